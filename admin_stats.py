@@ -0,0 +1,192 @@
+import argparse
+import json
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+
+# --- Dashboard Aggregates ---
+# Totals for the admin dashboard, kept up to date by triggers (migrations.py,
+# migration 12) inside every writing transaction: API routes, bulk imports,
+# expiry sweeps and repricing alike. Reading them costs a few rows per
+# service, whatever the number of users and subscriptions:
+#   * dashboard_totals: number of users;
+#   * service_stats: active / inactive subscriptions per service, and the
+#     billed price of the active ones (in cents, so that the running sums stay
+#     exact) plus how many of them have not been priced yet;
+#   * expiry_stats: active subscriptions per end_date and service, summed
+#     over the notice window for "expiring soon" and before today for the
+#     ones waiting for the next expiry sweep.
+# rebuild_stats() recomputes everything in one scan of user_services; the
+# command line checks the stored aggregates against it, or rebuilds them.
+#   python admin_stats.py --database extended_database.db [--check | --rebuild]
+
+def compute_stats(cursor):
+    """Aggregates recomputed from the base tables: (users, {service_id: row}, {(end_date, service_id): count})."""
+    users = cursor.execute("SELECT COUNT(*) FROM users;").fetchone()[0]
+    services = {}
+    expiry = {}
+    # One scan: inactive rows are grouped without their end_date, which does not matter for them.
+    cursor.execute('''
+        SELECT service_id, active IS 1, CASE WHEN active IS 1 THEN end_date END, COUNT(*),
+               COALESCE(SUM(CAST(ROUND(price * 100) AS INTEGER)), 0), SUM(price IS NULL)
+        FROM user_services GROUP BY 1, 2, 3;
+    ''')
+    for service_id, active, end_date, count, revenue_cents, unpriced in cursor.fetchall():
+        stats = services.setdefault(service_id, {'active': 0, 'inactive': 0, 'revenue_cents': 0, 'unpriced': 0})
+        if active:
+            stats['active'] += count
+            stats['revenue_cents'] += revenue_cents
+            stats['unpriced'] += unpriced
+            if end_date is not None:
+                expiry[(end_date, service_id)] = count
+        else:
+            stats['inactive'] += count
+    return users, services, expiry
+
+def stored_stats(cursor):
+    users = cursor.execute("SELECT users FROM dashboard_totals WHERE id = 1;").fetchone()[0]
+    services = {
+        service_id: {'active': active, 'inactive': inactive, 'revenue_cents': revenue_cents, 'unpriced': unpriced}
+        for service_id, active, inactive, revenue_cents, unpriced in cursor.execute(
+            "SELECT service_id, active, inactive, revenue_cents, unpriced FROM service_stats;")
+        if active or inactive # rows left at zero by deletions
+    }
+    expiry = {(end_date, service_id): active for end_date, service_id, active in cursor.execute(
+        "SELECT end_date, service_id, active FROM expiry_stats WHERE active <> 0;")}
+    return users, services, expiry
+
+def rebuild_stats(cursor):
+    """Replaces the stored aggregates with compute_stats(); run inside a write transaction."""
+    users, services, expiry = compute_stats(cursor)
+    cursor.execute("DELETE FROM service_stats;")
+    cursor.execute("DELETE FROM expiry_stats;")
+    cursor.execute("INSERT OR REPLACE INTO dashboard_totals (id, users) VALUES (1, ?);", (users,))
+    cursor.executemany(
+        "INSERT INTO service_stats (service_id, active, inactive, revenue_cents, unpriced) VALUES (?, ?, ?, ?, ?);",
+        [(service_id, s['active'], s['inactive'], s['revenue_cents'], s['unpriced']) for service_id, s in services.items()]
+    )
+    cursor.executemany("INSERT INTO expiry_stats (end_date, service_id, active) VALUES (?, ?, ?);",
+                       [(end_date, service_id, count) for (end_date, service_id), count in expiry.items()])
+    return {'users': users, 'services': len(services), 'expiry_dates': len({end_date for end_date, _ in expiry})}
+
+def check_stats(cursor):
+    """Differences between the stored aggregates and a recomputation, as a list of strings (empty = consistent)."""
+    expected_users, expected_services, expected_expiry = compute_stats(cursor)
+    users, services, expiry = stored_stats(cursor)
+    differences = []
+    if users != expected_users:
+        differences.append(f"users: stored {users}, expected {expected_users}")
+    for service_id in sorted(set(services) | set(expected_services)):
+        if services.get(service_id) != expected_services.get(service_id):
+            differences.append(f"service {service_id}: stored {services.get(service_id)}, "
+                               f"expected {expected_services.get(service_id)}")
+    for key in sorted(set(expiry) | set(expected_expiry)):
+        if expiry.get(key) != expected_expiry.get(key):
+            differences.append(f"expiry {key[0]} service {key[1]}: stored {expiry.get(key)}, "
+                               f"expected {expected_expiry.get(key)}")
+    return differences
+
+SUBSCRIPTION_COUNTS = ('active', 'inactive', 'expiring_soon', 'overdue', 'unpriced')
+
+def read_stats(conn, today=None, notice_days=7):
+    """Dashboard totals as served by GET /admin/stats."""
+    today = today or date.today().isoformat()
+    horizon = (date.fromisoformat(today) + timedelta(days=notice_days)).isoformat()
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    users = cursor.execute("SELECT users FROM dashboard_totals WHERE id = 1;").fetchone()[0]
+    # Every service is listed, with zeros when it has no subscriptions yet.
+    rows = cursor.execute('''
+        SELECT s.id, s.name, COALESCE(st.active, 0), COALESCE(st.inactive, 0),
+               COALESCE(st.revenue_cents, 0), COALESCE(st.unpriced, 0)
+        FROM services s LEFT JOIN service_stats st ON st.service_id = s.id ORDER BY s.id;
+    ''').fetchall()
+    expiring = dict(cursor.execute(
+        "SELECT service_id, SUM(active) FROM expiry_stats WHERE end_date BETWEEN ? AND ? GROUP BY service_id;",
+        (today, horizon)).fetchall())
+    overdue = dict(cursor.execute(
+        "SELECT service_id, SUM(active) FROM expiry_stats WHERE end_date < ? GROUP BY service_id;",
+        (today,)).fetchall())
+
+    services = [
+        {'service_id': service_id, 'name': name, 'active': active, 'inactive': inactive,
+         'expiring_soon': expiring.get(service_id, 0), 'overdue': overdue.get(service_id, 0),
+         'revenue': revenue_cents / 100, 'unpriced': unpriced}
+        for service_id, name, active, inactive, revenue_cents, unpriced in rows
+    ]
+    return {
+        'as_of': today,
+        'notice_days': notice_days,
+        'users': users,
+        'subscriptions': {field: sum(s[field] for s in services) for field in SUBSCRIPTION_COUNTS},
+        'revenue': sum(row[4] for row in rows) / 100, # summed in cents and divided once, as in combine_stats()
+        'services': services,
+    }
+
+def combine_stats(results):
+    """read_stats() of every shard added up into the dashboard of the whole layout."""
+    # Revenues are added up in cents, like read_stats() does, and divided once.
+    services = {}
+    revenue_cents = {}
+    for result in results:
+        for service in result['services']:
+            total = services.setdefault(service['service_id'], {**service, **dict.fromkeys(SUBSCRIPTION_COUNTS, 0)})
+            for field in SUBSCRIPTION_COUNTS:
+                total[field] += service[field]
+            revenue_cents[service['service_id']] = (revenue_cents.get(service['service_id'], 0)
+                                                    + round(service['revenue'] * 100))
+    services = [services[service_id] for service_id in sorted(services)]
+    for service in services:
+        service['revenue'] = revenue_cents[service['service_id']] / 100
+    return {
+        'as_of': results[0]['as_of'],
+        'notice_days': results[0]['notice_days'],
+        'users': sum(result['users'] for result in results),
+        'subscriptions': {field: sum(s[field] for s in services) for field in SUBSCRIPTION_COUNTS},
+        'revenue': sum(revenue_cents.values()) / 100,
+        'services': services,
+    }
+
+# --- Command Line Interface ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show, check or rebuild the admin dashboard aggregates.")
+    parser.add_argument('--database', default='extended_database.db')
+    parser.add_argument('--check', action='store_true', help="Compare the stored aggregates with a recomputation")
+    parser.add_argument('--rebuild', action='store_true', help="Recompute the aggregates and store them")
+    parser.add_argument('--as-of', help="Date for the expiring/overdue counts (YYYY-MM-DD), defaults to today")
+    parser.add_argument('--notice-days', type=int, default=7)
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.database, isolation_level=None)
+    conn.execute("PRAGMA busy_timeout = 5000;")
+    try:
+        started = time.perf_counter()
+        if args.rebuild:
+            conn.execute("BEGIN IMMEDIATE;")
+            try:
+                result = rebuild_stats(conn.cursor())
+            except BaseException:
+                conn.execute("ROLLBACK;")
+                raise
+            conn.execute("COMMIT;")
+            print(json.dumps({**result, 'seconds': round(time.perf_counter() - started, 3)}))
+        elif args.check:
+            conn.execute("BEGIN;") # one read snapshot for both sides of the comparison
+            try:
+                differences = check_stats(conn.cursor())
+            finally:
+                conn.execute("ROLLBACK;")
+            for difference in differences:
+                print(difference)
+            print(f"{len(differences)} differences ({time.perf_counter() - started:.2f}s).")
+            return 1 if differences else 0
+        else:
+            print(json.dumps(read_stats(conn, args.as_of, args.notice_days), indent=2))
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,93 +1,768 @@
 
 import sqlite3
+import base64
+import heapq
+import hmac
+import io
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
-from flask import Flask, jsonify, request, g
-import bcrypt # Import bcrypt for password hashing
+from itertools import islice
+from operator import itemgetter
+from flask import Flask, jsonify, request, g, Response, stream_with_context, has_request_context
+from werkzeug.middleware.proxy_fix import ProxyFix
+from passwords import DEFAULT_ROUNDS, PasswordPoolBusy, get_hasher
+from db_pool import DEFAULT_PRAGMAS, PoolTimeout, get_pool_set, open_connection
+from catalog_cache import CatalogCache
+from bulk_import import DEFAULT_CHUNK_SIZE, import_users, iter_records
+from profiler import SamplingProfiler
+from expiry import ExpiryScheduler
+from change_feed import ChangeNotifier, fetch_changes, format_sse
+from login_guard import LoginGuard, LoginRateLimited
+from migrations import ensure_schema as migrate_database
+from session_tokens import DELETED, EpochCache, InvalidSession, TokenSigner
+from snapshots import SnapshotManager
+from group_commit import GroupCommitWriter
+from sharding import (SUBSCRIPTION_INSERT, ShardSet, allocate_user_id, lookup_user_id, release_user_id, rename_user,
+                      shard_paths)
+from admin_stats import combine_stats, read_stats
+from serialization import (COMPRESSIBLE_MIMETYPES, FastJSONProvider, accepted_encoding, compress, fetch_record,
+                           fetch_records, parse_fields, select_list, to_records, tuple_cursor)
+import archive
+import metrics
+import tickets
 
 app = Flask(__name__)
 app.config['DATABASE'] = 'extended_database.db'
+app.config['AUTO_MIGRATE'] = True # apply pending schema migrations on first use of a database
+app.config['USERS_PAGE_DEFAULT_LIMIT'] = 100
+app.config['USERS_PAGE_MAX_LIMIT'] = 1000
+app.config['EXPORT_FETCH_SIZE'] = 500
+app.config['SEARCH_DEFAULT_LIMIT'] = 20
+app.config['SEARCH_MAX_LIMIT'] = 100
+app.config['SUBSCRIPTIONS_PAGE_DEFAULT_LIMIT'] = 50 # users per page of GET /subscriptions
+app.config['SUBSCRIPTIONS_PAGE_MAX_LIMIT'] = 500
+app.config['SUBSCRIPTIONS_BATCH_MAX_IDS'] = 1000
+app.config['DB_READ_POOL_SIZE'] = 4
+app.config['DB_POOL_TIMEOUT'] = 5.0 # seconds to wait for a free connection
+app.config['DB_PRAGMAS'] = dict(DEFAULT_PRAGMAS)
+app.config['BCRYPT_ROUNDS'] = DEFAULT_ROUNDS
+app.config['PASSWORD_POOL_WORKERS'] = None # None = half the CPUs
+app.config['PASSWORD_POOL_MAX_PENDING'] = 64
+app.config['BULK_IMPORT_CHUNK_SIZE'] = DEFAULT_CHUNK_SIZE
+app.config['BULK_IMPORT_REPORT_MAX_ROWS'] = 1000 # rows detailed in the response, the rest are only counted
+app.config['CATALOG_REVALIDATE_SECONDS'] = 1.0
+app.config['CATALOG_CACHE_MAX_AGE'] = 60 # Cache-Control max-age sent with /services
+app.config['SLOW_QUERY_SECONDS'] = 0.1
+app.config['EXPIRY_SCHEDULER_ENABLED'] = True # started with the first request
+app.config['EXPIRY_SWEEP_INTERVAL'] = 3600.0
+app.config['EXPIRY_NOTICE_DAYS'] = 7
+app.config['EXPIRY_BATCH_SIZE'] = 500
+app.config['CHANGES_PAGE_DEFAULT_LIMIT'] = 100
+app.config['CHANGES_PAGE_MAX_LIMIT'] = 1000
+app.config['CHANGES_MAX_WAIT'] = 30.0 # longest long-poll, in seconds
+app.config['CHANGES_POLL_INTERVAL'] = 1.0 # re-check for writes made by other processes
+app.config['CHANGES_HEARTBEAT_SECONDS'] = 15.0 # SSE keep-alive comment
+app.config['LOGIN_GUARD_ENABLED'] = True
+app.config['LOGIN_IP_RATE'] = 1.0 # login attempts per second and client IP (sustained)
+app.config['LOGIN_IP_BURST'] = 20
+app.config['LOGIN_ACCOUNT_RATE'] = 0.2 # per account
+app.config['LOGIN_ACCOUNT_BURST'] = 5
+app.config['LOGIN_FAILURE_LIMIT'] = 10 # failed logins per account, client IP and window before lockout
+app.config['LOGIN_FAILURE_WINDOW'] = 900.0
+app.config['LOGIN_NEGATIVE_CACHE_TTL'] = 60.0 # seconds an unknown email is remembered
+app.config['LOGIN_GUARD_MAX_KEYS'] = 100000 # per structure, least recently used evicted first
+# Reverse proxies in front of the app: the client IP (login limits) is then read from X-Forwarded-For.
+# Applied at import, like the other environment settings; 0 = REMOTE_ADDR is the client.
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+app.config['SESSION_SECRET'] = os.environ.get('SESSION_SECRET') # HMAC key, shared by every worker process
+app.config['SESSION_TOKEN_TTL'] = 3600 # seconds a token issued by /login stays valid
+app.config['SESSION_AUTH_REQUIRED'] = True # profile and subscription routes need the user's token
+app.config['SESSION_EPOCH_CACHE_TTL'] = 30.0 # revocations by other processes are seen within this delay
+app.config['SESSION_EPOCH_CACHE_MAX_KEYS'] = 100000
+app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN') # X-Admin-Token of the /admin routes; unset = they answer 403
+app.config['JSON_ENCODER'] = 'auto' # orjson when installed, else the stdlib encoder (see serialization.py)
+app.config['COMPRESSION_MIN_SIZE'] = 2048 # bytes; smaller JSON bodies are sent as is
+app.config['COMPRESSION_LEVEL'] = 5 # gzip level / brotli quality
+app.config['GROUP_COMMIT_ENABLED'] = False # request writes go through one writer thread, committed in batches;
+# only pays off when commits are expensive (synchronous = FULL), see benchmarks/README.md
+app.config['GROUP_COMMIT_MAX_BATCH'] = 64 # mutations per transaction
+app.config['GROUP_COMMIT_MAX_DELAY'] = 0.002 # seconds the writer may wait for more mutations during a burst
+app.config['SNAPSHOT_READS_ENABLED'] = False # serve reporting reads from periodically copied snapshots
+app.config['SNAPSHOT_REPLICAS'] = 1
+app.config['SNAPSHOT_INTERVAL'] = 30.0 # seconds between refreshes of each replica
+app.config['SNAPSHOT_REFRESH_COMMITS'] = 1000 # refresh early after this many writes (0 = on the interval only)
+app.config['SNAPSHOT_MAX_STALENESS'] = 60.0 # older snapshots are bypassed; X-Max-Staleness can only lower it
+app.config['SNAPSHOT_DIRECTORY'] = None # default: <DATABASE>.snapshots
+app.config['SHARDS'] = 0 # users and subscriptions spread over this many files (0 = all in DATABASE), see sharding.py
+app.config['SHARD_DIRECTORY'] = None # default: <DATABASE>.shards
+app.config['TICKETS_QUEUE_DEFAULT_LIMIT'] = 20
+app.config['TICKETS_QUEUE_MAX_LIMIT'] = 200
+app.config['TICKETS_BULK_MAX_IDS'] = 1000 # tickets per bulk assign/close
+app.config['ARCHIVE_DATABASE'] = None # default: <DATABASE>.archive
+app.config['ARCHIVE_AFTER_DAYS'] = 90 # inactive subscriptions ended longer ago than this are archived
+app.config['ARCHIVE_BATCH_SIZE'] = 500
+app.config['ARCHIVE_VACUUM_STEP'] = 1000 # pages released per incremental vacuum transaction
+
+app.json = FastJSONProvider(app, app.config['JSON_ENCODER'])
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
+catalog_cache = CatalogCache(app.config['CATALOG_REVALIDATE_SECONDS'], app.json.encode)
+profiler = SamplingProfiler()
+session_epochs = EpochCache(app.config['SESSION_EPOCH_CACHE_TTL'], app.config['SESSION_EPOCH_CACHE_MAX_KEYS'])
+# Own connections per sweep (one per shard): it commits batch by batch and must not hold the pooled writer.
+expiry_scheduler = ExpiryScheduler(lambda: [open_connection(database, app.config['DB_PRAGMAS'])
+                                            for database in user_databases()],
+                                   app.config['EXPIRY_SWEEP_INTERVAL'], app.config['EXPIRY_NOTICE_DAYS'],
+                                   app.config['EXPIRY_BATCH_SIZE'])
+change_notifier = ChangeNotifier()
+expiry_scheduler.add_listener(lambda event: change_notifier.notify())
 
 # --- Database Connection Management ---
 
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_migrated_databases = set()
+_migrate_lock = threading.Lock()
+
+def ensure_schema():
+    # Once per database and process; when the schema is current this is a single PRAGMA user_version read.
+    database = app.config['DATABASE']
+    if database in _migrated_databases or not app.config['AUTO_MIGRATE']:
+        return
+    with _migrate_lock:
+        if database not in _migrated_databases:
+            migrate_database(database)
+            _migrated_databases.add(database)
+
+def get_pools():
+    ensure_schema()
+    # Pooled connections are instrumented: statement counts (trace callback) and timings feed /metrics.
+    return get_pool_set(app.config['DATABASE'], app.config['DB_READ_POOL_SIZE'], app.config['DB_PRAGMAS'],
+                        factory=metrics.InstrumentedConnection, trace=metrics.trace_statement)
+
 def get_db():
+    # Read-only requests borrow a reader connection, everything else the single writer.
     db = getattr(g, '_database', None)
+    if db is None and has_request_context() and request.method in READ_METHODS:
+        db = acquire_snapshot()
     if db is None:
-        db = g._database = sqlite3.connect(app.config['DATABASE'])
-        db.row_factory = sqlite3.Row # This makes rows behave like dicts
-        db.execute("PRAGMA foreign_keys = ON;")
+        pools = get_pools()
+        pool = pools.readers if has_request_context() and request.method in READ_METHODS else pools.writer
+        db = pool.acquire(timeout=app.config['DB_POOL_TIMEOUT'])
+        g._database = db
+        g._database_pool = pool
     return db
 
+@contextmanager
+def writer_connection():
+    # Short-lived writer checkout, independent of the request's own connection.
+    pool = get_pools().writer
+    conn = pool.acquire(timeout=app.config['DB_POOL_TIMEOUT'])
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+@contextmanager
+def reader_connection():
+    # Short-lived reader checkout, for streaming responses that outlive get_db().
+    pool = get_pools().readers
+    conn = pool.acquire(timeout=app.config['DB_POOL_TIMEOUT'])
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+_group_writer = None
+_group_writer_database = None
+_group_writer_lock = threading.Lock()
+
+def get_group_writer():
+    # Built from app.config on first use (one per database), None when disabled.
+    global _group_writer, _group_writer_database
+    if not app.config['GROUP_COMMIT_ENABLED']:
+        return None
+    database = app.config['DATABASE']
+    with _group_writer_lock:
+        if _group_writer is None or _group_writer_database != database:
+            ensure_schema()
+            if _group_writer is not None:
+                _group_writer.stop()
+            _group_writer = GroupCommitWriter(
+                lambda: open_connection(database, app.config['DB_PRAGMAS'], factory=metrics.InstrumentedConnection,
+                                        trace=metrics.trace_statement),
+                app.config['GROUP_COMMIT_MAX_BATCH'], app.config['GROUP_COMMIT_MAX_DELAY'])
+            _group_writer_database = database
+        return _group_writer
+
+def run_write(fn, *args):
+    # fn(conn, *args) in a write transaction, committed before returning: batched with the
+    # concurrent writes by the group-commit writer, or on the request's writer connection.
+    writer = get_group_writer()
+    if writer is not None:
+        return writer.execute(fn, *args, timeout=app.config['DB_POOL_TIMEOUT'])
+    conn = get_db()
+    try:
+        result = fn(conn, *args)
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    return result
+
+def fetch_one(conn, query, params=()):
+    # Single-statement mutation for run_write(), e.g. UPDATE ... RETURNING id.
+    return conn.execute(query, params).fetchone()
+
+def release_db():
+    # Give the connection back early, e.g. before slow non-database work.
+    db = g.pop('_database', None)
+    if db is not None:
+        g.pop('_database_pool').release(db)
+    for conn, pool in g.pop('_shard_connections', {}).values():
+        pool.release(conn)
+
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
-    if db is not None:
-        db.close()
+    release_db()
+
+# --- Sharded Storage ---
+
+_shards = None
+_shards_lock = threading.Lock()
+
+def get_shards():
+    # Built from app.config on first use, None when users live in DATABASE.
+    global _shards
+    if not app.config['SHARDS']:
+        return None
+    with _shards_lock:
+        if _shards is None or (_shards.database, _shards.count) != (app.config['DATABASE'], app.config['SHARDS']):
+            ensure_schema()
+            if _shards is not None:
+                _shards.close()
+            group_commit = None
+            if app.config['GROUP_COMMIT_ENABLED']:
+                group_commit = (app.config['GROUP_COMMIT_MAX_BATCH'], app.config['GROUP_COMMIT_MAX_DELAY'])
+            _shards = ShardSet(app.config['DATABASE'], app.config['SHARDS'], app.config['SHARD_DIRECTORY'],
+                               app.config['DB_READ_POOL_SIZE'], app.config['DB_PRAGMAS'], group_commit,
+                               factory=metrics.InstrumentedConnection, trace=metrics.trace_statement)
+    # The shards' copies of the services table follow the catalog, checked as often as the catalog cache.
+    if _shards.catalog_due(app.config['CATALOG_REVALIDATE_SECONDS']):
+        with reader_connection() as conn:
+            catalog = catalog_cache.get(conn)
+        _shards.sync_catalog(catalog.version, catalog.services, app.config['DB_POOL_TIMEOUT'])
+    return _shards
+
+def user_databases():
+    # Files holding users and subscriptions: the shards, or DATABASE itself.
+    if app.config['SHARDS']:
+        return shard_paths(app.config['DATABASE'], app.config['SHARDS'], app.config['SHARD_DIRECTORY'])
+    return [app.config['DATABASE']]
+
+def user_db(user_id):
+    # Connection for reading this user's rows: get_db(), or a reader of the user's shard kept until teardown.
+    shards = get_shards()
+    if shards is None:
+        return get_db()
+    index = shards.index(user_id)
+    held = g.setdefault('_shard_connections', {})
+    if index not in held:
+        pool = shards.pools[index].readers
+        held[index] = (pool.acquire(timeout=app.config['DB_POOL_TIMEOUT']), pool)
+    return held[index][0]
+
+def run_user_write(user_id, fn, *args):
+    # run_write() on the database holding this user's rows.
+    shards = get_shards()
+    if shards is None:
+        return run_write(fn, *args)
+    return shards.write(shards.index(user_id), fn, *args, timeout=app.config['DB_POOL_TIMEOUT'])
+
+def fetch_rows(conn, query, params=()):
+    return tuple_cursor(conn).execute(query, params).fetchall()
+
+SINGLE_DATABASE_ONLY = 'Not available with sharded storage (SHARDS)'
+
+def single_database_only():
+    # Response of the features that still expect every user in DATABASE.
+    return jsonify({'message': SINGLE_DATABASE_ONLY}), 409
+
+# --- Read Snapshots ---
+
+# Reporting reads that tolerate a bounded delay; everything else (sessions, the catalog
+# version, the change feed, profile reads after a write) stays on the primary.
+SNAPSHOT_ENDPOINTS = {'api_get_all_users', 'api_search_users', 'api_get_subscriptions_batch'}
+
+_snapshots = None
+_snapshots_lock = threading.Lock()
+
+def get_snapshots():
+    # Built from app.config on first use, None when disabled.
+    global _snapshots
+    if not app.config['SNAPSHOT_READS_ENABLED'] or app.config['SHARDS']:
+        return None # reporting reads on shards are spread over the shards' own readers
+    with _snapshots_lock:
+        if _snapshots is None:
+            ensure_schema()
+            _snapshots = SnapshotManager(
+                app.config['DATABASE'], app.config['SNAPSHOT_DIRECTORY'], app.config['SNAPSHOT_REPLICAS'],
+                app.config['SNAPSHOT_INTERVAL'], app.config['SNAPSHOT_REFRESH_COMMITS'],
+                app.config['DB_READ_POOL_SIZE'], app.config['DB_PRAGMAS'],
+                factory=metrics.InstrumentedConnection, trace=metrics.trace_statement)
+        return _snapshots
+
+def snapshot_staleness(max_staleness_header):
+    # The configured bound, lowered by an X-Max-Staleness request header (seconds; 0 = primary only).
+    bound = app.config['SNAPSHOT_MAX_STALENESS']
+    try:
+        return min(bound, max(0.0, float(max_staleness_header))) if max_staleness_header else bound
+    except ValueError:
+        return bound
+
+def acquire_snapshot():
+    # Connection to a fresh enough snapshot for the current request, or None for the primary.
+    if request.endpoint not in SNAPSHOT_ENDPOINTS:
+        return None
+    snapshots = get_snapshots()
+    if snapshots is None:
+        return None
+    acquired = snapshots.acquire(snapshot_staleness(request.headers.get('X-Max-Staleness')),
+                                 app.config['DB_POOL_TIMEOUT'])
+    if acquired is None:
+        g._snapshot_age = 0.0 # served by the primary
+        return None
+    conn, snapshot = acquired
+    g._database = conn
+    g._database_pool = snapshots
+    g._snapshot_age = snapshot.age
+    return conn
+
+@app.after_request
+def report_snapshot_age(response):
+    age = g.pop('_snapshot_age', None)
+    if age is not None:
+        response.headers['X-Snapshot-Age'] = f'{age:.3f}'
+    return response
+
+# --- Background Jobs ---
+
+@app.before_request
+def start_background_jobs():
+    if app.config['EXPIRY_SCHEDULER_ENABLED'] and not expiry_scheduler.running:
+        ensure_schema()
+        expiry_scheduler.start()
+    snapshots = get_snapshots()
+    if snapshots is not None and not snapshots.running:
+        snapshots.start()
+
+@app.after_request
+def compress_response(response):
+    # br/gzip for large JSON (and Prometheus text) bodies. Streamed responses are left alone, and so
+    # are responses with an ETag, whose validators must keep matching the uncompressed body.
+    if (response.is_streamed or response.direct_passthrough or response.status_code < 200
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers or 'ETag' in response.headers):
+        return response
+    body = response.get_data()
+    if len(body) < app.config['COMPRESSION_MIN_SIZE']:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is not None:
+        response.set_data(compress(body, encoding, app.config['COMPRESSION_LEVEL']))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.after_request
+def notify_change_consumers(response):
+    # Wake long-polling /changes consumers; the triggers have already written the outbox rows.
+    if request.method not in READ_METHODS and response.status_code < 400:
+        change_notifier.notify()
+        if _snapshots is not None:
+            _snapshots.record_commit()
+    return response
+
+# --- Request Instrumentation ---
+
+@app.before_request
+def start_request_metrics():
+    g._request_started = time.perf_counter()
+    metrics.slow_query_threshold = app.config['SLOW_QUERY_SECONDS']
+    metrics.begin_request()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('_request_started', None)
+    stats = metrics.end_request()
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.http_request_duration.observe(time.perf_counter() - started, route=route, method=request.method)
+        metrics.http_requests.inc(route=route, method=request.method, status=response.status_code)
+        if stats is not None:
+            metrics.sql_statements_per_request.observe(stats.statements, route=route)
+            metrics.sql_seconds_per_request.observe(stats.sql_seconds, route=route)
+    return response
+
+class NotFoundError(Exception):
+    pass
+
+class ConflictError(Exception):
+    pass
+
+class ForbiddenError(Exception):
+    pass
+
+@app.errorhandler(NotFoundError)
+def handle_not_found(e):
+    return jsonify({'message': str(e)}), 404
+
+@app.errorhandler(ConflictError)
+def handle_conflict(e):
+    return jsonify({'message': str(e)}), 409
+
+@app.errorhandler(ForbiddenError)
+def handle_forbidden(e):
+    return jsonify({'message': str(e)}), 403
+
+@app.errorhandler(InvalidSession)
+def handle_invalid_session(e):
+    return jsonify({'message': str(e)}), 401, {'WWW-Authenticate': 'Bearer'}
+
+@app.errorhandler(PoolTimeout)
+def handle_pool_timeout(e):
+    return jsonify({'message': 'Database busy, please retry'}), 503
+
+@app.errorhandler(LoginRateLimited)
+def handle_login_rate_limited(e):
+    retry_after = max(1, int(e.retry_after + 0.999))
+    return jsonify({'message': 'Too many login attempts, please retry later'}), 429, {'Retry-After': str(retry_after)}
+
+@app.errorhandler(PasswordPoolBusy)
+def handle_password_pool_busy(e):
+    return jsonify({'message': 'Too many authentication requests, please retry'}), 503, {'Retry-After': '1'}
 
 # --- Utility Functions ---
 
+def get_password_hasher():
+    return get_hasher(app.config['BCRYPT_ROUNDS'], app.config['PASSWORD_POOL_WORKERS'],
+                      app.config['PASSWORD_POOL_MAX_PENDING'])
+
 def hash_password(password):
-    # Hash a password for storing in the database.
-    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-    return hashed.decode('utf-8') # Store as UTF-8 string
+    # Hash a password for storing in the database (runs in the password worker pool).
+    started = time.perf_counter()
+    try:
+        return get_password_hasher().hash(password)
+    finally:
+        metrics.password_duration.observe(time.perf_counter() - started, operation='hash')
 
 def verify_password(hashed_password, provided_password):
-    # Verify a plain-text password against a hashed password.
-    return bcrypt.checkpw(provided_password.encode('utf-8'), hashed_password.encode('utf-8'))
+    # Verify a plain-text password against a hashed password (runs in the password worker pool).
+    started = time.perf_counter()
+    try:
+        return get_password_hasher().verify(hashed_password, provided_password)
+    finally:
+        metrics.password_duration.observe(time.perf_counter() - started, operation='verify')
+
+_login_guard = None
+
+def get_login_guard():
+    # Built from app.config on first use, None when disabled.
+    global _login_guard
+    if not app.config['LOGIN_GUARD_ENABLED']:
+        return None
+    if _login_guard is None:
+        _login_guard = LoginGuard(
+            app.config['LOGIN_IP_RATE'], app.config['LOGIN_IP_BURST'], app.config['LOGIN_ACCOUNT_RATE'],
+            app.config['LOGIN_ACCOUNT_BURST'], app.config['LOGIN_FAILURE_LIMIT'], app.config['LOGIN_FAILURE_WINDOW'],
+            app.config['LOGIN_NEGATIVE_CACHE_TTL'], app.config['LOGIN_GUARD_MAX_KEYS'])
+    return _login_guard
+
+def forget_missing_emails(emails):
+    guard = _login_guard
+    if guard is not None:
+        guard.forget_missing(emails)
+
+_token_signer = None
+
+def get_token_signer():
+    global _token_signer
+    if _token_signer is None:
+        secret = app.config['SESSION_SECRET']
+        if not secret:
+            # Tokens would then only be accepted by this process.
+            print("SESSION_SECRET is not set, session tokens are signed with a random per-process key.")
+            secret = secrets.token_bytes(32)
+        _token_signer = TokenSigner(secret, app.config['SESSION_TOKEN_TTL'])
+    return _token_signer
+
+def issue_session(user_id, epoch):
+    signer = get_token_signer()
+    return {'token': signer.issue(user_id, epoch), 'token_type': 'Bearer', 'expires_in': signer.ttl}
+
+def read_session(authorization):
+    # Returns (user_id, epoch) from an "Authorization: Bearer <token>" header; raises InvalidSession.
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        raise InvalidSession('Authentication required')
+    return get_token_signer().verify(token.strip())
+
+def load_token_epoch(conn, user_id):
+    row = conn.execute("SELECT token_epoch FROM users WHERE id = ?;", (user_id,)).fetchone()
+    return row[0] if row is not None else DELETED
+
+def bump_token_epoch(conn, user_id):
+    # Mutation (see run_write): returns the new epoch, None for an unknown user.
+    row = conn.execute("UPDATE users SET token_epoch = token_epoch + 1 WHERE id = ? RETURNING token_epoch;",
+                       (user_id,)).fetchone()
+    return row[0] if row is not None else None
+
+def revoke_sessions(user_id):
+    # Revokes every token of the user; returns the new epoch, None for an unknown user.
+    epoch = run_user_write(user_id, bump_token_epoch, user_id)
+    session_epochs.set(user_id, epoch if epoch is not None else DELETED)
+    return epoch
+
+def current_token_epoch(user_id):
+    epoch = session_epochs.get(user_id)
+    if epoch is None:
+        epoch = load_token_epoch(user_db(user_id), user_id)
+        session_epochs.set(user_id, epoch)
+    return epoch
+
+def require_session(user_id):
+    # Profile and subscription routes: the token is checked in memory, the epoch comes from the cache.
+    if not app.config['SESSION_AUTH_REQUIRED']:
+        return
+    token_user_id, epoch = read_session(request.headers.get('Authorization'))
+    if token_user_id != user_id:
+        raise ForbiddenError('Session token does not belong to this user')
+    if epoch != current_token_epoch(user_id):
+        raise InvalidSession('Session revoked')
+
+def check_admin_token(supplied):
+    # Raises ForbiddenError while ADMIN_TOKEN is unset, InvalidSession when `supplied` does not match it.
+    expected = app.config['ADMIN_TOKEN']
+    if not expected:
+        raise ForbiddenError('Admin routes are disabled: ADMIN_TOKEN is not set')
+    if not hmac.compare_digest((supplied or '').encode('utf-8'), expected.encode('utf-8')):
+        raise InvalidSession('Admin token required')
+
+def require_admin():
+    # Routes outside /admin that read every user's data (batch subscriptions, change feed).
+    check_admin_token(request.headers.get('X-Admin-Token'))
+
+@app.before_request
+def require_admin_token():
+    # Every /admin route (customer data, tickets, archive, jobs) needs the shared ADMIN_TOKEN.
+    if request.path.startswith('/admin/'):
+        require_admin()
+
+_dummy_hash = None
+
+def simulate_password_check(guard):
+    # Unknown email: take as long as a real bcrypt verify, without the CPU cost once the duration is known.
+    global _dummy_hash
+    if guard.verify_seconds is not None:
+        time.sleep(guard.verify_seconds)
+        return
+    if _dummy_hash is None:
+        _dummy_hash = hash_password('not-a-real-password')
+    started = time.perf_counter()
+    verify_password(_dummy_hash, 'wrong-password')
+    guard.observe_verify(time.perf_counter() - started)
+
+def encode_cursor(last_id):
+    # Opaque pagination token: clients must not rely on its content.
+    raw = json.dumps({'after_id': last_id}).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(token):
+    # Raises ValueError on any malformed token.
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return int(data['after_id'])
+    except (TypeError, KeyError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+def check_date(value, name):
+    # Dates are stored and compared as TEXT: only the canonical YYYY-MM-DD form sorts correctly.
+    try:
+        valid = datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d') == value
+    except (TypeError, ValueError):
+        valid = False
+    if not valid:
+        raise ValueError(f"{name} must be YYYY-MM-DD")
+
+def parse_page_args(default_limit, max_limit, args=None):
+    # Reads ?limit= and ?after= from the query string (or the given mapping), returns (limit, after_id).
+    args = request.args if args is None else args
+    limit = args.get('limit', default_limit)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError("limit must be an integer")
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    limit = min(limit, max_limit)
+
+    after = args.get('after')
+    after_id = decode_cursor(after) if after else 0
+    return limit, after_id
 
 # --- User Management Functions (Interacting with 'users' table) ---
 
+def insert_user(conn, email, hashed_pass, first_name, last_name, user_id=None):
+    # user_id None = next id of the table
+    return conn.execute(
+        "INSERT INTO users (id, email, password, first_name, last_name) VALUES (?, ?, ?, ?, ?) RETURNING id;",
+        (user_id, email, hashed_pass, first_name, last_name)
+    ).fetchone()[0]
+
 def add_user(email, password, first_name, last_name):
-    conn = get_db()
-    cursor = conn.cursor())
+    # Hash before queuing the write so bcrypt never holds the writer.
+    hashed_pass = hash_password(password)
     try:
-        hashed_pass = hash_password(password)
-        cursor.execute(
-            "INSERT INTO users (email, password, first_name, last_name) VALUES (?, ?, ?, ?);",
-            (email, hashed_pass, first_name, last_name)
-        )
-        conn.commit()
-        return cursor.lastrowid
+        if get_shards() is None:
+            user_id = run_write(insert_user, email, hashed_pass, first_name, last_name)
+        else:
+            # The directory on DATABASE hands out the id and keeps the email unique across shards.
+            user_id = run_write(allocate_user_id, email)
+            try:
+                run_user_write(user_id, insert_user, email, hashed_pass, first_name, last_name, user_id)
+            except BaseException:
+                run_write(release_user_id, user_id)
+                raise
     except sqlite3.IntegrityError:
         # Handles UNIQUE constraint violation for email
         return None # User with this email already exists
     except sqlite3.Error as e:
         print(f"Database error adding user: {e}")
         return None
+    forget_missing_emails([email])
+    return user_id
 
-def get_user_by_id(user_id):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, email, first_name, last_name FROM users WHERE id = ?;", (user_id,))
-    return cursor.fetchone()
+# Fields selectable with ?fields= (pushed down to the SELECT list)
+USER_FIELDS = ('id', 'email', 'first_name', 'last_name')
+
+def get_user_by_id(user_id, fields=USER_FIELDS):
+    return fetch_record(user_db(user_id), f"SELECT {', '.join(fields)} FROM users WHERE id = ?;", (user_id,))
 
 def get_user_by_email(email):
     conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, email, password, first_name, last_name FROM users WHERE email = ?;", (email,))
-    return cursor.fetchone()
+    query = "SELECT id, email, password, first_name, last_name, token_epoch FROM users WHERE {} = ?;"
+    if get_shards() is None:
+        return conn.execute(query.format('email'), (email,)).fetchone()
+    user_id = lookup_user_id(conn, email)
+    if user_id is None:
+        return None
+    return user_db(user_id).execute(query.format('id'), (user_id,)).fetchone()
 
-def search_users(email=None, first_name=None, last_name=None):
-    conn = get_db()
-    cursor = conn.cursor()
-    query = "SELECT id, email, first_name, last_name FROM users WHERE 1=1"
+def users_rows(conn, after_id=0, limit=100, fields=USER_FIELDS):
+    # Keyset pagination on the primary key: constant cost whatever the page depth.
+    # The id is always read last, for the cursor, but only returned if requested.
+    cursor = tuple_cursor(conn)
+    cursor.execute(f"SELECT {', '.join(fields)}, id FROM users WHERE id > ? ORDER BY id LIMIT ?;", (after_id, limit))
+    return cursor.fetchall()
+
+def users_page(conn, after_id=0, limit=100, fields=USER_FIELDS):
+    # Returns (users, last_id)
+    rows = users_rows(conn, after_id, limit, fields)
+    return to_records(fields, rows), rows[-1][-1] if rows else None
+
+def get_users_page(after_id=0, limit=100, fields=USER_FIELDS):
+    shards = get_shards()
+    if shards is None:
+        return users_page(get_db(), after_id, limit, fields)
+    # Each shard returns its first `limit` users after the cursor; the page keeps the lowest ids of all.
+    rows = list(islice(heapq.merge(*shards.broadcast(users_rows, after_id, limit, fields,
+                                                     timeout=app.config['DB_POOL_TIMEOUT']),
+                                   key=itemgetter(-1)), limit))
+    return to_records(fields, rows), rows[-1][-1] if rows else None
+
+def iter_all_users(fetch_size=500, fields=USER_FIELDS):
+    # Yields lists of at most fetch_size users without materializing the whole table.
+    if get_shards() is not None:
+        # Merged keyset pages: no shard connection is held between two chunks.
+        users, last_id = get_users_page(0, fetch_size, fields)
+        while users:
+            yield users
+            if len(users) < fetch_size:
+                break
+            users, last_id = get_users_page(last_id, fetch_size, fields)
+        return
+    cursor = tuple_cursor(get_db())
+    cursor.execute(f"SELECT {', '.join(fields)} FROM users ORDER BY id;")
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            break
+        yield to_records(fields, rows)
+
+def fts_quote(term):
+    # Quote a user term as an FTS5 string so operators in it are taken literally.
+    return '"' + term.replace('"', '""') + '"'
+
+def build_search_query(email=None, first_name=None, last_name=None, limit=20, offset=0, fields=USER_FIELDS,
+                       sort_keys=False):
+    # Returns (query, params); shared by search_users and the ASGI entry point.
+    # sort_keys appends the ORDER BY values (rank, id) to each row, to merge results from several shards.
+    columns = ', '.join(f'u.{field}' for field in fields)
+    match_terms = []
+    filters = []
     params = []
 
-    if email:
-        query += " AND email LIKE ?"
-        params.append(f'%{email}%')
-    if first_name:
-        query += " AND first_name LIKE ?"
-        params.append(f'%{first_name}%')
-    if last_name:
-        query += " AND last_name LIKE ?"
-        params.append(f'%{last_name}%')
-
-    cursor.execute(query, params)
-    return cursor.fetchall()
+    for column, value in (('email', email), ('first_name', first_name), ('last_name', last_name)):
+        if not value:
+            continue
+        if len(value) >= 3:
+            match_terms.append(f"{column} : {fts_quote(value)}")
+        else:
+            # Trigrams need at least 3 characters; shorter terms only narrow the indexed matches.
+            filters.append(f"u.{column} LIKE ?")
+            params.append(f'%{value}%')
+
+    if match_terms:
+        if sort_keys:
+            columns += ", users_fts.rank, u.id"
+        query = (
+            f"SELECT {columns} FROM users_fts "
+            "JOIN users u ON u.id = users_fts.rowid WHERE users_fts MATCH ?"
+        )
+        params.insert(0, ' AND '.join(match_terms))
+        if filters:
+            query += " AND " + " AND ".join(filters)
+        query += " ORDER BY users_fts.rank, u.id LIMIT ? OFFSET ?;"
+    else:
+        if sort_keys:
+            columns += ", 0, u.id"
+        query = f"SELECT {columns} FROM users u"
+        if filters:
+            query += " WHERE " + " AND ".join(filters)
+        query += " ORDER BY u.id LIMIT ? OFFSET ?;"
+    params.extend([limit, offset])
+    return query, params
+
+def search_users(email=None, first_name=None, last_name=None, limit=20, offset=0, fields=USER_FIELDS):
+    shards = get_shards()
+    if shards is None:
+        return fetch_records(get_db(), *build_search_query(email, first_name, last_name, limit, offset, fields))
+    # Every shard returns its best offset + limit matches, merged on (rank, id). FTS ranks (bm25) use
+    # each shard's own statistics: close to, but not always exactly, the single-database order.
+    query, params = build_search_query(email, first_name, last_name, offset + limit, 0, fields, sort_keys=True)
+    rows = heapq.merge(*shards.broadcast(fetch_rows, query, params, timeout=app.config['DB_POOL_TIMEOUT']),
+                       key=lambda row: row[-2:])
+    return to_records(fields, islice(rows, offset, offset + limit))
 
 def update_user(user_id, email=None, first_name=None, last_name=None, new_password=None):
-    conn = get_db()
-    cursor = conn.cursor()
+    # Returns True when updated, False if there was nothing to update.
+    # Raises NotFoundError for an unknown user and ConflictError for a duplicate email.
     updates = []
     params = []
 
@@ -108,136 +783,255 @@ def update_user(user_id, email=None, first_name=None, last_name=None, new_passwo
     if not updates:
         return False # Nothing to update
 
-    query = f"UPDATE users SET {', '.join(updates)} WHERE id = ?;"
+    query = f"UPDATE users SET {', '.join(updates)} WHERE id = ? RETURNING id;"
     params.append(user_id)
 
+    previous_email = None
     try:
-        cursor.execute(query, params)
-        conn.commit()
-        return cursor.rowcount > 0 # Returns True if a row was updated
+        if email is not None and get_shards() is not None:
+            # The directory takes the email first, so that it stays unique across shards.
+            previous_email = run_write(rename_user, user_id, email)
+            if previous_email is None:
+                raise NotFoundError('User not found')
+        try:
+            updated = run_user_write(user_id, fetch_one, query, params)
+        except Exception:
+            if previous_email is not None:
+                run_write(rename_user, user_id, previous_email)
+            raise
     except sqlite3.IntegrityError:
         # Handles UNIQUE constraint violation for email during update
-        return False
-    except sqlite3.Error as e:
-        print(f"Database error updating user: {e}")
-        return False
+        raise ConflictError('A user with this email already exists')
+    if updated is None:
+        raise NotFoundError('User not found')
+    if email is not None:
+        forget_missing_emails([email])
+    return True
 
 def delete_user(user_id):
-    conn = get_db()
-    cursor = conn.cursor()
     try:
-        cursor.execute("DELETE FROM users WHERE id = ?;", (user_id,))
-        conn.commit()
-        return cursor.rowcount > 0 # Returns True if a row was deleted
+        # Returns True if a row was deleted
+        deleted = run_user_write(user_id, fetch_one, "DELETE FROM users WHERE id = ? RETURNING id;", (user_id,))
+        if deleted is not None and get_shards() is not None:
+            run_write(release_user_id, user_id)
+        return deleted is not None
     except sqlite3.Error as e:
         print(f"Database error deleting user: {e}")
         return False
 
 # --- Service Management Functions (Interacting with 'services' table) ---
 
-def get_all_services():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, description FROM services;")
-    return cursor.fetchall()
+# Reads go through the in-process catalog cache. The app never writes services: changes made with
+# services_manager.py bump catalog_version (triggers) and are seen within CATALOG_REVALIDATE_SECONDS.
 
-def get_service_by_id(service_id):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, description FROM services WHERE id = ?;", (service_id,))
-    return cursor.fetchone()
-
-# --- User Subscription Management Functions (Interacting with 'user_services' table) ---
-
-def get_user_subscriptions(user_id):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT
-            us.id AS subscription_id,
-            s.id AS service_id,
-            s.name AS service_name,
-            s.description AS service_description,
-            us.active,
-            us.start_date,
-            us.end_date
-        FROM user_services us
-        JOIN services s ON us.service_id = s.id
-        WHERE us.user_id = ?;
-    ''', (user_id,))
-    return cursor.fetchall()
+def get_catalog():
+    catalog_cache.revalidate_seconds = app.config['CATALOG_REVALIDATE_SECONDS']
+    return catalog_cache.get(get_db())
 
-def get_user_service_subscription(user_id, service_id):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT
-            us.id AS subscription_id,
-            s.name AS service_name,
-            s.description AS service_description,
-            us.active,
-            us.start_date,
-            us.end_date
-        FROM user_services us
-        JOIN services s ON us.service_id = s.id
-        WHERE us.user_id = ? AND us.service_id = ?;
-    ''', (user_id, service_id))
-    return cursor.fetchone()
+def get_all_services():
+    return get_catalog().services
 
-def add_user_subscription(user_id, service_id, start_date, end_date=None, active=1):
-    conn = get_db()
-    cursor = conn.cursor()
+def get_service_by_id(service_id):
     try:
-        cursor.execute(
-            "INSERT INTO user_services (user_id, service_id, active, start_date, end_date) VALUES (?, ?, ?, ?, ?);",
-            (user_id, service_id, active, start_date, end_date)
-        )
-        conn.commit()
-        return cursor.lastrowid
-    except sqlite3.IntegrityError:
-        # This handles the UNIQUE(user_id, service_id) constraint violation
-        return None # User already subscribed to this service
-    except sqlite3.Error as e:
-        print(f"Database error adding subscription: {e}")
+        return get_catalog().by_id.get(int(service_id))
+    except (TypeError, ValueError):
         return None
 
-def update_user_subscription(user_id, service_id, active=None, end_date=None):
-    conn = get_db()
-    cursor = conn.cursor()
-    updates = []
-    params = []
+# --- User Subscription Management Functions (Interacting with 'user_services' table) ---
 
+SUBSCRIPTION_COLUMNS = {
+    'subscription_id': 'us.id',
+    'service_id': 's.id',
+    'service_name': 's.name',
+    'service_description': 's.description',
+    'active': 'us.active',
+    'start_date': 'us.start_date',
+    'end_date': 'us.end_date',
+}
+USER_SUBSCRIPTION_FIELDS = tuple(SUBSCRIPTION_COLUMNS)
+USER_SERVICE_SUBSCRIPTION_FIELDS = tuple(field for field in SUBSCRIPTION_COLUMNS if field != 'service_id')
+
+def user_subscriptions_query(fields=USER_SUBSCRIPTION_FIELDS, one_service=False):
+    # Parameters: (user_id,) or (user_id, service_id) with one_service
+    return (f"SELECT {select_list(fields, SUBSCRIPTION_COLUMNS)} FROM user_services us "
+            "JOIN services s ON us.service_id = s.id WHERE us.user_id = ?"
+            + (" AND us.service_id = ?;" if one_service else ";"))
+
+def get_user_subscriptions(user_id, fields=USER_SUBSCRIPTION_FIELDS):
+    return fetch_records(user_db(user_id), user_subscriptions_query(fields), (user_id,))
+
+def get_user_service_subscription(user_id, service_id, fields=USER_SERVICE_SUBSCRIPTION_FIELDS):
+    return fetch_record(user_db(user_id), user_subscriptions_query(fields, one_service=True), (user_id, service_id))
+
+def find_missing_parent(conn, user_id, service_id):
+    # Only called on the failure path, to tell which side of the relation is missing.
+    # Service existence comes from the catalog cache, only the user costs a query.
+    if conn.execute("SELECT 1 FROM users WHERE id = ?;", (user_id,)).fetchone() is None:
+        return 'User not found'
+    if get_service_by_id(service_id) is None:
+        return 'Service not found'
+    return None
+
+def check_promo_code(conn, code):
+    # None or '' means no code; any other value must be the code of a promotion (ValueError otherwise).
+    if code is None or code == '':
+        return None
+    if not isinstance(code, str) or conn.execute("SELECT 1 FROM promotions WHERE code = ?;", (code,)).fetchone() is None:
+        raise ValueError('Unknown promotion code')
+    return code
+
+def insert_subscription(conn, user_id, service_id, active, start_date, end_date, promo_code=None):
+    # Mutation for run_write(): the row is priced in the same transaction, as the repricing job would.
+    import pricing
+
+    promo_code = check_promo_code(conn, promo_code)
+    price, promotion_id = pricing.price_subscription(conn, user_id, service_id, promo_code)
+    return conn.execute(
+        "INSERT INTO user_services (user_id, service_id, active, start_date, end_date, promo_code, price, promotion_id) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?) RETURNING id;",
+        (user_id, service_id, active, start_date, end_date, promo_code, price, promotion_id)).fetchone()
+
+def change_subscription(conn, user_id, service_id, updates):
+    # Mutation for run_write(): UPDATE of {column: value}, repricing the row. None when there is no such row.
+    import pricing
+
+    row = conn.execute("SELECT promo_code FROM user_services WHERE user_id = ? AND service_id = ?;",
+                       (user_id, service_id)).fetchone()
+    if row is None:
+        return None
+    updates = dict(updates)
+    if 'promo_code' in updates:
+        updates['promo_code'] = check_promo_code(conn, updates['promo_code'])
+    updates['price'], updates['promotion_id'] = pricing.price_subscription(
+        conn, user_id, service_id, updates.get('promo_code', row[0]))
+    return conn.execute(
+        f"UPDATE user_services SET {', '.join(f'{column} = ?' for column in updates)} "
+        "WHERE user_id = ? AND service_id = ? RETURNING id;", [*updates.values(), user_id, service_id]).fetchone()
+
+def add_user_subscription(user_id, service_id, start_date, end_date=None, active=1, promo_code=None):
+    # One INSERT: foreign keys report a missing user/service, UNIQUE(user_id, service_id) a duplicate.
+    # An unknown promo_code raises ValueError. Shards take the id from next_subscription_id, to keep
+    # ids unique across shards; their rows are not priced (promotions stay on the main database).
+    try:
+        if get_shards() is None:
+            return run_write(insert_subscription, user_id, service_id, active, start_date, end_date, promo_code)[0]
+        if promo_code:
+            raise ConflictError(SINGLE_DATABASE_ONLY)
+        return run_user_write(user_id, fetch_one, SUBSCRIPTION_INSERT,
+                              (user_id, service_id, active, start_date, end_date))[0]
+    except sqlite3.IntegrityError as e:
+        if 'FOREIGN KEY' in str(e):
+            raise NotFoundError(find_missing_parent(user_db(user_id), user_id, service_id) or 'User or service not found')
+        raise ConflictError('User is already subscribed to this service')
+
+def update_user_subscription(user_id, service_id, active=None, end_date=None, promo_code=None):
+    # Returns True when updated, False if there was nothing to update. Raises NotFoundError otherwise.
+    updates = {}
     if active is not None:
-        updates.append("active = ?")
-        params.append(active)
+        updates['active'] = active
     if end_date is not None:
-        updates.append("end_date = ?")
-        params.append(end_date)
+        updates['end_date'] = end_date or None # '' clears the end date
+    if promo_code is not None:
+        updates['promo_code'] = promo_code # '' clears the code
 
     if not updates:
         return False # Nothing to update
 
-    query = f"UPDATE user_services SET {', '.join(updates)} WHERE user_id = ? AND service_id = ?;"
-    params.extend([user_id, service_id])
-
-    try:
-        cursor.execute(query, params)
-        conn.commit()
-        return cursor.rowcount > 0 # Returns True if a row was updated
-    except sqlite3.Error as e:
-        print(f"Database error updating subscription: {e}")
-        return False
+    if get_shards() is None:
+        updated = run_write(change_subscription, user_id, service_id, updates)
+    elif promo_code is not None:
+        raise ConflictError(SINGLE_DATABASE_ONLY)
+    else:
+        updated = run_user_write(
+            user_id, fetch_one,
+            f"UPDATE user_services SET {', '.join(f'{column} = ?' for column in updates)} "
+            "WHERE user_id = ? AND service_id = ? RETURNING id;", [*updates.values(), user_id, service_id])
+    if updated is None:
+        raise NotFoundError(find_missing_parent(user_db(user_id), user_id, service_id) or 'Subscription not found')
+    return True
 
 def delete_user_subscription(user_id, service_id):
-    conn = get_db()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("DELETE FROM user_services WHERE user_id = ? AND service_id = ?;", (user_id, service_id))
-        conn.commit()
-        return cursor.rowcount > 0 # Returns True if a row was deleted
-    except sqlite3.Error as e:
-        print(f"Database error deleting subscription: {e}")
-        return False
+    # Raises NotFoundError when there was nothing to delete.
+    deleted = run_user_write(user_id, fetch_one,
+                             "DELETE FROM user_services WHERE user_id = ? AND service_id = ? RETURNING id;",
+                             (user_id, service_id))
+    if deleted is None:
+        raise NotFoundError(find_missing_parent(user_db(user_id), user_id, service_id) or 'Subscription not found')
+    return True
+
+def get_subscriptions_batch(conn, user_ids=None, service_id=None, active=None, after_id=0, limit=50,
+                            fields=USER_SUBSCRIPTION_FIELDS):
+    # Subscriptions of many users in one query, grouped per user and paginated by user id.
+    # With user_ids every requested user gets a group (possibly empty); otherwise the page
+    # holds the users having at least one subscription matching service_id/active.
+    # Returns (groups, next_after_id).
+    filters = []
+    params = []
+    if service_id is not None:
+        filters.append("us.service_id = ?")
+        params.append(service_id)
+    if active is not None:
+        filters.append("us.active = ?")
+        params.append(active)
+
+    if user_ids is not None:
+        remaining = sorted(user_id for user_id in set(user_ids) if user_id > after_id)
+        page_ids = remaining[:limit]
+        has_more = len(remaining) > limit
+        page = "SELECT value AS user_id FROM json_each(?)"
+        page_params = [json.dumps(page_ids)]
+    else:
+        page_ids = None
+        page = f"""
+            SELECT DISTINCT us.user_id FROM user_services us
+            WHERE us.user_id > ? {''.join(' AND ' + f for f in filters)}
+            ORDER BY us.user_id LIMIT ?"""
+        page_params = [after_id, *params, limit]
+
+    # user_id is read last: zip() with the field names leaves it out of each subscription.
+    cursor = tuple_cursor(conn)
+    cursor.execute(f"""
+        WITH page AS ({page})
+        SELECT {select_list(fields, SUBSCRIPTION_COLUMNS)}, us.user_id
+        FROM page
+        JOIN user_services us ON us.user_id = page.user_id
+        JOIN services s ON us.service_id = s.id
+        {'WHERE ' + ' AND '.join(filters) if filters else ''}
+        ORDER BY us.user_id, us.service_id;
+    """, [*page_params, *params])
+
+    groups = {user_id: [] for user_id in page_ids} if page_ids is not None else {}
+    for row in cursor:
+        groups.setdefault(row[-1], []).append(dict(zip(fields, row)))
+    result = [{'user_id': user_id, 'subscriptions': subscriptions} for user_id, subscriptions in groups.items()]
+
+    if page_ids is None:
+        has_more = len(result) == limit
+    next_after_id = result[-1]['user_id'] if has_more and result else None
+    return result, next_after_id
+
+def find_subscriptions_batch(user_ids=None, service_id=None, active=None, after_id=0, limit=50,
+                             fields=USER_SUBSCRIPTION_FIELDS):
+    # get_subscriptions_batch() on DATABASE, or on the shards with the groups merged by user id.
+    shards = get_shards()
+    if shards is None:
+        return get_subscriptions_batch(get_db(), user_ids, service_id, active, after_id, limit, fields)
+    timeout = app.config['DB_POOL_TIMEOUT']
+    if user_ids is not None:
+        # The page of ids is cut first; each shard is only asked for its own users of the page.
+        remaining = sorted(user_id for user_id in set(user_ids) if user_id > after_id)
+        by_shard = {}
+        for user_id in remaining[:limit]:
+            by_shard.setdefault(shards.index(user_id), []).append(user_id)
+        results = shards.map(get_subscriptions_batch, {
+            index: (ids, service_id, active, 0, len(ids), fields) for index, ids in by_shard.items()
+        }, timeout)
+        groups = list(heapq.merge(*(groups for groups, _ in results), key=itemgetter('user_id')))
+        return groups, groups[-1]['user_id'] if len(remaining) > limit else None
+    results = shards.broadcast(get_subscriptions_batch, None, service_id, active, after_id, limit, fields,
+                               timeout=timeout)
+    groups = list(islice(heapq.merge(*(groups for groups, _ in results), key=itemgetter('user_id')), limit))
+    return groups, groups[-1]['user_id'] if len(groups) == limit else None
 
 # --- API Routes ---
 
@@ -263,23 +1057,69 @@ def api_add_user():
         return jsonify({'message': 'User created successfully', 'user_id': user_id}), 201
     return jsonify({'message': 'User with this email already exists or another error occurred'}), 409 # Conflict or other error
 
+@app.route('/admin/users/bulk', methods=['POST'])
+def api_bulk_add_users():
+    # Body is CSV (text/csv) or NDJSON (application/x-ndjson), read as a stream. Admin only: its hashing
+    # bypasses the password pool's pending cap (see passwords.hash_many).
+    fmt = request.args.get('format')
+    if fmt is None:
+        fmt = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'message': 'format must be csv or ndjson'}), 400
+    if app.config['SHARDS']:
+        return single_database_only()
+
+    lines = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    report = import_users(iter_records(lines, fmt), get_password_hasher(), writer_connection,
+                          app.config['BULK_IMPORT_CHUNK_SIZE'], app.config['BULK_IMPORT_REPORT_MAX_ROWS'],
+                          forget_missing_emails)
+    status = 201 if report['created'] else 200
+    return jsonify(report), status
+
 @app.route('/users', methods=['GET'])
 def api_get_all_users():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, email, first_name, last_name FROM users;")
-    users = cursor.fetchall()
-    return jsonify([dict(u) for u in users])
+    # ?format=ndjson streams the whole table, one JSON object per line; ?fields= selects the columns.
+    try:
+        fields = parse_fields(request.args.get('fields'), USER_FIELDS)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    if request.args.get('format') == 'ndjson':
+        get_db() # checked out now, so that X-Snapshot-Age is known before the body is streamed
+        fetch_size = app.config['EXPORT_FETCH_SIZE']
+        encode = app.json.encode
+
+        def generate():
+            # One chunk per fetch, not per user.
+            for users in iter_all_users(fetch_size, fields):
+                yield b''.join(encode(user) + b'\n' for user in users)
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    try:
+        limit, after_id = parse_page_args(app.config['USERS_PAGE_DEFAULT_LIMIT'], app.config['USERS_PAGE_MAX_LIMIT'])
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    users, last_id = get_users_page(after_id, limit, fields)
+    next_cursor = encode_cursor(last_id) if len(users) == limit else None
+    return jsonify({'users': users, 'next_cursor': next_cursor})
 
 @app.route('/users/<int:user_id>', methods=['GET'])
 def api_get_user(user_id):
-    user = get_user_by_id(user_id)
+    require_session(user_id)
+    try:
+        fields = parse_fields(request.args.get('fields'), USER_FIELDS)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    user = get_user_by_id(user_id, fields)
     if user:
-        return jsonify(dict(user))
+        return jsonify(user)
     return jsonify({'message': 'User not found'}), 404
 
 @app.route('/users/<int:user_id>', methods=['PUT'])
 def api_update_user(user_id):
+    require_session(user_id)
     data = request.get_json()
     email = data.get('email')
     first_name = data.get('first_name')
@@ -289,18 +1129,19 @@ def api_update_user(user_id):
     if not any([email, first_name, last_name, new_password]):
         return jsonify({'message': 'No update data provided'}), 400
 
-    if update_user(user_id, email=email, first_name=first_name, last_name=last_name, new_password=new_password):
-        return jsonify({'message': 'User updated successfully'}), 200
-    
-    # Check if user exists before determining error type
-    if not get_user_by_id(user_id):
-        return jsonify({'message': 'User not found'}), 404
-    
-    return jsonify({'message': 'Failed to update user, possibly duplicate email or no changes made'}), 400
+    # NotFoundError / ConflictError are turned into 404 / 409 by the error handlers
+    update_user(user_id, email=email, first_name=first_name, last_name=last_name, new_password=new_password)
+    if new_password:
+        # A new password revokes every existing session; the caller gets a fresh token.
+        epoch = revoke_sessions(user_id)
+        return jsonify({'message': 'User updated successfully', **issue_session(user_id, epoch)}), 200
+    return jsonify({'message': 'User updated successfully'}), 200
 
 @app.route('/users/<int:user_id>', methods=['DELETE'])
 def api_delete_user(user_id):
+    require_session(user_id)
     if delete_user(user_id):
+        session_epochs.set(user_id, DELETED)
         return jsonify({'message': 'User deleted successfully'}), 200
     return jsonify({'message': 'User not found'}), 404
 
@@ -313,11 +1154,47 @@ def login():
     if not all([email, password]):
         return jsonify({'message': 'Email and password are required'}), 400
 
+    # Rate limits and the unknown-email cache are checked before any database or bcrypt work.
+    guard = get_login_guard()
+    client = request.remote_addr # the client's address behind TRUSTED_PROXIES, see ProxyFix
+    if guard is not None:
+        guard.check(client, email) # raises LoginRateLimited -> 429
+        if guard.is_known_missing(email):
+            simulate_password_check(guard)
+            return jsonify({'message': 'Invalid credentials'}), 401
+
     user = get_user_by_email(email)
+    release_db() # Don't hold the writer connection during bcrypt
+    if user is None and guard is not None:
+        guard.remember_missing(email)
+        simulate_password_check(guard)
+        return jsonify({'message': 'Invalid credentials'}), 401
+
+    started = time.perf_counter()
     if user and verify_password(user['password'], password):
-        return jsonify({'message': 'Login successful', 'user_id': user['id'], 'email': user['email']}), 200
+        if guard is not None:
+            guard.observe_verify(time.perf_counter() - started)
+            guard.record_success(client, email)
+        if get_password_hasher().needs_rehash(user['password']):
+            # Stored with an older, cheaper cost: upgrade it now that we know the plain password.
+            update_user(user['id'], new_password=password)
+        session_epochs.set(user['id'], user['token_epoch'])
+        return jsonify({'message': 'Login successful', 'user_id': user['id'], 'email': user['email'],
+                        **issue_session(user['id'], user['token_epoch'])}), 200
+    if guard is not None and user:
+        guard.observe_verify(time.perf_counter() - started)
+        guard.record_failure(client, email)
     return jsonify({'message': 'Invalid credentials'}), 401 # Unauthorized
 
+@app.route('/logout', methods=['POST'])
+def logout():
+    # Revokes every session token of the user, on all devices.
+    user_id, epoch = read_session(request.headers.get('Authorization'))
+    if epoch != current_token_epoch(user_id):
+        raise InvalidSession('Session revoked')
+    revoke_sessions(user_id)
+    return jsonify({'message': 'Logged out'}), 200
+
 @app.route('/search/users', methods=['GET'])
 def api_search_users():
     email_query = request.args.get('email')
@@ -327,102 +1204,732 @@ def api_search_users():
     if not any([email_query, first_name_query, last_name_query]):
         return jsonify({'message': 'Please provide at least one search parameter (email, first_name, or last_name)'}), 400
 
-    users = search_users(email=email_query, first_name=first_name_query, last_name=last_name_query)
+    try:
+        limit = min(int(request.args.get('limit', app.config['SEARCH_DEFAULT_LIMIT'])), app.config['SEARCH_MAX_LIMIT'])
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({'message': 'limit and offset must be integers'}), 400
+    if limit < 1 or offset < 0:
+        return jsonify({'message': 'limit must be positive and offset non-negative'}), 400
+    try:
+        fields = parse_fields(request.args.get('fields'), USER_FIELDS)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    users = search_users(email=email_query, first_name=first_name_query, last_name=last_name_query,
+                         limit=limit, offset=offset, fields=fields)
 
-    if users:
-        return jsonify([dict(u) for u in users])
+    if users or offset > 0:
+        next_offset = offset + limit if len(users) == limit else None
+        return jsonify({'users': users, 'next_offset': next_offset})
     return jsonify({'message': 'No users found matching the criteria'}), 404
 
+def pool_gauges():
+    for pool in get_pools().stats().values():
+        for field in ('in_use', 'opened', 'checkouts', 'timeouts', 'wait_seconds_total', 'wait_seconds_max',
+                      'checkout_seconds_total', 'checkout_seconds_max'):
+            yield {'pool': pool['name'], 'field': field}, pool[field]
+
+def password_pool_gauges():
+    for field, value in get_password_hasher().stats().items():
+        yield {'field': field}, value if value is not None else 0
+
+def login_guard_gauges():
+    guard = get_login_guard()
+    for field, value in (guard.stats() if guard is not None else {}).items():
+        yield {'field': field}, value if value is not None else 0
+
+def session_epoch_gauges():
+    for field, value in session_epochs.stats().items():
+        yield {'field': field}, value
+
+def catalog_cache_gauges():
+    for field, value in catalog_cache.stats().items():
+        yield {'field': field}, value if value is not None else 0
+
+metrics.registry.register(metrics.Gauge('db_pool', 'Connection pool statistics.', pool_gauges))
+metrics.registry.register(metrics.Gauge('password_pool', 'Password hashing pool statistics.', password_pool_gauges))
+metrics.registry.register(metrics.Gauge('login_guard', 'Login rate limiter and unknown-email cache.', login_guard_gauges))
+metrics.registry.register(metrics.Gauge('session_epoch_cache', 'Cached session token epochs.', session_epoch_gauges))
+metrics.registry.register(metrics.Gauge('catalog_cache', 'Service catalog cache statistics.', catalog_cache_gauges))
+
+def snapshot_gauges():
+    snapshots = get_snapshots()
+    if snapshots is None:
+        return
+    status = snapshots.status()
+    for replica in status.pop('replicas'):
+        for field in ('age_seconds', 'in_use', 'file_bytes'):
+            yield {'replica': str(replica['replica']), 'field': field}, replica[field]
+    for field in ('pending_commits', 'refreshes', 'unchanged', 'errors', 'served', 'too_stale',
+                  'refresh_seconds_total', 'refresh_seconds_max'):
+        yield {'field': field}, status[field]
+
+metrics.registry.register(metrics.Gauge('read_snapshots', 'Read snapshot replicas and refreshes.', snapshot_gauges))
+
+def group_commit_gauges():
+    if _group_writer is None:
+        return
+    for field, value in _group_writer.stats().items():
+        if field != 'running':
+            yield {'field': field}, value
+
+metrics.registry.register(metrics.Gauge('group_commit', 'Group-commit writer batches and mutations.', group_commit_gauges))
+
+def shard_gauges():
+    if _shards is None:
+        return
+    for index in range(_shards.count):
+        yield {'shard': str(index), 'field': 'reads'}, _shards.reads[index]
+        yield {'shard': str(index), 'field': 'writes'}, _shards.writes[index]
+    yield {'field': 'fan_outs'}, _shards.fan_outs
+    yield {'field': 'catalog_syncs'}, _shards.catalog_syncs
+
+metrics.registry.register(metrics.Gauge('shards', 'Sharded storage reads, writes and fan-outs.', shard_gauges))
+
+@app.route('/metrics', methods=['GET'])
+def api_metrics():
+    # Prometheus text exposition format
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/metrics/slow-queries', methods=['GET'])
+def api_slow_queries():
+    return jsonify({'threshold_seconds': metrics.slow_query_threshold, 'queries': list(metrics.slow_queries)})
+
+@app.route('/admin/profiler', methods=['GET'])
+def api_profiler_report():
+    # Collapsed stacks ("frame;frame;frame count"), most frequent first
+    limit = request.args.get('limit', 200, type=int)
+    return Response(profiler.collapsed(limit), mimetype='text/plain', headers={'X-Profiler-Samples': str(profiler.samples)})
+
+@app.route('/admin/profiler', methods=['POST'])
+def api_profiler_toggle():
+    data = request.get_json(silent=True) or {}
+    if data.get('enabled'):
+        interval = float(data.get('interval', 0.01))
+        if not 0.001 <= interval <= 1.0:
+            return jsonify({'message': 'interval must be between 0.001 and 1 second'}), 400
+        profiler.start(interval)
+    else:
+        profiler.stop()
+    return jsonify(profiler.status())
+
+@app.route('/admin/expiry', methods=['GET'])
+def api_expiry_status():
+    # Scheduler state and the most recent expired/expiring events
+    return jsonify({**expiry_scheduler.status(), 'events': list(expiry_scheduler.recent_events)})
+
+@app.route('/admin/expiry/run', methods=['POST'])
+def api_expiry_run():
+    date = (request.get_json(silent=True) or {}).get('date')
+    try:
+        if date:
+            check_date(date, 'date')
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    return jsonify(expiry_scheduler.run_once(date))
+
+@app.route('/admin/stats', methods=['GET'])
+def api_admin_stats():
+    # Dashboard totals read from the trigger-maintained aggregates (admin_stats.py): a few rows per service.
+    as_of = request.args.get('as_of')
+    try:
+        if as_of:
+            datetime.strptime(as_of, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'message': 'as_of must be YYYY-MM-DD'}), 400
+    shards = get_shards()
+    if shards is None:
+        return jsonify(read_stats(get_db(), as_of, app.config['EXPIRY_NOTICE_DAYS']))
+    return jsonify(combine_stats(shards.broadcast(read_stats, as_of, app.config['EXPIRY_NOTICE_DAYS'],
+                                                  timeout=app.config['DB_POOL_TIMEOUT'])))
+
+@app.route('/admin/shards', methods=['GET'])
+def api_shard_status():
+    shards = get_shards()
+    if shards is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **shards.status()})
+
+@app.route('/admin/snapshots', methods=['GET'])
+def api_snapshot_status():
+    snapshots = get_snapshots()
+    if snapshots is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, 'max_staleness': app.config['SNAPSHOT_MAX_STALENESS'], **snapshots.status()})
+
+@app.route('/admin/snapshots/refresh', methods=['POST'])
+def api_snapshot_refresh():
+    # Refreshes every replica now, e.g. right after a bulk import.
+    snapshots = get_snapshots()
+    if snapshots is None:
+        return jsonify({'message': 'Snapshot reads are disabled'}), 409
+    for replica in range(len(snapshots.replicas)):
+        snapshots.refresh(replica)
+    return jsonify(snapshots.status())
+
+@app.route('/metrics/db-pool', methods=['GET'])
+def api_db_pool_metrics():
+    return jsonify(get_pools().stats())
+
+@app.route('/metrics/password-pool', methods=['GET'])
+def api_password_pool_metrics():
+    return jsonify(get_password_hasher().stats())
+
+@app.route('/metrics/login-guard', methods=['GET'])
+def api_login_guard_metrics():
+    guard = get_login_guard()
+    return jsonify(guard.stats() if guard is not None else {'enabled': False})
+
+@app.route('/metrics/catalog-cache', methods=['GET'])
+def api_catalog_cache_metrics():
+    return jsonify(catalog_cache.stats())
+
+# --- Change Feed API Routes ---
+
+def parse_changes_args(args, last_event_id=None):
+    # Returns (since, limit, wait); raises ValueError with a client-facing message.
+    try:
+        since = int(args.get('since') or last_event_id or 0)
+        limit = min(int(args.get('limit', app.config['CHANGES_PAGE_DEFAULT_LIMIT'])), app.config['CHANGES_PAGE_MAX_LIMIT'])
+        wait = min(float(args.get('wait', 0)), app.config['CHANGES_MAX_WAIT'])
+    except ValueError:
+        raise ValueError("since and limit must be integers, wait a number of seconds")
+    if since < 0 or limit < 1 or wait < 0:
+        raise ValueError("since and wait must be non-negative, limit positive")
+    return since, limit, wait
+
+def wait_for_changes(since, limit, wait):
+    # Long-poll: returns as soon as there are changes after `since`, or [] after `wait` seconds.
+    deadline = time.monotonic() + wait
+    while True:
+        version = change_notifier.version
+        changes = fetch_changes(get_db(), since, limit)
+        release_db() # never hold a pooled connection while waiting
+        remaining = deadline - time.monotonic()
+        if changes or remaining <= 0:
+            return changes
+        change_notifier.wait(version, min(remaining, app.config['CHANGES_POLL_INTERVAL']))
+
+def stream_changes(since, limit):
+    # Server-Sent Events: one event per change, forever, with a comment line as heartbeat.
+    heartbeat = app.config['CHANGES_HEARTBEAT_SECONDS']
+    last_sent = time.monotonic()
+    yield 'retry: 1000\n\n'
+    while True:
+        version = change_notifier.version
+        with reader_connection() as conn:
+            changes = fetch_changes(conn, since, limit)
+        if changes:
+            since = changes[-1]['seq']
+            last_sent = time.monotonic()
+            yield ''.join(format_sse(change) for change in changes)
+            continue
+        if time.monotonic() - last_sent >= heartbeat:
+            last_sent = time.monotonic()
+            yield ': keep-alive\n\n'
+        change_notifier.wait(version, app.config['CHANGES_POLL_INTERVAL'])
+
+@app.route('/changes', methods=['GET'])
+def api_get_changes():
+    # ?since=<seq>&limit=...&wait=<seconds>; Accept: text/event-stream switches to SSE.
+    require_admin() # every user's emails, names and subscriptions
+    if app.config['SHARDS']:
+        return single_database_only() # one sequence per shard: no single ordered feed
+    try:
+        since, limit, wait = parse_changes_args(request.args, request.headers.get('Last-Event-ID'))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        release_db()
+        return Response(stream_with_context(stream_changes(since, limit)), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    changes = wait_for_changes(since, limit, wait)
+    next_since = changes[-1]['seq'] if changes else since
+    return jsonify({'changes': changes, 'next_since': next_since})
+
 # --- Service API Routes ---
 
+def catalog_response(body, etag):
+    # Strong ETag + Cache-Control; make_conditional answers 304 to a matching If-None-Match.
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['CATALOG_CACHE_MAX_AGE']
+    return response.make_conditional(request)
+
 @app.route('/services', methods=['GET'])
 def api_get_services():
-    services = get_all_services()
-    return jsonify([dict(s) for s in services])
+    catalog = get_catalog()
+    return catalog_response(catalog.body, catalog.etag)
 
 @app.route('/services/<int:service_id>', methods=['GET'])
 def api_get_service(service_id):
-    service = get_service_by_id(service_id)
-    if service:
-        return jsonify(dict(service))
+    catalog = get_catalog()
+    if service_id in catalog.by_id:
+        return catalog_response(catalog.bodies_by_id[service_id], catalog.etags_by_id[service_id])
     return jsonify({'message': 'Service not found'}), 404
 
+# --- Pricing & Promotions API Routes ---
+# pricing (and NumPy) is imported inside the routes so that app startup doesn't pay for it.
+
+PROMOTION_FIELDS = ('code', 'kind', 'value', 'service_id', 'user_id', 'starts_at', 'ends_at', 'active')
+
+@app.route('/admin/promotions', methods=['GET'])
+def api_get_promotions():
+    try:
+        fields = parse_fields(request.args.get('fields'), ('id', *PROMOTION_FIELDS))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    return jsonify(fetch_records(get_db(), f"SELECT {', '.join(fields)} FROM promotions ORDER BY id;"))
+
+@app.route('/admin/promotions', methods=['POST'])
+def api_add_promotion():
+    # Admin only: a promotion applies to every matching subscription written afterwards.
+    data = request.get_json()
+    kind = data.get('kind')
+    value = data.get('value')
+
+    if kind not in ('percent', 'fixed'):
+        return jsonify({'message': "kind must be 'percent' or 'fixed'"}), 400
+    if not isinstance(value, (int, float)) or value < 0 or (kind == 'percent' and value > 100):
+        return jsonify({'message': 'value must be a non-negative number (at most 100 for percent)'}), 400
+    try:
+        for field in ('starts_at', 'ends_at'):
+            if data.get(field) is not None:
+                check_date(data[field], field)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    values = [data.get(field) for field in PROMOTION_FIELDS]
+    values[PROMOTION_FIELDS.index('active')] = data.get('active', 1)
+    try:
+        promotion_id = run_write(
+            fetch_one,
+            f"INSERT INTO promotions ({', '.join(PROMOTION_FIELDS)}) VALUES ({', '.join('?' * len(PROMOTION_FIELDS))}) RETURNING id;",
+            values
+        )[0]
+    except sqlite3.IntegrityError as e:
+        if 'FOREIGN KEY' in str(e):
+            raise NotFoundError('User or service not found')
+        raise ConflictError('A promotion with this code already exists')
+    return jsonify({'message': 'Promotion created successfully', 'promotion_id': promotion_id}), 201
+
+@app.route('/pricing/quote', methods=['GET'])
+def api_pricing_quote():
+    import pricing
+
+    user_id = request.args.get('user_id', type=int)
+    if user_id is None:
+        return jsonify({'message': 'user_id is required'}), 400
+    try:
+        service_ids = [int(value) for value in request.args.getlist('service_id')] or None
+    except ValueError:
+        return jsonify({'message': 'service_id must be an integer'}), 400
+    as_of = request.args.get('date')
+    try:
+        if as_of:
+            check_date(as_of, 'date')
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    try:
+        quotes = pricing.quote(get_db(), user_id, service_ids, code=request.args.get('code'), as_of=as_of)
+    except LookupError as e:
+        return jsonify({'message': str(e)}), 404
+    return jsonify(quotes)
+
+@app.route('/admin/pricing/reprice', methods=['POST'])
+def api_reprice_subscriptions():
+    import pricing
+
+    if app.config['SHARDS']:
+        return single_database_only() # promotions are not copied to the shards
+    as_of = (request.get_json(silent=True) or {}).get('date')
+    try:
+        if as_of:
+            check_date(as_of, 'date')
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    # Own connection: the job commits chunk by chunk and must not hold the pooled writer meanwhile.
+    conn = open_connection(app.config['DATABASE'], app.config['DB_PRAGMAS'])
+    try:
+        result = pricing.reprice_active_subscriptions(conn, as_of=as_of)
+    finally:
+        conn.close()
+    return jsonify(result)
+
 # --- User Subscription API Routes ---
 
+def parse_subscription_filters(args, max_ids):
+    # ?user_ids=1,2,3&service_id=...&active=0|1&fields=..., returns the keyword arguments of get_subscriptions_batch.
+    filters = {'fields': parse_fields(args.get('fields'), SUBSCRIPTION_COLUMNS)}
+    if args.get('user_ids'):
+        try:
+            filters['user_ids'] = [int(part) for part in args['user_ids'].split(',') if part.strip()]
+        except ValueError:
+            raise ValueError("user_ids must be a comma-separated list of integers")
+        if len(filters['user_ids']) > max_ids:
+            raise ValueError(f"at most {max_ids} user_ids per request")
+    if args.get('service_id'):
+        try:
+            filters['service_id'] = int(args['service_id'])
+        except ValueError:
+            raise ValueError("service_id must be an integer")
+    if args.get('active'):
+        if args['active'] not in ('0', '1'):
+            raise ValueError("active must be 0 or 1")
+        filters['active'] = int(args['active'])
+    return filters
+
+@app.route('/subscriptions', methods=['GET'])
+def api_get_subscriptions_batch():
+    # Batch lookup for dashboards: {users: [{user_id, subscriptions: [...]}], next_cursor}.
+    require_admin() # any user's subscriptions, which /users/<id>/subscriptions only shows to that user
+    try:
+        filters = parse_subscription_filters(request.args, app.config['SUBSCRIPTIONS_BATCH_MAX_IDS'])
+        limit, after_id = parse_page_args(app.config['SUBSCRIPTIONS_PAGE_DEFAULT_LIMIT'],
+                                          app.config['SUBSCRIPTIONS_PAGE_MAX_LIMIT'])
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    groups, next_after_id = find_subscriptions_batch(after_id=after_id, limit=limit, **filters)
+    next_cursor = encode_cursor(next_after_id) if next_after_id is not None else None
+    return jsonify({'users': groups, 'next_cursor': next_cursor})
+
 @app.route('/users/<int:user_id>/subscriptions', methods=['GET'])
 def api_get_user_subs(user_id):
-    subscriptions = get_user_subscriptions(user_id)
+    require_session(user_id)
+    try:
+        fields = parse_fields(request.args.get('fields'), SUBSCRIPTION_COLUMNS)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    subscriptions = get_user_subscriptions(user_id, fields)
     if subscriptions:
-        return jsonify([dict(sub) for sub in subscriptions])
+        return jsonify(subscriptions)
     return jsonify({'message': 'No subscriptions found for this user'}), 404
 
 @app.route('/users/<int:user_id>/subscriptions/<int:service_id>', methods=['GET'])
 def api_get_user_service_sub(user_id, service_id):
-    subscription = get_user_service_subscription(user_id, service_id)
+    require_session(user_id)
+    try:
+        fields = parse_fields(request.args.get('fields'), SUBSCRIPTION_COLUMNS, USER_SERVICE_SUBSCRIPTION_FIELDS)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    subscription = get_user_service_subscription(user_id, service_id, fields)
     if subscription:
-        return jsonify(dict(subscription))
+        return jsonify(subscription)
     return jsonify({'message': 'Subscription not found'}), 404
 
 @app.route('/users/<int:user_id>/subscriptions', methods=['POST'])
 def api_add_user_subscription(user_id):
+    require_session(user_id)
     data = request.get_json()
     service_id = data.get('service_id')
     start_date = data.get('start_date', datetime.now().strftime('%Y-%m-%d'))
-    end_date = data.get('end_date')
-    active = data.get('active', 1)
+    end_date = data.get('end_date') or None # '' means no end date (see migrations.normalize_subscription_fields)
+    active = 1 if data.get('active') is None else data.get('active')
 
     if not service_id:
         return jsonify({'message': 'Service ID is required'}), 400
+    try:
+        check_date(start_date, 'start_date')
+        if end_date is not None:
+            check_date(end_date, 'end_date') # compared as TEXT by the expiry sweep
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
 
-    # Check if service exists
-    if not get_service_by_id(service_id):
-        return jsonify({'message': 'Service not found'}), 404
-
-    # Check if user exists
-    if not get_user_by_id(user_id):
-        return jsonify({'message': 'User not found'}), 404
-
-    sub_id = add_user_subscription(user_id, service_id, start_date, end_date, active)
-    if sub_id is not None:
-        return jsonify({'message': 'Subscription added successfully', 'subscription_id': sub_id}), 201
-    elif sub_id is None:
-         return jsonify({'message': 'User is already subscribed to this service'}), 409 # Conflict
-    return jsonify({'message': 'Failed to add subscription'}), 500
+    # Missing user/service (404) and duplicates (409) are raised by add_user_subscription
+    try:
+        sub_id = add_user_subscription(user_id, service_id, start_date, end_date, active, data.get('promo_code'))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    return jsonify({'message': 'Subscription added successfully', 'subscription_id': sub_id}), 201
 
 @app.route('/users/<int:user_id>/subscriptions/<int:service_id>', methods=['PUT'])
 def api_update_user_subscription(user_id, service_id):
+    require_session(user_id)
     data = request.get_json()
     active = data.get('active')
     end_date = data.get('end_date')
 
-    # Check if user and service exist
-    if not get_user_by_id(user_id):
-        return jsonify({'message': 'User not found'}), 404
-    if not get_service_by_id(service_id):
-        return jsonify({'message': 'Service not found'}), 404
-
     # Convert active to int if provided
     if active is not None:
         try:
             active = int(active)
         except ValueError:
             return jsonify({'message': 'Active status must be 0 or 1'}), 400
+    try:
+        if end_date: # '' clears it
+            check_date(end_date, 'end_date')
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
 
-    if update_user_subscription(user_id, service_id, active=active, end_date=end_date):
+    try:
+        updated = update_user_subscription(user_id, service_id, active=active, end_date=end_date,
+                                           promo_code=data.get('promo_code'))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    if updated:
         return jsonify({'message': 'Subscription updated successfully'}), 200
-    return jsonify({'message': 'Subscription not found or nothing to update'}), 404
+    return jsonify({'message': 'No update data provided'}), 400
 
 @app.route('/users/<int:user_id>/subscriptions/<int:service_id>', methods=['DELETE'])
 def api_delete_user_subscription(user_id, service_id):
-    # Check if user and service exist
-    if not get_user_by_id(user_id):
-        return jsonify({'message': 'User not found'}), 404
-    if not get_service_by_id(service_id):
-        return jsonify({'message': 'Service not found'}), 404
-
-    if delete_user_subscription(user_id, service_id):
-        return jsonify({'message': 'Subscription deleted successfully'}), 200
-    return jsonify({'message': 'Subscription not found'}), 404
+    require_session(user_id)
+    delete_user_subscription(user_id, service_id)
+    return jsonify({'message': 'Subscription deleted successfully'}), 200
+
+# --- Support Ticket API Routes ---
+# Customers file and follow their tickets under /users/<id>/tickets (session token required);
+# agents work the queues under /admin/tickets. See tickets.py for the queue indexes.
+
+def require_single_database():
+    # Tickets and the archive work on the users of DATABASE: not available with sharded storage.
+    if app.config['SHARDS']:
+        raise ConflictError(SINGLE_DATABASE_ONLY)
+
+def parse_queue_limit():
+    limit = request.args.get('limit', app.config['TICKETS_QUEUE_DEFAULT_LIMIT'])
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError("limit must be an integer")
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, app.config['TICKETS_QUEUE_MAX_LIMIT'])
+
+def parse_ticket_ids(data):
+    ids = data.get('ids')
+    if not isinstance(ids, list) or not ids or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        raise ValueError("ids must be a non-empty list of ticket ids")
+    if len(ids) > app.config['TICKETS_BULK_MAX_IDS']:
+        raise ValueError(f"at most {app.config['TICKETS_BULK_MAX_IDS']} ids per request")
+    return ids
+
+def message_failure(ticket_id, user_id=None):
+    # Why add_message() changed nothing: unknown ticket (404) or closed ticket (409).
+    state = tickets.ticket_state(get_db(), ticket_id)
+    if state is None or (user_id is not None and state[0] != user_id):
+        raise NotFoundError('Ticket not found')
+    raise ConflictError('Ticket is closed')
+
+def bulk_result(ids, updated):
+    updated_set = set(updated)
+    return jsonify({'updated': updated, 'skipped': [i for i in ids if i not in updated_set]})
+
+@app.route('/users/<int:user_id>/tickets', methods=['POST'])
+def api_open_ticket(user_id):
+    require_session(user_id)
+    require_single_database()
+    data = request.get_json(silent=True) or {}
+    subject = data.get('subject')
+    body = data.get('body')
+    subscription_id = data.get('subscription_id')
+
+    if not subject or not body:
+        return jsonify({'message': 'subject and body are required'}), 400
+    try:
+        priority = tickets.parse_priority(data.get('priority', 'normal'))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    if subscription_id is not None and not isinstance(subscription_id, int):
+        return jsonify({'message': 'subscription_id must be an integer'}), 400
+
+    try:
+        ticket_id, sla_due_at = run_write(tickets.open_ticket, user_id, subject, body, priority, subscription_id)
+    except LookupError as e:
+        raise NotFoundError(str(e))
+    except sqlite3.IntegrityError:
+        raise NotFoundError('User not found')
+    return jsonify({'message': 'Ticket created successfully', 'ticket_id': ticket_id, 'sla_due_at': sla_due_at}), 201
+
+@app.route('/users/<int:user_id>/tickets', methods=['GET'])
+def api_get_user_tickets(user_id):
+    require_session(user_id)
+    require_single_database()
+    return jsonify(tickets.user_tickets(get_db(), user_id))
+
+@app.route('/users/<int:user_id>/tickets/<int:ticket_id>', methods=['GET'])
+def api_get_user_ticket(user_id, ticket_id):
+    require_session(user_id)
+    require_single_database()
+    ticket = tickets.get_ticket(get_db(), ticket_id, user_id)
+    if ticket is None:
+        return jsonify({'message': 'Ticket not found'}), 404
+    return jsonify(ticket)
+
+@app.route('/users/<int:user_id>/tickets/<int:ticket_id>/messages', methods=['POST'])
+def api_add_user_ticket_message(user_id, ticket_id):
+    require_session(user_id)
+    require_single_database()
+    body = (request.get_json(silent=True) or {}).get('body')
+    if not body:
+        return jsonify({'message': 'body is required'}), 400
+    message_id = run_write(tickets.add_message, ticket_id, body, None, user_id)
+    if message_id is None:
+        message_failure(ticket_id, user_id)
+    return jsonify({'message': 'Message added successfully', 'message_id': message_id}), 201
+
+@app.route('/admin/tickets/queue', methods=['GET'])
+def api_ticket_queue():
+    # The next open tickets, in handling order (read only: POST /admin/tickets/next claims one).
+    require_single_database()
+    try:
+        limit = parse_queue_limit()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    return jsonify(tickets.work_queue(get_db(), limit))
+
+@app.route('/admin/tickets/next', methods=['POST'])
+def api_claim_next_ticket():
+    require_single_database()
+    assignee = (request.get_json(silent=True) or {}).get('assignee')
+    if not assignee:
+        return jsonify({'message': 'assignee is required'}), 400
+    ticket = run_write(tickets.claim_next, assignee)
+    if ticket is None:
+        return jsonify({'message': 'No ticket waiting'}), 404
+    return jsonify(ticket)
+
+@app.route('/admin/tickets/sla', methods=['GET'])
+def api_ticket_sla_queue():
+    # Unanswered tickets by first-response deadline; ?breached=1 keeps only the overdue ones.
+    require_single_database()
+    try:
+        limit = parse_queue_limit()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    now = tickets.utc_now()
+    before = now if request.args.get('breached') == '1' else None
+    queue = tickets.sla_queue(get_db(), limit, before)
+    for ticket in queue:
+        ticket['breached'] = ticket['sla_due_at'] < now
+    return jsonify(queue)
+
+@app.route('/admin/tickets', methods=['GET'])
+def api_agent_tickets():
+    # ?assignee=: the tickets an agent is working on, nearest deadline first.
+    require_single_database()
+    assignee = request.args.get('assignee')
+    if not assignee:
+        return jsonify({'message': 'assignee is required'}), 400
+    try:
+        limit = parse_queue_limit()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    return jsonify(tickets.agent_tickets(get_db(), assignee, limit))
+
+@app.route('/admin/tickets/<int:ticket_id>', methods=['GET'])
+def api_get_ticket(ticket_id):
+    require_single_database()
+    ticket = tickets.get_ticket(get_db(), ticket_id)
+    if ticket is None:
+        return jsonify({'message': 'Ticket not found'}), 404
+    return jsonify(ticket)
+
+@app.route('/admin/tickets/<int:ticket_id>/messages', methods=['POST'])
+def api_add_agent_ticket_message(ticket_id):
+    require_single_database()
+    data = request.get_json(silent=True) or {}
+    agent = data.get('agent')
+    body = data.get('body')
+    if not agent or not body:
+        return jsonify({'message': 'agent and body are required'}), 400
+    message_id = run_write(tickets.add_message, ticket_id, body, agent)
+    if message_id is None:
+        message_failure(ticket_id)
+    return jsonify({'message': 'Message added successfully', 'message_id': message_id}), 201
+
+@app.route('/admin/tickets/bulk/assign', methods=['POST'])
+def api_bulk_assign_tickets():
+    # {"ids": [...], "assignee": "..."}; assignee null puts the tickets back in the queue.
+    require_single_database()
+    data = request.get_json(silent=True) or {}
+    assignee = data.get('assignee')
+    try:
+        ids = parse_ticket_ids(data)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    if assignee is not None and (not isinstance(assignee, str) or not assignee):
+        return jsonify({'message': 'assignee must be a non-empty string or null'}), 400
+    return bulk_result(ids, run_write(tickets.assign_tickets, ids, assignee))
+
+@app.route('/admin/tickets/bulk/close', methods=['POST'])
+def api_bulk_close_tickets():
+    require_single_database()
+    try:
+        ids = parse_ticket_ids(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    return bulk_result(ids, run_write(tickets.close_tickets, ids))
+
+# --- Archive API Routes ---
+# Expired subscriptions and deleted accounts moved to the archive database by archive.py:
+# running the job, its state, and history lookups on a read-only connection to the archive.
+
+_archive_lock = threading.Lock() # one run at a time
+_last_archive_report = None
+
+def get_archive_path():
+    return app.config['ARCHIVE_DATABASE'] or archive.archive_path(app.config['DATABASE'])
+
+def read_archive(fn, *args):
+    # fn(conn, *args) on the archive; None while nothing was ever archived.
+    conn = archive.open_archive(get_archive_path())
+    if conn is None:
+        return None
+    try:
+        return fn(conn, *args)
+    finally:
+        conn.close()
+
+@app.route('/admin/archive', methods=['GET'])
+def api_archive_status():
+    require_single_database()
+    return jsonify({**archive.archive_status(get_db(), get_archive_path()), 'last_report': _last_archive_report})
+
+@app.route('/admin/archive/run', methods=['POST'])
+def api_archive_run():
+    global _last_archive_report
+    require_single_database()
+    days = (request.get_json(silent=True) or {}).get('days', app.config['ARCHIVE_AFTER_DAYS'])
+    if not isinstance(days, int) or isinstance(days, bool) or days < 0:
+        return jsonify({'message': 'days must be a non-negative integer'}), 400
+    if not _archive_lock.acquire(blocking=False):
+        return jsonify({'message': 'An archive run is already in progress'}), 409
+    try:
+        ensure_schema()
+        # Own connection, as for the expiry sweeps: it commits batch by batch and attaches the archive.
+        conn = open_connection(app.config['DATABASE'], app.config['DB_PRAGMAS'])
+        try:
+            report = archive.run(conn, get_archive_path(), days, batch_size=app.config['ARCHIVE_BATCH_SIZE'],
+                                 vacuum_step=app.config['ARCHIVE_VACUUM_STEP'])
+        finally:
+            conn.close()
+    finally:
+        _archive_lock.release()
+    _last_archive_report = report
+    return jsonify(report)
+
+@app.route('/admin/archive/users/<int:user_id>', methods=['GET'])
+def api_archived_user(user_id):
+    # The deleted account (if any) and the archived subscriptions of user_id.
+    require_single_database()
+    history = read_archive(archive.user_history, user_id)
+    if history is None:
+        return jsonify({'message': 'Nothing archived for this user'}), 404
+    return jsonify(history)
+
+@app.route('/users/<int:user_id>/subscriptions/history', methods=['GET'])
+def api_get_user_subscription_history(user_id):
+    require_session(user_id)
+    require_single_database()
+    subscriptions = read_archive(archive.archived_subscriptions, user_id)
+    if subscriptions:
+        return jsonify(subscriptions)
+    return jsonify({'message': 'No archived subscriptions for this user'}), 404
 
 # To run this Flask app:
 # 1. Save this code as `app.py`
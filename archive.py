@@ -0,0 +1,279 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+
+# --- Cold Archive ---
+# Moves cold rows out of the hot tables into an append-only archive database
+# (<DATABASE>.archive), attached to the job's connection, so the hot tables and
+# their indexes only hold what the API still works with:
+#   * subscriptions inactive with an end_date more than `days` ago, walked in
+#     end_date order through the (active, end_date) index;
+#   * deleted accounts: deleting a user leaves one row in deleted_users (a
+#     trigger, migration 14) with the account and the subscriptions the delete
+#     cascades to, as JSON. The job copies them to the archive and clears them.
+# Each batch is committed to the archive first, then removed from the hot
+# database in its own short transaction, and only if the archive holds it: a
+# crash in between leaves the rows in both places and the next run finishes
+# the move (INSERT OR IGNORE). Once done, incremental vacuum hands the freed
+# pages back to the file system, a step at a time. New databases are created
+# with auto_vacuum = INCREMENTAL (migrations.py); an existing one needs a full
+# VACUUM once: python archive.py --enable-incremental-vacuum.
+# The hot deletes go through the usual triggers, except for the change feed
+# (archiving is not a change): the dashboard no longer counts the archived
+# subscriptions and tickets about them lose their subscription_id.
+#   python archive.py --database extended_database.db [--days 90] [--user 3]
+
+SUBSCRIPTION_COLUMNS = ('id', 'user_id', 'service_id', 'active', 'start_date', 'end_date', 'price')
+USER_COLUMNS = ('id', 'email', 'first_name', 'last_name', 'deleted_at', 'archived_at')
+
+EXPIRED = 'expired' # reason of an archived subscription
+USER_DELETED = 'user_deleted'
+
+INCREMENTAL = 2 # PRAGMA auto_vacuum value
+
+ARCHIVE_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS archive.archived_users (
+        id INTEGER PRIMARY KEY, -- users.id
+        email TEXT NOT NULL,
+        first_name TEXT,
+        last_name TEXT,
+        deleted_at TEXT NOT NULL,
+        archived_at TEXT NOT NULL
+    );
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS archive.archived_subscriptions (
+        id INTEGER PRIMARY KEY, -- user_services.id
+        user_id INTEGER NOT NULL,
+        service_id INTEGER NOT NULL,
+        active INTEGER,
+        start_date TEXT,
+        end_date TEXT,
+        price REAL,
+        reason TEXT NOT NULL, -- 'expired' or 'user_deleted'
+        archived_at TEXT NOT NULL
+    );
+    ''',
+    "CREATE INDEX IF NOT EXISTS archive.idx_archived_subscriptions_user ON archived_subscriptions (user_id);",
+) + tuple(
+    f"CREATE TRIGGER IF NOT EXISTS archive.{table}_no_{event.lower()} BEFORE {event} ON {table} BEGIN "
+    f"SELECT RAISE(ABORT, 'the archive is append-only'); END;"
+    for table in ('archived_users', 'archived_subscriptions') for event in ('UPDATE', 'DELETE')
+)
+
+def archive_path(database):
+    return database + '.archive'
+
+def utc_now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def attach_archive(conn, path):
+    # Attaches the archive as `archive`, creating it if needed; outside any transaction.
+    conn.execute("ATTACH DATABASE ? AS archive;", (path,))
+    conn.execute("PRAGMA archive.journal_mode = WAL;") # history lookups keep reading while the job appends
+    # Whatever the hot database uses: a batch leaves it only once durably in the archive.
+    conn.execute("PRAGMA archive.synchronous = FULL;")
+    with conn:
+        for statement in ARCHIVE_SCHEMA:
+            conn.execute(statement)
+
+def open_archive(path):
+    # Read-only connection for history lookups, None while nothing was ever archived.
+    if not os.path.exists(path):
+        return None
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA query_only = ON;")
+    return conn
+
+# --- Archiving ---
+
+def archive_expired_subscriptions(conn, before, batch_size=500, pause=0.01, now=None):
+    """Moves inactive subscriptions that ended before `before` to the archive; returns (count, batches)."""
+    now = now or utc_now()
+    columns = ', '.join(SUBSCRIPTION_COLUMNS)
+    moved = batches = 0
+    while True:
+        ids = [row[0] for row in conn.execute(
+            "SELECT id FROM user_services WHERE active = 0 AND end_date < ? ORDER BY end_date LIMIT ?;",
+            (before, batch_size))]
+        if ids:
+            batch = json.dumps(ids)
+            with conn:
+                conn.execute(
+                    f"INSERT OR IGNORE INTO archive.archived_subscriptions ({columns}, reason, archived_at) "
+                    f"SELECT {columns}, '{EXPIRED}', ? FROM user_services WHERE id IN (SELECT value FROM json_each(?));",
+                    (now, batch))
+            with conn:
+                conn.execute("BEGIN IMMEDIATE;") # no other writer between reading MAX(seq) and the delete
+                last_change = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes;").fetchone()[0]
+                # Rows reactivated in between stay hot.
+                moved += conn.execute(
+                    "DELETE FROM user_services WHERE id IN (SELECT value FROM json_each(?1)) AND active = 0 "
+                    "AND end_date < ?2 AND id IN (SELECT id FROM archive.archived_subscriptions "
+                    "WHERE id IN (SELECT value FROM json_each(?1)));",
+                    (batch, before)).rowcount
+                # The triggers logged a deletion per row: archiving is not a change for feed consumers.
+                conn.execute("DELETE FROM changes WHERE seq > ?;", (last_change,))
+            batches += 1
+        if len(ids) < batch_size:
+            return moved, batches
+        time.sleep(pause) # let queued writers in between batches
+
+def archive_deleted_users(conn, batch_size=500, pause=0.01, now=None):
+    """Moves the accounts queued in deleted_users, with their subscriptions, to the archive; returns (count, batches)."""
+    now = now or utc_now()
+    fields = ', '.join(f"json_extract(s.value, '$.{column}')" for column in SUBSCRIPTION_COLUMNS)
+    moved = batches = 0
+    while True:
+        ids = [row[0] for row in conn.execute("SELECT id FROM deleted_users ORDER BY id LIMIT ?;", (batch_size,))]
+        if ids:
+            batch = json.dumps(ids)
+            with conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO archive.archived_users (id, email, first_name, last_name, deleted_at, "
+                    "archived_at) SELECT id, json_extract(data, '$.email'), json_extract(data, '$.first_name'), "
+                    "json_extract(data, '$.last_name'), deleted_at, ? FROM deleted_users "
+                    "WHERE id IN (SELECT value FROM json_each(?));",
+                    (now, batch))
+                conn.execute(
+                    f"INSERT OR IGNORE INTO archive.archived_subscriptions ({', '.join(SUBSCRIPTION_COLUMNS)}, "
+                    f"reason, archived_at) SELECT {fields}, '{USER_DELETED}', ? "
+                    f"FROM deleted_users d, json_each(d.data, '$.subscriptions') s "
+                    f"WHERE d.id IN (SELECT value FROM json_each(?));",
+                    (now, batch))
+            with conn:
+                moved += conn.execute(
+                    "DELETE FROM deleted_users WHERE id IN (SELECT value FROM json_each(?1)) "
+                    "AND id IN (SELECT id FROM archive.archived_users WHERE id IN (SELECT value FROM json_each(?1)));",
+                    (batch,)).rowcount
+            batches += 1
+        if len(ids) < batch_size:
+            return moved, batches
+        time.sleep(pause)
+
+def release_free_pages(conn, step=1000, pause=0.01):
+    """Incremental vacuum, `step` pages per transaction; returns the pages released (0 without auto_vacuum)."""
+    if conn.execute("PRAGMA auto_vacuum;").fetchone()[0] != INCREMENTAL:
+        return 0
+    released = 0
+    while True:
+        free = conn.execute("PRAGMA freelist_count;").fetchone()[0]
+        if not free:
+            break
+        # executescript steps the pragma to completion; execute() would free a single page.
+        conn.executescript(f"PRAGMA incremental_vacuum({min(free, step)});")
+        released += min(free, step)
+        time.sleep(pause)
+    if released:
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE);") # the file shrinks once the WAL is written back
+    return released
+
+def enable_incremental_vacuum(conn):
+    # Rewrites the whole file (VACUUM), blocking writers meanwhile: a maintenance-window operation.
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+    conn.execute("VACUUM;")
+
+def run(conn, archive, days=90, today=None, batch_size=500, pause=0.01, vacuum_step=1000):
+    """Archives deleted accounts and subscriptions ended more than `days` before `today`, then vacuums."""
+    started = time.perf_counter()
+    today = today or date.today().isoformat()
+    before = (date.fromisoformat(today) - timedelta(days=days)).isoformat()
+    now = utc_now()
+    attach_archive(conn, archive)
+    try:
+        users, user_batches = archive_deleted_users(conn, batch_size, pause, now)
+        subscriptions, subscription_batches = archive_expired_subscriptions(conn, before, batch_size, pause, now)
+    finally:
+        conn.execute("DETACH DATABASE archive;")
+    pages = release_free_pages(conn, vacuum_step, pause)
+    return {
+        'ended_before': before,
+        'deleted_users': users,
+        'expired_subscriptions': subscriptions,
+        'batches': user_batches + subscription_batches,
+        'pages_released': pages,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+# --- History Lookups ---
+# On a connection to the archive itself (open_archive) or with it attached: the table names are unique.
+
+def archived_subscriptions(conn, user_id):
+    return [dict(zip(SUBSCRIPTION_COLUMNS + ('reason', 'archived_at'), row)) for row in conn.execute(
+        f"SELECT {', '.join(SUBSCRIPTION_COLUMNS)}, reason, archived_at FROM archived_subscriptions "
+        f"WHERE user_id = ? ORDER BY end_date DESC, id;", (user_id,))]
+
+def user_history(conn, user_id):
+    # {'user': archived account or None, 'subscriptions': [...]}, None when nothing is archived for user_id.
+    row = conn.execute(f"SELECT {', '.join(USER_COLUMNS)} FROM archived_users WHERE id = ?;", (user_id,)).fetchone()
+    subscriptions = archived_subscriptions(conn, user_id)
+    if row is None and not subscriptions:
+        return None
+    return {'user': dict(zip(USER_COLUMNS, row)) if row is not None else None, 'subscriptions': subscriptions}
+
+def archive_status(conn, archive):
+    # Sizes and counts for GET /admin/archive; conn is the hot database.
+    status = {
+        'path': archive,
+        'pending_deleted_users': conn.execute("SELECT COUNT(*) FROM deleted_users;").fetchone()[0],
+        'hot_pages': conn.execute("PRAGMA page_count;").fetchone()[0],
+        'free_pages': conn.execute("PRAGMA freelist_count;").fetchone()[0],
+        'incremental_vacuum': conn.execute("PRAGMA auto_vacuum;").fetchone()[0] == INCREMENTAL,
+        'archived_users': 0,
+        'archived_subscriptions': 0,
+        'size_bytes': 0,
+    }
+    archive_conn = open_archive(archive)
+    if archive_conn is not None:
+        try:
+            status['archived_users'] = archive_conn.execute("SELECT COUNT(*) FROM archived_users;").fetchone()[0]
+            status['archived_subscriptions'] = archive_conn.execute(
+                "SELECT COUNT(*) FROM archived_subscriptions;").fetchone()[0]
+        finally:
+            archive_conn.close()
+        status['size_bytes'] = os.path.getsize(archive)
+    return status
+
+# --- Command Line Interface ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive expired subscriptions and deleted accounts, then vacuum.")
+    parser.add_argument('--database', default='extended_database.db')
+    parser.add_argument('--archive', help="Archive database, defaults to <database>.archive")
+    parser.add_argument('--days', type=int, default=90, help="Archive subscriptions ended more than this many days ago")
+    parser.add_argument('--as-of', help="Reference date (YYYY-MM-DD), defaults to today")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--user', type=int, help="Print the archived history of this user instead")
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help="Switch an existing database to auto_vacuum = INCREMENTAL (full VACUUM)")
+    args = parser.parse_args(argv)
+    archive = args.archive or archive_path(args.database)
+
+    if args.user is not None:
+        conn = open_archive(archive)
+        history = user_history(conn, args.user) if conn is not None else None
+        if conn is not None:
+            conn.close()
+        print(json.dumps(history))
+        return 0 if history is not None else 1
+
+    conn = sqlite3.connect(args.database)
+    conn.execute("PRAGMA busy_timeout = 5000;")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute("PRAGMA foreign_keys = ON;")
+    try:
+        if args.enable_incremental_vacuum:
+            enable_incremental_vacuum(conn)
+        result = run(conn, archive, args.days, args.as_of, args.batch_size)
+    finally:
+        conn.close()
+    print(json.dumps(result))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,785 @@
+import asyncio
+import contextvars
+import json
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs
+
+from werkzeug.test import EnvironBuilder
+
+import app as flask_module
+import metrics
+from app import (SUBSCRIPTION_COLUMNS, USER_FIELDS, USER_SERVICE_SUBSCRIPTION_FIELDS, ForbiddenError,
+                 bump_token_epoch, change_subscription, check_admin_token, check_date, insert_subscription,
+                 insert_user, build_search_query, encode_cursor, get_subscriptions_batch, issue_session,
+                 load_token_epoch, parse_changes_args, parse_page_args, parse_subscription_filters, read_session,
+                 session_epochs, user_subscriptions_query, users_page)
+from change_feed import fetch_changes, format_sse
+from db_pool import open_connection
+from login_guard import LoginRateLimited
+from passwords import PasswordPoolBusy
+from serialization import (COMPRESSIBLE_MIMETYPES, accepted_encoding, compress, fetch_record, fetch_records,
+                           parse_fields)
+from session_tokens import DELETED, InvalidSession
+
+# --- Async ASGI Entry Point ---
+# Same routes and JSON contracts as app.py, served by an ASGI server:
+#   uvicorn asgi_app:app --workers 1
+# The request-path routes (users, login, search, services, subscriptions) are
+# handled natively: the event loop never blocks, SQLite work runs on dedicated
+# DB threads (one writer, a few readers, one connection per thread) and bcrypt
+# in the password process pool. Every other route (admin, metrics, bulk,
+# pricing) is forwarded to the Flask app on a worker thread.
+#
+# Native routes are instrumented like the Flask ones (request counter, latency
+# and per-request SQL histograms, under the same Flask route rule): the
+# statements each DB-thread call runs are added to the RequestStats of the
+# request awaiting it, held in a context variable.
+
+flask_app = flask_module.app
+
+_request_stats = contextvars.ContextVar('request_stats', default=None)
+
+def count_sql(stats):
+    # Adds a DB-thread call's statements to the current request's metrics.RequestStats.
+    current = _request_stats.get()
+    if current is not None and stats is not None:
+        current.statements += stats.statements
+        current.sql_seconds += stats.sql_seconds
+
+class AsyncDatabase:
+    """aiosqlite-style access: each call runs fn(conn, *args) on a DB thread and is awaited."""
+
+    def __init__(self, database, pragmas, read_threads=4, group_writer=None):
+        self.database = database
+        self.pragmas = pragmas
+        self.group_writer = group_writer # group_commit.GroupCommitWriter shared with the Flask routes, if enabled
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._readers = ThreadPoolExecutor(max_workers=read_threads, thread_name_prefix='db-reader')
+        self._local = threading.local()
+
+    def _call(self, read_only, fn, args):
+        # Returns (result, metrics.RequestStats of the call).
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = open_connection(self.database, self.pragmas, read_only,
+                                                      factory=metrics.InstrumentedConnection,
+                                                      trace=metrics.trace_statement)
+        stats = metrics.begin_request()
+        try:
+            result = fn(conn, *args)
+            if not read_only:
+                conn.commit()
+            return result, stats
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            metrics.end_request()
+
+    async def read(self, fn, *args):
+        result, stats = await asyncio.get_running_loop().run_in_executor(self._readers, self._call, True, fn, args)
+        count_sql(stats)
+        return result
+
+    def _call_snapshot(self, snapshots, max_staleness, timeout, fn, args):
+        # fn on a snapshot within max_staleness, else on this thread's primary connection; returns (result, age, stats).
+        acquired = snapshots.acquire(max_staleness, timeout)
+        if acquired is None:
+            return *self._call(True, fn, args), 0.0
+        conn, snapshot = acquired
+        stats = metrics.begin_request()
+        try:
+            return fn(conn, *args), stats, snapshot.age
+        finally:
+            metrics.end_request()
+            snapshots.release(conn)
+
+    async def read_snapshot(self, snapshots, max_staleness, timeout, fn, *args):
+        result, stats, age = await asyncio.get_running_loop().run_in_executor(
+            self._readers, self._call_snapshot, snapshots, max_staleness, timeout, fn, args)
+        count_sql(stats)
+        return result, age
+
+    async def write(self, fn, *args):
+        # fn(conn, *args) is a mutation: it is committed by the caller of fn, never by fn itself.
+        if self.group_writer is not None:
+            future = self.group_writer.submit(fn, *args)
+            try:
+                return await asyncio.wrap_future(future)
+            finally:
+                count_sql(getattr(future, 'sql_stats', None))
+        result, stats = await asyncio.get_running_loop().run_in_executor(self._writer, self._call, False, fn, args)
+        count_sql(stats)
+        return result
+
+    def close(self):
+        self._writer.shutdown()
+        self._readers.shutdown()
+
+_db = None
+_db_lock = threading.Lock()
+
+SHARDS_UNSUPPORTED = "asgi_app does not support sharded storage (SHARDS): serve app.py instead"
+
+def get_async_db():
+    global _db
+    if flask_app.config['SHARDS']:
+        raise RuntimeError(SHARDS_UNSUPPORTED)
+    with _db_lock:
+        if _db is None or _db.database != flask_app.config['DATABASE']:
+            flask_module.ensure_schema()
+            _db = AsyncDatabase(flask_app.config['DATABASE'], flask_app.config['DB_PRAGMAS'],
+                                flask_app.config['DB_READ_POOL_SIZE'], flask_module.get_group_writer())
+        return _db
+
+async def read_reporting(request, fn, *args):
+    # app.acquire_snapshot() counterpart for the reporting routes: (result, response headers).
+    snapshots = flask_module.get_snapshots()
+    if snapshots is None:
+        return await get_async_db().read(fn, *args), {}
+    if not snapshots.running:
+        snapshots.start()
+    max_staleness = flask_module.snapshot_staleness(request.headers.get('x-max-staleness'))
+    result, age = await get_async_db().read_snapshot(snapshots, max_staleness, flask_app.config['DB_POOL_TIMEOUT'],
+                                                     fn, *args)
+    return result, {'X-Snapshot-Age': f'{age:.3f}'}
+
+async def hash_password(password):
+    return await asyncio.wrap_future(flask_module.get_password_hasher().submit_hash(password))
+
+async def verify_password(hashed_password, provided_password):
+    return await asyncio.wrap_future(flask_module.get_password_hasher().submit_verify(hashed_password, provided_password))
+
+async def simulate_password_check(guard):
+    if guard.verify_seconds is not None:
+        await asyncio.sleep(guard.verify_seconds)
+    else:
+        # First time only: a real dummy verify measures the duration (see app.simulate_password_check).
+        await asyncio.get_running_loop().run_in_executor(None, flask_module.simulate_password_check, guard)
+
+# --- Request / Response helpers ---
+
+class Request:
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.body = body
+        self.args = {k: v[-1] for k, v in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get('headers', [])}
+
+    def get_json(self):
+        try:
+            data = json.loads(self.body or b'null')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+
+class Response:
+    def __init__(self, body=b'', status=200, content_type='application/json', headers=None):
+        self.body = body
+        self.status = status
+        self.headers = [(b'content-type', content_type.encode('latin-1'))]
+        for name, value in (headers or {}).items():
+            self.headers.append((name.lower().encode('latin-1'), str(value).encode('latin-1')))
+
+    async def send(self, send, head=False):
+        # HEAD: the GET response's headers, Content-Length included, without the body.
+        await send({'type': 'http.response.start', 'status': self.status,
+                    'headers': self.headers + [(b'content-length', str(len(self.body)).encode())]})
+        await send({'type': 'http.response.body', 'body': b'' if head else self.body})
+
+def json_response(payload, status=200, headers=None):
+    return Response(flask_app.json.encode(payload), status, headers=headers)
+
+def message(text, status):
+    return json_response({'message': text}, status)
+
+class StreamingResponse:
+    def __init__(self, chunks, content_type, headers=None):
+        self.chunks = chunks
+        self.status = 200
+        self.headers = [(b'content-type', content_type.encode('latin-1'))]
+        for name, value in (headers or {}).items():
+            self.headers.append((name.lower().encode('latin-1'), str(value).encode('latin-1')))
+
+    async def send(self, send, head=False):
+        await send({'type': 'http.response.start', 'status': self.status, 'headers': self.headers})
+        if head: # the length is not known without producing the stream
+            await self.chunks.aclose()
+        else:
+            async for chunk in self.chunks:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+def compress_response(response, accept_encoding):
+    # Same rules as app.compress_response().
+    headers = {name for name, _ in response.headers}
+    content_type = dict(response.headers)[b'content-type'].split(b';')[0].decode('latin-1')
+    if (response.status < 200 or content_type not in COMPRESSIBLE_MIMETYPES or b'etag' in headers
+            or b'content-encoding' in headers or len(response.body) < flask_app.config['COMPRESSION_MIN_SIZE']):
+        return
+    response.headers.append((b'vary', b'Accept-Encoding'))
+    encoding = accepted_encoding(accept_encoding)
+    if encoding is not None:
+        response.body = compress(response.body, encoding, flask_app.config['COMPRESSION_LEVEL'])
+        response.headers.append((b'content-encoding', encoding.encode('latin-1')))
+
+# --- Database functions (run on the DB threads) ---
+
+def db_user_by_id(conn, user_id, fields):
+    return fetch_record(conn, f"SELECT {', '.join(fields)} FROM users WHERE id = ?;", (user_id,))
+
+def db_user_by_email(conn, email):
+    row = conn.execute("SELECT id, email, password, first_name, last_name, token_epoch FROM users WHERE email = ?;",
+                       (email,)).fetchone()
+    return dict(row) if row else None
+
+def db_add_user(conn, email, hashed, first_name, last_name):
+    try:
+        return insert_user(conn, email, hashed, first_name, last_name)
+    except sqlite3.IntegrityError:
+        return None
+
+def db_update_user(conn, user_id, updates):
+    # Returns 'ok', 'not_found' or 'conflict'.
+    columns = ', '.join(f'{column} = ?' for column in updates)
+    try:
+        row = conn.execute(f"UPDATE users SET {columns} WHERE id = ? RETURNING id;",
+                           [*updates.values(), user_id]).fetchone()
+    except sqlite3.IntegrityError:
+        return 'conflict'
+    return 'ok' if row else 'not_found'
+
+def db_delete_user(conn, user_id):
+    return conn.execute("DELETE FROM users WHERE id = ?;", (user_id,)).rowcount > 0
+
+def db_search(conn, query, params):
+    return fetch_records(conn, query, params)
+
+def db_catalog(conn):
+    return flask_module.catalog_cache.get(conn)
+
+def db_user_subscriptions(conn, user_id, fields):
+    return fetch_records(conn, user_subscriptions_query(fields), (user_id,))
+
+def db_user_service_subscription(conn, user_id, service_id, fields):
+    return fetch_record(conn, user_subscriptions_query(fields, one_service=True), (user_id, service_id))
+
+def db_missing_parent(conn, user_id, service_id):
+    if conn.execute("SELECT 1 FROM users WHERE id = ?;", (user_id,)).fetchone() is None:
+        return 'User not found'
+    try:
+        service_id = int(service_id)
+    except (TypeError, ValueError):
+        return 'Service not found'
+    if service_id not in flask_module.catalog_cache.get(conn).by_id:
+        return 'Service not found'
+    return None
+
+def db_add_subscription(conn, user_id, service_id, start_date, end_date, active, promo_code):
+    # Returns (subscription_id, error_message, status)
+    try:
+        return insert_subscription(conn, user_id, service_id, active, start_date, end_date, promo_code)[0], None, 201
+    except ValueError as e:
+        return None, str(e), 400
+    except sqlite3.IntegrityError as e:
+        if 'FOREIGN KEY' in str(e):
+            return None, db_missing_parent(conn, user_id, service_id) or 'User or service not found', 404
+        return None, 'User is already subscribed to this service', 409
+
+def db_change_subscription(conn, sql, params, user_id, service_id):
+    # Runs an UPDATE/DELETE ... RETURNING id; returns None or the not-found message.
+    row = conn.execute(sql, params).fetchone()
+    if row is None:
+        return db_missing_parent(conn, user_id, service_id) or 'Subscription not found'
+    return None
+
+def db_update_subscription(conn, user_id, service_id, updates):
+    # Returns (error_message, status), (None, 200) once updated and repriced.
+    try:
+        if change_subscription(conn, user_id, service_id, updates) is None:
+            return db_missing_parent(conn, user_id, service_id) or 'Subscription not found', 404
+    except ValueError as e:
+        return str(e), 400
+    return None, 200
+
+# --- Session tokens ---
+
+async def current_token_epoch(user_id):
+    epoch = session_epochs.get(user_id)
+    if epoch is None:
+        epoch = await get_async_db().read(load_token_epoch, user_id)
+        session_epochs.set(user_id, epoch)
+    return epoch
+
+async def require_session(request, user_id):
+    # Same checks as app.require_session(); InvalidSession / ForbiddenError are turned into 401 / 403 by app().
+    if not flask_app.config['SESSION_AUTH_REQUIRED']:
+        return
+    token_user_id, epoch = read_session(request.headers.get('authorization'))
+    if token_user_id != user_id:
+        raise ForbiddenError('Session token does not belong to this user')
+    if epoch != await current_token_epoch(user_id):
+        raise InvalidSession('Session revoked')
+
+# --- Route handlers ---
+
+async def index(request):
+    return Response(b"Welcome to the Extended Flask App!", content_type='text/html; charset=utf-8')
+
+async def add_user(request):
+    data = request.get_json() or {}
+    email, password = data.get('email'), data.get('password')
+    first_name, last_name = data.get('first_name'), data.get('last_name')
+    if not all([email, password, first_name, last_name]):
+        return message('Missing data', 400)
+    hashed = await hash_password(password)
+    user_id = await get_async_db().write(db_add_user, email, hashed, first_name, last_name)
+    if user_id:
+        flask_module.forget_missing_emails([email])
+        return json_response({'message': 'User created successfully', 'user_id': user_id}, 201)
+    return message('User with this email already exists or another error occurred', 409)
+
+async def list_users(request):
+    try:
+        fields = parse_fields(request.args.get('fields'), USER_FIELDS)
+    except ValueError as e:
+        return message(str(e), 400)
+    if request.args.get('format') == 'ndjson':
+        fetch_size = flask_app.config['EXPORT_FETCH_SIZE']
+        encode = flask_app.json.encode
+        # The first page is read before the response starts, for its X-Snapshot-Age.
+        (users, last_id), headers = await read_reporting(request, users_page, 0, fetch_size, fields)
+
+        async def chunks():
+            # Keyset pages instead of one long-lived cursor: each page is a short DB-thread call.
+            page, after_id = users, last_id
+            while page:
+                yield b''.join(encode(user) + b'\n' for user in page)
+                (page, after_id), _ = await read_reporting(request, users_page, after_id, fetch_size, fields)
+
+        return StreamingResponse(chunks(), 'application/x-ndjson', headers)
+
+    try:
+        limit, after_id = parse_page_args(flask_app.config['USERS_PAGE_DEFAULT_LIMIT'],
+                                          flask_app.config['USERS_PAGE_MAX_LIMIT'], request.args)
+    except ValueError as e:
+        return message(str(e), 400)
+    (users, last_id), headers = await read_reporting(request, users_page, after_id, limit, fields)
+    next_cursor = encode_cursor(last_id) if len(users) == limit else None
+    return json_response({'users': users, 'next_cursor': next_cursor}, headers=headers)
+
+async def get_user(request, user_id):
+    await require_session(request, user_id)
+    try:
+        fields = parse_fields(request.args.get('fields'), USER_FIELDS)
+    except ValueError as e:
+        return message(str(e), 400)
+    user = await get_async_db().read(db_user_by_id, user_id, fields)
+    if user:
+        return json_response(user)
+    return message('User not found', 404)
+
+async def update_user(request, user_id):
+    await require_session(request, user_id)
+    data = request.get_json() or {}
+    updates = {column: data[column] for column in ('email', 'first_name', 'last_name') if data.get(column)}
+    if data.get('password'):
+        updates['password'] = await hash_password(data['password'])
+    if not updates:
+        return message('No update data provided', 400)
+    result = await get_async_db().write(db_update_user, user_id, updates)
+    if result == 'not_found':
+        return message('User not found', 404)
+    if result == 'conflict':
+        return message('A user with this email already exists', 409)
+    if 'email' in updates:
+        flask_module.forget_missing_emails([updates['email']])
+    if 'password' in updates:
+        epoch = await get_async_db().write(bump_token_epoch, user_id)
+        session_epochs.set(user_id, epoch if epoch is not None else DELETED)
+        return json_response({'message': 'User updated successfully', **issue_session(user_id, epoch)})
+    return message('User updated successfully', 200)
+
+async def delete_user(request, user_id):
+    await require_session(request, user_id)
+    if await get_async_db().write(db_delete_user, user_id):
+        session_epochs.set(user_id, DELETED)
+        return message('User deleted successfully', 200)
+    return message('User not found', 404)
+
+async def login(request):
+    data = request.get_json() or {}
+    email, password = data.get('email'), data.get('password')
+    if not all([email, password]):
+        return message('Email and password are required', 400)
+    # Same guard as app.login(): rate limits and unknown-email cache before any DB or bcrypt work.
+    guard = flask_module.get_login_guard()
+    # Behind a reverse proxy, the ASGI server rewrites the client from X-Forwarded-For
+    # (uvicorn --proxy-headers --forwarded-allow-ips=<proxy>).
+    client = request.scope.get('client')
+    client = client[0] if client else None
+    if guard is not None:
+        try:
+            guard.check(client, email)
+        except LoginRateLimited as e:
+            return json_response({'message': 'Too many login attempts, please retry later'}, 429,
+                                 headers={'Retry-After': max(1, int(e.retry_after + 0.999))})
+        if guard.is_known_missing(email):
+            await simulate_password_check(guard)
+            return message('Invalid credentials', 401)
+
+    db = get_async_db()
+    user = await db.read(db_user_by_email, email)
+    if user is None and guard is not None:
+        guard.remember_missing(email)
+        await simulate_password_check(guard)
+        return message('Invalid credentials', 401)
+
+    started = time.perf_counter()
+    if user and await verify_password(user['password'], password):
+        if guard is not None:
+            guard.observe_verify(time.perf_counter() - started)
+            guard.record_success(client, email)
+        hasher = flask_module.get_password_hasher()
+        if hasher.needs_rehash(user['password']):
+            await db.write(db_update_user, user['id'], {'password': await hash_password(password)})
+        session_epochs.set(user['id'], user['token_epoch'])
+        return json_response({'message': 'Login successful', 'user_id': user['id'], 'email': user['email'],
+                              **issue_session(user['id'], user['token_epoch'])})
+    if guard is not None and user:
+        guard.observe_verify(time.perf_counter() - started)
+        guard.record_failure(client, email)
+    return message('Invalid credentials', 401)
+
+async def search_users(request):
+    email, first_name, last_name = (request.args.get(k) for k in ('email', 'first_name', 'last_name'))
+    if not any([email, first_name, last_name]):
+        return message('Please provide at least one search parameter (email, first_name, or last_name)', 400)
+    try:
+        limit = min(int(request.args.get('limit', flask_app.config['SEARCH_DEFAULT_LIMIT'])),
+                    flask_app.config['SEARCH_MAX_LIMIT'])
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return message('limit and offset must be integers', 400)
+    if limit < 1 or offset < 0:
+        return message('limit must be positive and offset non-negative', 400)
+    try:
+        fields = parse_fields(request.args.get('fields'), USER_FIELDS)
+    except ValueError as e:
+        return message(str(e), 400)
+    users, headers = await read_reporting(request, db_search, *build_search_query(email, first_name, last_name, limit,
+                                                                                offset, fields))
+    if users or offset > 0:
+        return json_response({'users': users, 'next_offset': offset + limit if len(users) == limit else None},
+                             headers=headers)
+    return message('No users found matching the criteria', 404)
+
+NOTIFIER_CHECK_SECONDS = 0.05
+
+async def wait_for_notification(version, timeout):
+    # Async counterpart of ChangeNotifier.wait(): checks the version instead of blocking on the condition.
+    notifier = flask_module.change_notifier
+    deadline = time.monotonic() + timeout
+    while notifier.version == version and time.monotonic() < deadline:
+        await asyncio.sleep(NOTIFIER_CHECK_SECONDS)
+
+async def list_changes(request):
+    check_admin_token(request.headers.get('x-admin-token')) # see app.api_get_changes()
+    try:
+        since, limit, wait = parse_changes_args(request.args, request.headers.get('last-event-id'))
+    except ValueError as e:
+        return message(str(e), 400)
+    db = get_async_db()
+    poll_interval = flask_app.config['CHANGES_POLL_INTERVAL']
+
+    if 'text/event-stream' in request.headers.get('accept', ''):
+        heartbeat = flask_app.config['CHANGES_HEARTBEAT_SECONDS']
+
+        async def events():
+            nonlocal since
+            last_sent = time.monotonic()
+            yield b'retry: 1000\n\n'
+            while True:
+                version = flask_module.change_notifier.version
+                changes = await db.read(fetch_changes, since, limit)
+                if changes:
+                    since = changes[-1]['seq']
+                    last_sent = time.monotonic()
+                    yield ''.join(format_sse(change) for change in changes).encode('utf-8')
+                    continue
+                if time.monotonic() - last_sent >= heartbeat:
+                    last_sent = time.monotonic()
+                    yield b': keep-alive\n\n'
+                await wait_for_notification(version, poll_interval)
+
+        return StreamingResponse(events(), 'text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    deadline = time.monotonic() + wait
+    while True:
+        version = flask_module.change_notifier.version
+        changes = await db.read(fetch_changes, since, limit)
+        remaining = deadline - time.monotonic()
+        if changes or remaining <= 0:
+            break
+        await wait_for_notification(version, min(remaining, poll_interval))
+    return json_response({'changes': changes, 'next_since': changes[-1]['seq'] if changes else since})
+
+def catalog_response(request, body, etag):
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': f"public, max-age={flask_app.config['CATALOG_CACHE_MAX_AGE']}"}
+    if f'"{etag}"' in request.headers.get('if-none-match', ''):
+        return Response(b'', 304, headers=headers)
+    return Response(body, headers=headers)
+
+async def list_services(request):
+    catalog = await get_async_db().read(db_catalog)
+    return catalog_response(request, catalog.body, catalog.etag)
+
+async def get_service(request, service_id):
+    catalog = await get_async_db().read(db_catalog)
+    if service_id in catalog.by_id:
+        return catalog_response(request, catalog.bodies_by_id[service_id], catalog.etags_by_id[service_id])
+    return message('Service not found', 404)
+
+async def list_user_subscriptions(request, user_id):
+    await require_session(request, user_id)
+    try:
+        fields = parse_fields(request.args.get('fields'), SUBSCRIPTION_COLUMNS)
+    except ValueError as e:
+        return message(str(e), 400)
+    subscriptions = await get_async_db().read(db_user_subscriptions, user_id, fields)
+    if subscriptions:
+        return json_response(subscriptions)
+    return message('No subscriptions found for this user', 404)
+
+async def list_subscriptions_batch(request):
+    check_admin_token(request.headers.get('x-admin-token')) # see app.api_get_subscriptions_batch()
+    try:
+        filters = parse_subscription_filters(request.args, flask_app.config['SUBSCRIPTIONS_BATCH_MAX_IDS'])
+        limit, after_id = parse_page_args(flask_app.config['SUBSCRIPTIONS_PAGE_DEFAULT_LIMIT'],
+                                          flask_app.config['SUBSCRIPTIONS_PAGE_MAX_LIMIT'], request.args)
+    except ValueError as e:
+        return message(str(e), 400)
+    (groups, next_after_id), headers = await read_reporting(
+        request, get_subscriptions_batch, filters.get('user_ids'), filters.get('service_id'), filters.get('active'),
+        after_id, limit, filters['fields'])
+    next_cursor = encode_cursor(next_after_id) if next_after_id is not None else None
+    return json_response({'users': groups, 'next_cursor': next_cursor}, headers=headers)
+
+async def get_user_subscription(request, user_id, service_id):
+    await require_session(request, user_id)
+    try:
+        fields = parse_fields(request.args.get('fields'), SUBSCRIPTION_COLUMNS, USER_SERVICE_SUBSCRIPTION_FIELDS)
+    except ValueError as e:
+        return message(str(e), 400)
+    subscription = await get_async_db().read(db_user_service_subscription, user_id, service_id, fields)
+    if subscription:
+        return json_response(subscription)
+    return message('Subscription not found', 404)
+
+async def add_subscription(request, user_id):
+    await require_session(request, user_id)
+    data = request.get_json() or {}
+    service_id = data.get('service_id')
+    if not service_id:
+        return message('Service ID is required', 400)
+    start_date = data.get('start_date', datetime.now().strftime('%Y-%m-%d'))
+    end_date = data.get('end_date') or None
+    try:
+        check_date(start_date, 'start_date')
+        if end_date is not None:
+            check_date(end_date, 'end_date') # compared as TEXT by the expiry sweep
+    except ValueError as e:
+        return message(str(e), 400)
+    sub_id, error, status = await get_async_db().write(
+        db_add_subscription, user_id, service_id, start_date, end_date,
+        1 if data.get('active') is None else data['active'], data.get('promo_code'))
+    if error:
+        return message(error, status)
+    return json_response({'message': 'Subscription added successfully', 'subscription_id': sub_id}, 201)
+
+async def update_subscription(request, user_id, service_id):
+    await require_session(request, user_id)
+    data = request.get_json() or {}
+    updates = {}
+    if data.get('active') is not None:
+        try:
+            updates['active'] = int(data['active'])
+        except (TypeError, ValueError):
+            return message('Active status must be 0 or 1', 400)
+    if data.get('end_date') is not None:
+        updates['end_date'] = data['end_date'] or None # '' clears the end date
+        try:
+            if updates['end_date'] is not None:
+                check_date(updates['end_date'], 'end_date')
+        except ValueError as e:
+            return message(str(e), 400)
+    if data.get('promo_code') is not None:
+        updates['promo_code'] = data['promo_code'] # '' clears the code
+    if not updates:
+        return message('No update data provided', 400)
+    error, status = await get_async_db().write(db_update_subscription, user_id, service_id, updates)
+    if error:
+        return message(error, status)
+    return message('Subscription updated successfully', 200)
+
+async def delete_subscription(request, user_id, service_id):
+    await require_session(request, user_id)
+    error = await get_async_db().write(
+        db_change_subscription, "DELETE FROM user_services WHERE user_id = ? AND service_id = ? RETURNING id;",
+        (user_id, service_id), user_id, service_id)
+    if error:
+        return message(error, 404)
+    return message('Subscription deleted successfully', 200)
+
+# Flask rules, so that the metrics of both entry points share their route labels.
+ROUTES = [
+    ('GET', '/', index),
+    ('POST', '/users', add_user),
+    ('GET', '/users', list_users),
+    ('GET', '/users/<int:user_id>', get_user),
+    ('PUT', '/users/<int:user_id>', update_user),
+    ('DELETE', '/users/<int:user_id>', delete_user),
+    ('POST', '/login', login),
+    ('GET', '/search/users', search_users),
+    ('GET', '/services', list_services),
+    ('GET', '/services/<int:service_id>', get_service),
+    ('GET', '/subscriptions', list_subscriptions_batch),
+    ('GET', '/changes', list_changes),
+    ('GET', '/users/<int:user_id>/subscriptions', list_user_subscriptions),
+    ('GET', '/users/<int:user_id>/subscriptions/<int:service_id>', get_user_subscription),
+    ('POST', '/users/<int:user_id>/subscriptions', add_subscription),
+    ('PUT', '/users/<int:user_id>/subscriptions/<int:service_id>', update_subscription),
+    ('DELETE', '/users/<int:user_id>/subscriptions/<int:service_id>', delete_subscription),
+]
+COMPILED_ROUTES = [(method, re.compile(re.sub(r'<int:\w+>', r'(\\d+)', rule) + '$'), handler, rule)
+                   for method, rule, handler in ROUTES]
+
+def match_route(method, path):
+    # (handler, int arguments, Flask rule), or (None, None, None) for the routes left to Flask.
+    for route_method, pattern, handler, rule in COMPILED_ROUTES:
+        if route_method == method or (method == 'HEAD' and route_method == 'GET'):
+            match = pattern.match(path)
+            if match:
+                return handler, [int(group) for group in match.groups()], rule
+    return None, None, None
+
+# --- WSGI fallback for the remaining routes ---
+
+_wsgi_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='wsgi-fallback')
+
+def run_wsgi(scope, body):
+    headers = [(k.decode('latin-1'), v.decode('latin-1')) for k, v in scope.get('headers', [])]
+    environ = EnvironBuilder(
+        path=scope.get('root_path', '') + scope['path'], method=scope['method'], headers=headers, data=body,
+        query_string=scope.get('query_string', b'').decode('latin-1'),
+    ).get_environ()
+    captured = {}
+
+    def start_response(status, response_headers, exc_info=None):
+        captured['status'] = int(status.split(' ', 1)[0])
+        captured['headers'] = response_headers
+
+    result = flask_app.wsgi_app(environ, start_response)
+    try:
+        content = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return captured['status'], captured['headers'], content
+
+async def forward_to_flask(scope, body, send):
+    # Flask records its own request metrics (app.record_request_metrics).
+    status, headers, content = await asyncio.get_running_loop().run_in_executor(_wsgi_executor, run_wsgi, scope, body)
+    raw_headers = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers
+                   if k.lower() != 'content-length' or scope['method'] == 'HEAD']
+    if scope['method'] != 'HEAD': # Flask already sent the GET body's length, with an empty body
+        raw_headers.append((b'content-length', str(len(content)).encode()))
+    await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+    await send({'type': 'http.response.body', 'body': content})
+
+# --- ASGI application ---
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        event = await receive()
+        if event['type'] == 'http.disconnect':
+            break
+        chunks.append(event.get('body', b''))
+        if not event.get('more_body'):
+            break
+    return b''.join(chunks)
+
+async def lifespan(receive, send):
+    while True:
+        event = await receive()
+        if event['type'] == 'lifespan.startup':
+            if flask_app.config['SHARDS']:
+                await send({'type': 'lifespan.startup.failed', 'message': SHARDS_UNSUPPORTED})
+                return
+            flask_module.ensure_schema()
+            if flask_app.config['EXPIRY_SCHEDULER_ENABLED']:
+                flask_module.expiry_scheduler.start()
+            snapshots = flask_module.get_snapshots()
+            if snapshots is not None:
+                snapshots.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif event['type'] == 'lifespan.shutdown':
+            flask_module.expiry_scheduler.stop()
+            if flask_module._snapshots is not None:
+                flask_module._snapshots.close()
+            if _db is not None:
+                _db.close()
+            if flask_module._group_writer is not None:
+                flask_module._group_writer.stop()
+            flask_module.get_password_hasher().shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    body = await read_body(receive)
+    handler, params, rule = match_route(scope['method'], scope['path'])
+    if handler is None:
+        return await forward_to_flask(scope, body, send)
+
+    # Same instrumentation as app.start_request_metrics() / app.record_request_metrics().
+    started = time.perf_counter()
+    metrics.slow_query_threshold = flask_app.config['SLOW_QUERY_SECONDS']
+    stats = metrics.RequestStats()
+    _request_stats.set(stats)
+    request = Request(scope, body)
+    try:
+        response = await handler(request, *params)
+    except PasswordPoolBusy:
+        response = json_response({'message': 'Too many authentication requests, please retry'}, 503,
+                                 headers={'Retry-After': '1'})
+    except InvalidSession as e:
+        response = json_response({'message': str(e)}, 401, headers={'WWW-Authenticate': 'Bearer'})
+    except ForbiddenError as e:
+        response = message(str(e), 403)
+    if scope['method'] not in flask_module.READ_METHODS and response.status < 400:
+        flask_module.change_notifier.notify()
+        if flask_module._snapshots is not None:
+            flask_module._snapshots.record_commit()
+    if isinstance(response, Response):
+        compress_response(response, request.headers.get('accept-encoding'))
+    metrics.http_request_duration.observe(time.perf_counter() - started, route=rule, method=scope['method'])
+    metrics.http_requests.inc(route=rule, method=scope['method'], status=response.status)
+    metrics.sql_statements_per_request.observe(stats.statements, route=rule)
+    metrics.sql_seconds_per_request.observe(stats.sql_seconds, route=rule)
+    await response.send(send, head=scope['method'] == 'HEAD')
+
+if __name__ == '__main__':
+    import uvicorn # optional dependency, only needed to serve this entry point
+    uvicorn.run('asgi_app:app', host='127.0.0.1', port=5000)
@@ -0,0 +1,121 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datagen import generate_database
+from load_test import percentile
+
+# Cold archive (archive.py) on a generated database, where most subscriptions
+# with an end date ended long ago. Before and after one archive run, reports
+# the pages of user_services and its indexes (dbstat), the file size and the
+# latency of the hot subscription reads through Flask's test client. Also
+# times a user deletion with the deleted_users trigger against the same
+# deletion without it.
+#   python benchmarks/bench_archive.py --users 100000 --subscriptions 300000 --days 90
+
+ADMIN_TOKEN = 'bench-archive' # GET /subscriptions needs it
+
+def hot_footprint(conn):
+    # (table pages, index pages) of user_services, and the file size in bytes.
+    indexes = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'user_services';")]
+    pages = dict(conn.execute(
+        "SELECT name, COUNT(*) FROM dbstat WHERE name IN (SELECT value FROM json_each(?)) GROUP BY name;",
+        (json.dumps(['user_services'] + indexes),)).fetchall())
+    table = pages.pop('user_services', 0)
+    return table, sum(pages.values())
+
+READS = {
+    'GET /users/<id>/subscriptions': lambda rng, args: f'/users/{rng.randint(1, args.users)}/subscriptions',
+    'GET /subscriptions?user_ids=': lambda rng, args: '/subscriptions?user_ids=' + ','.join(
+        str(rng.randint(1, args.users)) for _ in range(50)),
+    'GET /subscriptions?active=0': lambda rng, args: '/subscriptions?active=0&limit=50',
+}
+
+def time_reads(client, args, seed):
+    rng = random.Random(seed)
+    latencies = {}
+    for _ in range(args.requests):
+        for name, url in READS.items():
+            started = time.perf_counter()
+            response = client.get(url(rng, args), headers={'X-Admin-Token': ADMIN_TOKEN})
+            response.get_data()
+            latencies.setdefault(name, []).append(time.perf_counter() - started)
+    return {name: sorted(values) for name, values in latencies.items()}
+
+def time_deletes(conn, user_ids):
+    latencies = []
+    for user_id in user_ids:
+        started = time.perf_counter()
+        with conn:
+            conn.execute("DELETE FROM users WHERE id = ?;", (user_id,))
+        latencies.append(time.perf_counter() - started)
+    return sorted(latencies)
+
+def report(label, conn, database, reads):
+    table, indexes = hot_footprint(conn)
+    page_size = conn.execute("PRAGMA page_size;").fetchone()[0]
+    rows = conn.execute("SELECT COUNT(*) FROM user_services;").fetchone()[0]
+    print(f"\n{label}: {rows} subscriptions, table {table * page_size / 2**20:.1f} MB, "
+          f"indexes {indexes * page_size / 2**20:.1f} MB, file {os.path.getsize(database) / 2**20:.1f} MB")
+    for name, latency in reads.items():
+        print(f"  {name:<36} p50 {percentile(latency, 0.5) * 1000:7.2f} ms  p99 {percentile(latency, 0.99) * 1000:7.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the hot tables before and after archiving.")
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--services', type=int, default=20)
+    parser.add_argument('--subscriptions', type=int, default=300000)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--requests', type=int, default=300, help="Calls per read route, before and after")
+    parser.add_argument('--deletes', type=int, default=500, help="Users deleted with, then without the trigger")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'bench_archive.db')
+        generate_database(database, args.users, args.services, args.subscriptions).close()
+
+        import app as app_module
+        import archive
+        flask_app = app_module.app
+        flask_app.config.update(DATABASE=database, SESSION_AUTH_REQUIRED=False, EXPIRY_SCHEDULER_ENABLED=False,
+                                ADMIN_TOKEN=ADMIN_TOKEN)
+        client = flask_app.test_client()
+
+        conn = sqlite3.connect(database)
+        conn.execute("PRAGMA foreign_keys = ON;")
+        conn.execute("PRAGMA busy_timeout = 30000;")
+        conn.execute("PRAGMA synchronous = NORMAL;") # as the app's connections (db_pool.DEFAULT_PRAGMAS)
+        report('before', conn, database, time_reads(client, args, 1))
+
+        # Deletions: the last users, so the reads above and below see the same population.
+        victims = list(range(args.users, args.users - 2 * args.deletes, -1))
+        with_trigger = time_deletes(conn, victims[:args.deletes])
+        trigger = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'users_archive_bd';").fetchone()[0]
+        with conn:
+            conn.execute("DROP TRIGGER users_archive_bd;")
+        without_trigger = time_deletes(conn, victims[args.deletes:])
+        with conn:
+            conn.execute(trigger)
+        print(f"\nDELETE FROM users, {args.deletes} users: p50 {percentile(with_trigger, 0.5) * 1000:.3f} ms with the "
+              f"deleted_users trigger, {percentile(without_trigger, 0.5) * 1000:.3f} ms without")
+
+        result = archive.run(conn, archive.archive_path(database), args.days)
+        print(f"\narchive run: {result}")
+        print(f"archive file {os.path.getsize(archive.archive_path(database)) / 2**20:.1f} MB")
+        report('after', conn, database, time_reads(client, args, 1))
+        conn.close()
+
+        if app_module._group_writer is not None:
+            app_module._group_writer.stop()
+        app_module.get_password_hasher().shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datagen import BENCH_PASSWORD, generate_database, user_email
+from load_test import client_address, percentile
+
+# Compares the two serving modes under many concurrent clients, in-process and
+# without network: asgi_app.app driven by asyncio tasks (one task per client)
+# against the Flask WSGI app driven by one thread per client.
+#   python benchmarks/bench_asgi.py --clients 8 --clients 64 --clients 256
+#
+# The mix is mostly reads plus a share of logins (bcrypt in the password pool),
+# where a blocked WSGI thread is what limits concurrency.
+
+def workload(i, users, services, login_every, signer):
+    # Returns (method, path, body, headers); profile routes carry the user's session token.
+    user_id = (i * 7919) % users + 1
+    if login_every and i % login_every == 0:
+        return 'POST', '/login', {'email': user_email(user_id), 'password': BENCH_PASSWORD}, {}
+    session = {'Authorization': f'Bearer {signer.issue(user_id, 0)}'}
+    kind = i % 4
+    if kind == 0:
+        return 'GET', f'/users/{user_id}', None, session
+    if kind == 1:
+        return 'GET', f'/users/{user_id}/subscriptions', None, session
+    if kind == 2:
+        return 'GET', f'/services/{i % services + 1}', None, {}
+    return 'GET', '/users?limit=20', None, {}
+
+async def asgi_request(app, method, path, body, headers, client):
+    path, _, query = path.partition('?')
+    payload = json.dumps(body).encode('utf-8') if body is not None else b''
+    raw_headers = [(b'content-type', b'application/json')]
+    raw_headers += [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()]
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query.encode('latin-1'),
+             'headers': raw_headers, 'client': (client, 50000)}
+    events = [{'type': 'http.request', 'body': payload}]
+    status = []
+
+    async def receive():
+        return events.pop() if events else {'type': 'http.disconnect'}
+
+    async def send(event):
+        if event['type'] == 'http.response.start':
+            status.append(event['status'])
+
+    await app(scope, receive, send)
+    return status[0]
+
+def run_asgi(app, requests, clients, make_request):
+    latencies, errors = [], [0]
+
+    async def client(worker):
+        for i in range(worker, requests, clients):
+            method, path, body, headers = make_request(i)
+            started = time.perf_counter()
+            status = await asgi_request(app, method, path, body, headers, client_address(i))
+            latencies.append(time.perf_counter() - started)
+            if status >= 400 and status != 404:
+                errors[0] += 1
+
+    async def main():
+        await asyncio.gather(*(client(worker) for worker in range(clients)))
+
+    started = time.perf_counter()
+    asyncio.run(main())
+    return summarize(latencies, errors[0], time.perf_counter() - started)
+
+def run_wsgi(flask_app, requests, clients, make_request):
+    local = threading.local()
+    latencies, errors = [], []
+
+    def client(worker):
+        test_client = getattr(local, 'client', None)
+        if test_client is None:
+            test_client = local.client = flask_app.test_client()
+        for i in range(worker, requests, clients):
+            method, path, body, headers = make_request(i)
+            started = time.perf_counter()
+            response = test_client.open(path, method=method, json=body, headers=headers,
+                                        environ_base={'REMOTE_ADDR': client_address(i)})
+            response.get_data()
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400 and response.status_code != 404:
+                errors.append(response.status_code)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(client, range(clients)))
+    return summarize(latencies, len(errors), time.perf_counter() - started)
+
+def summarize(latencies, errors, wall):
+    latencies.sort()
+    return {
+        'throughput': len(latencies) / wall if wall else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'errors': errors,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the ASGI and WSGI entry points under concurrency.")
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--services', type=int, default=20)
+    parser.add_argument('--subscriptions', type=int, default=30000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--clients', type=int, action='append', help="Concurrent clients (repeatable)")
+    parser.add_argument('--login-every', type=int, default=20, help="One request in N is a login (0 = none)")
+    parser.add_argument('--bcrypt-rounds', type=int, default=4)
+    args = parser.parse_args()
+    client_counts = args.clients or [8, 64, 256]
+
+    import app as app_module
+    import asgi_app
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'bench_asgi.db')
+        generate_database(database, args.users, args.services, args.subscriptions, rounds=args.bcrypt_rounds).close()
+        app_module.app.config['DATABASE'] = database
+        app_module.app.config['BCRYPT_ROUNDS'] = args.bcrypt_rounds
+        # Both modes share the password pool; size its queue for the largest client count.
+        app_module.app.config['PASSWORD_POOL_MAX_PENDING'] = max(client_counts)
+
+        signer = app_module.get_token_signer()
+
+        def make_request(i):
+            return workload(i, args.users, args.services, args.login_every, signer)
+
+        print(f"{'mode':<6} {'clients':>7} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6}")
+        for clients in client_counts:
+            for mode, run in (('wsgi', lambda: run_wsgi(app_module.app, args.requests, clients, make_request)),
+                              ('asgi', lambda: run_asgi(asgi_app.app, args.requests, clients, make_request))):
+                result = run()
+                print(f"{mode:<6} {clients:7d} {result['throughput']:9.1f} {result['p50_ms']:8.2f} "
+                      f"{result['p99_ms']:8.2f} {result['errors']:6d}")
+
+        asgi_app.get_async_db().close()
+        app_module.get_password_hasher().shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bulk_import import import_users
+from migrations import create_search_index, create_tables
+from passwords import _hash_password, get_hasher
+
+# Compares the historical one-row-at-a-time insert (hash inline, commit per row)
+# with bulk_import.import_users on a fresh database.
+#   python benchmarks/bench_bulk_import.py --rows 20000 --rounds 4
+# --fixed-hash reuses one precomputed hash for every row, isolating the insert
+# path from bcrypt (which dominates on machines with few cores).
+
+class FixedHasher:
+    workers = 1
+
+    def __init__(self, rounds):
+        self.hashed = _hash_password('fixed', rounds)
+
+    def hash_many(self, passwords):
+        return [self.hashed for _ in passwords]
+
+    def shutdown(self):
+        pass
+
+def make_records(rows):
+    for i in range(rows):
+        yield i + 1, {
+            'email': f'user{i}@bench.example',
+            'password': f'secret-{i}',
+            'first_name': f'First{i}',
+            'last_name': f'Last{i}',
+        }
+
+def fresh_database(directory, name):
+    path = os.path.join(directory, name)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    cursor = conn.cursor()
+    create_tables(cursor)
+    create_search_index(cursor)
+    conn.commit()
+    return conn
+
+def bench_row_by_row(conn, rows, rounds, fixed_hash):
+    fixed = FixedHasher(rounds).hashed if fixed_hash else None
+    started = time.perf_counter()
+    for _, record in make_records(rows):
+        hashed = fixed or _hash_password(record['password'], rounds)
+        conn.execute(
+            "INSERT INTO users (email, password, first_name, last_name) VALUES (?, ?, ?, ?);",
+            (record['email'], hashed, record['first_name'], record['last_name'])
+        )
+        conn.commit()
+    return time.perf_counter() - started
+
+def bench_bulk(conn, rows, rounds, chunk_size, workers, fixed_hash):
+    @contextmanager
+    def connection():
+        yield conn
+
+    hasher = FixedHasher(rounds) if fixed_hash else get_hasher(rounds=rounds, workers=workers)
+    hasher.hash_many(['warm-up'] * hasher.workers) # exclude process start-up
+    started = time.perf_counter()
+    report = import_users(make_records(rows), hasher, connection, chunk_size)
+    elapsed = time.perf_counter() - started
+    hasher.shutdown()
+    assert report['created'] == rows, report['created']
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=4)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--fixed-hash', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        conn = fresh_database(directory, 'row_by_row.db')
+        row_by_row = bench_row_by_row(conn, args.rows, args.rounds, args.fixed_hash)
+        conn.close()
+
+        conn = fresh_database(directory, 'bulk.db')
+        bulk = bench_bulk(conn, args.rows, args.rounds, args.chunk_size, args.workers, args.fixed_hash)
+        conn.close()
+
+    print(f"rows={args.rows} rounds={args.rounds} chunk_size={args.chunk_size} fixed_hash={args.fixed_hash}")
+    print(f"row by row : {row_by_row:8.2f}s {args.rows / row_by_row:10.0f} rows/s")
+    print(f"bulk import: {bulk:8.2f}s {args.rows / bulk:10.0f} rows/s ({row_by_row / bulk:.1f}x)")
+
+if __name__ == '__main__':
+    main()
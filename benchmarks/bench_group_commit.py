@@ -0,0 +1,110 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datagen import generate_database
+from load_test import percentile
+
+# Concurrent small writes with and without the group-commit writer (group_commit.py).
+# Writer threads loop over profile updates (PUT /users/<id>) and subscription
+# creations / deletions (POST and DELETE /users/<id>/subscriptions) for the
+# duration of each run; a share of the creations are duplicates, answered 409
+# from inside a batch. Reports writes per second, latencies and, with group
+# commit, the number of commits and the average and largest batch.
+#   python benchmarks/bench_group_commit.py --users 20000 --threads 16 --duration 10 [--synchronous FULL]
+
+def run(flask_app, args, enabled, max_delay, seed):
+    import app as app_module
+    flask_app.config.update(GROUP_COMMIT_ENABLED=enabled, GROUP_COMMIT_MAX_DELAY=max_delay)
+    if app_module._group_writer is not None:
+        app_module._group_writer.stop()
+        app_module._group_writer = None
+
+    lock = threading.Lock()
+    results = {'latency': [], 'statuses': {}}
+    deadline = time.monotonic() + args.duration
+
+    def worker(n):
+        client = flask_app.test_client()
+        rng = random.Random(seed * 1000 + n)
+        latencies = []
+        statuses = {}
+        while time.monotonic() < deadline:
+            user_id = rng.randint(1, args.users)
+            started = time.perf_counter()
+            kind = rng.random()
+            if kind < 0.5:
+                response = client.put(f'/users/{user_id}', json={'first_name': f'N{rng.randint(0, 999)}'})
+            elif kind < 0.8:
+                response = client.post(f'/users/{user_id}/subscriptions',
+                                       json={'service_id': rng.randint(1, args.services), 'start_date': '2026-01-01'})
+            else:
+                response = client.delete(f'/users/{user_id}/subscriptions/{rng.randint(1, args.services)}')
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        with lock:
+            results['latency'].extend(latencies)
+            for status, count in statuses.items():
+                results['statuses'][status] = results['statuses'].get(status, 0) + count
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if enabled:
+        results['group'] = app_module._group_writer.stats()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent writes with and without group commit.")
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--services', type=int, default=20)
+    parser.add_argument('--subscriptions', type=int, default=40000)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--synchronous', default='NORMAL', choices=['OFF', 'NORMAL', 'FULL'],
+                        help="PRAGMA synchronous: with FULL every commit waits for an fsync")
+    parser.add_argument('--max-delay', type=float, nargs='+', default=[0.0, 0.002],
+                        help="GROUP_COMMIT_MAX_DELAY values to compare (seconds)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'bench_group_commit.db')
+        generate_database(database, args.users, args.services, args.subscriptions).close()
+
+        import app as app_module
+        flask_app = app_module.app
+        flask_app.config.update(DATABASE=database, SESSION_AUTH_REQUIRED=False, EXPIRY_SCHEDULER_ENABLED=False,
+                                LOGIN_GUARD_ENABLED=False, DB_POOL_TIMEOUT=30.0,
+                                DB_PRAGMAS={**app_module.DEFAULT_PRAGMAS, 'synchronous': args.synchronous})
+
+        print(f"{'group commit':<18} {'writes/s':>8} {'mean':>8} {'p50':>8} {'p99':>8} {'max':>8} {'commits':>8} {'avg batch':>9} "
+              f"{'max batch':>9}  statuses")
+        runs = [(False, 0.0)] + [(True, delay) for delay in args.max_delay]
+        for seed, (enabled, max_delay) in enumerate(runs):
+            results = run(flask_app, args, enabled, max_delay, seed)
+            latency = sorted(results['latency'])
+            label = f"on, delay {max_delay * 1000:g}ms" if enabled else 'off'
+            line = (f"{label:<18} {len(latency) / args.duration:8.0f} {sum(latency) / len(latency) * 1000:6.2f}ms "
+                    f"{percentile(latency, 0.5) * 1000:6.2f}ms "
+                    f"{percentile(latency, 0.99) * 1000:6.2f}ms {latency[-1] * 1000:6.0f}ms")
+            group = results.get('group')
+            if group is not None:
+                line += f" {group['batches']:8d} {group['mutations'] / max(group['batches'], 1):9.1f} " \
+                        f"{group['batch_size_max']:9d}"
+            else:
+                line += f" {'-':>8} {'-':>9} {'-':>9}"
+            print(f"{line}  {dict(sorted(results['statuses'].items()))}")
+        if app_module._group_writer is not None:
+            app_module._group_writer.stop()
+        app_module.get_password_hasher().shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datagen import BENCH_PASSWORD, generate_database, user_email
+from load_test import percentile
+
+# /login under a credential-stuffing burst, with and without the login guard.
+# A few attacker addresses replay a list of leaked emails (mostly unknown
+# here) and spray wrong passwords on real accounts, while legitimate users
+# log in from their own addresses at a steady pace. Reports the bcrypt
+# verifies actually run, the attack requests shed, and the latency/success of
+# the legitimate logins.
+#   python benchmarks/bench_login_guard.py --duration 15 --rounds 8
+
+def verify_count(metrics):
+    # Number of bcrypt verifies recorded by app.verify_password, read from the Prometheus output.
+    for line in metrics.registry.render().splitlines():
+        if line.startswith('password_hash_duration_seconds_count{operation="verify"}'):
+            return int(line.rsplit(' ', 1)[1])
+    return 0
+
+def attack_request(i, rng, users, attackers, leaked):
+    address = f'203.0.113.{i % attackers + 1}'
+    if i % 2 == 0:
+        email = leaked[rng.randrange(len(leaked))] # credential stuffing, mostly unknown emails
+    else:
+        email = user_email(rng.randint(1, users)) # password spraying on real accounts
+    return address, {'email': email, 'password': f'guess{i}'}
+
+def run(flask_app, metrics, args, guard_enabled):
+    import app as app_module
+    flask_app.config['LOGIN_GUARD_ENABLED'] = guard_enabled
+    app_module._login_guard = None # fresh limiter state for each run
+
+    rng = random.Random(args.seed)
+    leaked = [f'leaked{n}@mail.example' for n in range(args.leaked_emails)]
+    leaked += [user_email(rng.randint(1, args.users)) for _ in range(args.leaked_emails // 10)]
+    lock = threading.Lock()
+    statuses = {'attack': {}, 'legit': {}}
+    legit_latencies = []
+    deadline = time.monotonic() + args.duration
+
+    def record(kind, status):
+        with lock:
+            statuses[kind][status] = statuses[kind].get(status, 0) + 1
+
+    def attacker(worker):
+        # Closed loop: each attacker thread fires its next attempt as soon as the previous one is answered.
+        client = flask_app.test_client()
+        worker_rng = random.Random(args.seed + worker)
+        i = worker
+        while time.monotonic() < deadline:
+            address, body = attack_request(i, worker_rng, args.users, args.attackers, leaked)
+            record('attack', client.post('/login', json=body, environ_base={'REMOTE_ADDR': address}).status_code)
+            i += args.concurrency
+
+    def legitimate():
+        # Open loop: evenly spaced logins from distinct addresses, whatever the attack does.
+        client = flask_app.test_client()
+        interval = args.duration / args.legit_logins
+        for n in range(args.legit_logins):
+            time.sleep(max(0.0, deadline - args.duration + n * interval - time.monotonic()))
+            body = {'email': user_email(rng.randint(1, args.users)), 'password': BENCH_PASSWORD}
+            started = time.perf_counter()
+            response = client.post('/login', json=body, environ_base={'REMOTE_ADDR': f'198.51.100.{n % 250 + 1}'})
+            legit_latencies.append(time.perf_counter() - started)
+            record('legit', response.status_code)
+
+    verifies_before = verify_count(metrics)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency + 1) as executor:
+        futures = [executor.submit(attacker, worker) for worker in range(args.concurrency)]
+        futures.append(executor.submit(legitimate))
+        for future in futures:
+            future.result()
+    wall = time.perf_counter() - started
+    legit_latencies.sort()
+    return {
+        'wall': wall,
+        'verifies': verify_count(metrics) - verifies_before,
+        'attack': statuses['attack'],
+        'legit': statuses['legit'],
+        'legit_p50_ms': percentile(legit_latencies, 0.5) * 1000,
+        'legit_p99_ms': percentile(legit_latencies, 0.99) * 1000,
+        'guard': app_module.get_login_guard().stats() if guard_enabled else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /login under a credential-stuffing burst.")
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--duration', type=float, default=15.0, help="Seconds of attack")
+    parser.add_argument('--attackers', type=int, default=4, help="Distinct attacker addresses")
+    parser.add_argument('--leaked-emails', type=int, default=300)
+    parser.add_argument('--legit-logins', type=int, default=60, help="Spread evenly over the duration")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--rounds', type=int, default=8, help="bcrypt cost of the stored hashes")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    import app as app_module
+    import metrics
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'bench_login.db')
+        generate_database(database, args.users, 5, args.users, rounds=args.rounds).close()
+        app_module.app.config['DATABASE'] = database
+        app_module.app.config['BCRYPT_ROUNDS'] = args.rounds
+        app_module.app.config['EXPIRY_SCHEDULER_ENABLED'] = False
+        app_module.app.config['PASSWORD_POOL_MAX_PENDING'] = args.concurrency * 2
+
+        for guard_enabled in (False, True):
+            result = run(app_module.app, metrics, args, guard_enabled)
+            attempts = sum(result['attack'].values())
+            print(f"guard {'on ' if guard_enabled else 'off'}: {attempts} attack attempts in {result['wall']:.1f}s, "
+                  f"{result['verifies']} bcrypt verifies")
+            print(f"  attack responses: {dict(sorted(result['attack'].items()))}")
+            print(f"  legit responses:  {dict(sorted(result['legit'].items()))}, "
+                  f"p50 {result['legit_p50_ms']:.1f} ms, p99 {result['legit_p99_ms']:.1f} ms")
+            if result['guard']:
+                print(f"  guard: {result['guard']}")
+
+        app_module.get_password_hasher().shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pricing
+from migrations import add_missing_service_columns, create_pricing_tables, create_tables
+
+# Measures the pricing engine on a synthetic catalog x customer base:
+#   1. compute_prices alone, on in-memory arrays;
+#   2. the full reprice_active_subscriptions job against a SQLite database.
+#   python benchmarks/bench_pricing.py --subscriptions 1000000
+
+def build_database(path, users, services, subscriptions, generic_promos, customer_promos, seed):
+    rng = np.random.default_rng(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    cursor = conn.cursor()
+    create_tables(cursor)
+    add_missing_service_columns(cursor)
+    create_pricing_tables(cursor)
+
+    cursor.executemany(
+        "INSERT INTO users (id, email, password, first_name, last_name) VALUES (?, ?, 'x', 'F', 'L');",
+        ((i, f'user{i}@bench.example') for i in range(1, users + 1))
+    )
+    cursor.executemany(
+        "INSERT INTO services (id, name, description, price) VALUES (?, ?, '', ?);",
+        ((i, f'Service {i}', round(float(p), 2)) for i, p in zip(range(1, services + 1), rng.uniform(5, 200, services)))
+    )
+    # One subscription per (user, service) pair, as UNIQUE(user_id, service_id) requires.
+    pairs = rng.choice(users * services, size=subscriptions, replace=False)
+    cursor.executemany(
+        "INSERT INTO user_services (user_id, service_id, active, start_date, promo_code) VALUES (?, ?, 1, '2026-01-01', ?);",
+        ((int(pair // services) + 1, int(pair % services) + 1, 'WELCOME' if pair % 7 == 0 else None) for pair in pairs)
+    )
+
+    promos = [('WELCOME', 'percent', 15.0, None, None)]
+    for i in range(generic_promos - 1):
+        promos.append((None, 'percent' if i % 2 else 'fixed', float(rng.uniform(1, 20)),
+                       int(rng.integers(1, services + 1)), None))
+    for user_id in rng.choice(users, size=customer_promos, replace=False):
+        promos.append((None, 'percent', float(rng.uniform(5, 40)), None, int(user_id) + 1))
+    cursor.executemany(
+        "INSERT INTO promotions (code, kind, value, service_id, user_id) VALUES (?, ?, ?, ?, ?);", promos
+    )
+    conn.commit()
+    return conn
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--services', type=int, default=50)
+    parser.add_argument('--subscriptions', type=int, default=1000000)
+    parser.add_argument('--generic-promos', type=int, default=20)
+    parser.add_argument('--customer-promos', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        conn = build_database(os.path.join(directory, 'pricing.db'), args.users, args.services, args.subscriptions,
+                              args.generic_promos, args.customer_promos, args.seed)
+        print(f"database built in {time.perf_counter() - started:.1f}s")
+
+        rows = conn.execute("SELECT user_id, service_id, promo_code FROM user_services;").fetchall()
+        user_ids, service_ids, codes = (np.array(column) for column in zip(*rows))
+        promotions = pricing.load_promotions(conn)
+        base_prices = pricing.load_base_prices(conn)[service_ids.astype(np.int64)]
+        code_ids = promotions.encode_codes(codes)
+
+        started = time.perf_counter()
+        prices, promo_ids = pricing.compute_prices(base_prices, service_ids, user_ids, code_ids, promotions)
+        compute = time.perf_counter() - started
+        discounted = int((promo_ids != pricing.NO_PROMOTION).sum())
+        print(f"compute_prices: {len(prices)} rows x {len(promotions)} promotions in {compute:.3f}s "
+              f"({len(prices) / compute:,.0f} rows/s, {discounted} discounted)")
+
+        first = pricing.reprice_active_subscriptions(conn)
+        print(f"reprice job (first run, writes every row): {first['scanned']} rows in {first['seconds']:.2f}s")
+        second = pricing.reprice_active_subscriptions(conn)
+        print(f"reprice job (nothing changed)          : {second['scanned']} rows in {second['seconds']:.2f}s")
+        conn.close()
+
+if __name__ == '__main__':
+    main()
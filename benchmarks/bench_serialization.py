@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datagen import generate_database
+from serialization import ENCODERS, compress, fetch_records
+
+# Cost of turning a page of user rows into a JSON body:
+#   * legacy: sqlite3.Row per row, dict(row), stdlib encoder with sorted keys
+#     (what jsonify([dict(r) for r in rows]) did);
+#   * records + <encoder>: tuples zipped with the column names (serialization.py),
+#     for every available encoder.
+# Reports the time per page, the memory allocated per row, and the body size
+# before and after gzip.
+#   python benchmarks/bench_serialization.py --rows 1000
+
+QUERY = "SELECT id, email, first_name, last_name FROM users ORDER BY id LIMIT ?;"
+
+def legacy(conn, rows):
+    conn.row_factory = sqlite3.Row
+    try:
+        records = [dict(row) for row in conn.execute(QUERY, (rows,)).fetchall()]
+    finally:
+        conn.row_factory = None
+    return json.dumps(records, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+def with_encoder(encode):
+    def serialize(conn, rows):
+        return encode(fetch_records(conn, QUERY, (rows,)))
+    return serialize
+
+def measure(fn, conn, rows, repeat):
+    fn(conn, rows) # warm up the statement cache
+    started = time.perf_counter()
+    for _ in range(repeat):
+        body = fn(conn, rows)
+    seconds = (time.perf_counter() - started) / repeat
+    tracemalloc.start()
+    fn(conn, rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak / rows, body
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark row serialization and response compression.")
+    parser.add_argument('--rows', type=int, default=1000, help="Rows per page")
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        conn = generate_database(os.path.join(directory, 'bench_serialization.db'), args.rows, 1, 0)
+        candidates = [('legacy (Row + stdlib)', legacy)]
+        candidates += [(f'records + {name}', with_encoder(encode)) for name, encode in sorted(ENCODERS.items())]
+
+        print(f"{'path':<26} {'ms/page':>8} {'us/row':>7} {'peak B/row':>10} {'bytes':>8} {'gzip':>7}")
+        for name, fn in candidates:
+            seconds, per_row, body = measure(fn, conn, args.rows, args.repeat)
+            print(f"{name:<26} {seconds * 1000:8.3f} {seconds * 1e6 / args.rows:7.2f} {per_row:10.0f} "
+                  f"{len(body):8d} {len(compress(body, 'gzip')):7d}")
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datagen import generate_database
+from load_test import percentile
+
+# One database against the same data resharded into N files (sharding.py). Each
+# layout runs writer threads (profile updates and subscription creations /
+# deletions) next to reader threads that page through GET /users, search by
+# email and list GET /subscriptions, all fanned out to every shard when sharded.
+# Reports writes per second and the latency of each read kind.
+#   python benchmarks/bench_sharding.py --users 20000 --shards 4 --writers 8 --readers 4 --duration 10
+
+ADMIN_TOKEN = 'bench-sharding' # GET /subscriptions needs it
+
+def encode_cursor(after_id):
+    from app import encode_cursor
+    return encode_cursor(after_id)
+
+READS = {
+    'GET /users': lambda rng, args: f'/users?limit=50&after={encode_cursor(rng.randint(1, args.users))}',
+    'GET /search/users': lambda rng, args: f'/search/users?email=user{rng.randint(1, args.users)}&limit=20',
+    'GET /subscriptions': lambda rng, args: '/subscriptions?limit=50&active=1',
+}
+
+def write(client, rng, args):
+    user_id = rng.randint(1, args.users)
+    kind = rng.random()
+    if kind < 0.5:
+        return client.put(f'/users/{user_id}', json={'first_name': f'N{rng.randint(0, 999)}'})
+    if kind < 0.8:
+        return client.post(f'/users/{user_id}/subscriptions',
+                           json={'service_id': rng.randint(1, args.services), 'start_date': '2026-01-01'})
+    return client.delete(f'/users/{user_id}/subscriptions/{rng.randint(1, args.services)}')
+
+def run(flask_app, args, seed):
+    lock = threading.Lock()
+    results = {'writes': [], 'statuses': {}, **{name: [] for name in READS}}
+    deadline = time.monotonic() + args.duration
+
+    def worker(n, reader):
+        client = flask_app.test_client()
+        rng = random.Random(seed * 1000 + n)
+        latencies = {name: [] for name in READS} if reader else {'writes': []}
+        statuses = {}
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            if reader:
+                name = rng.choice(list(READS))
+                response = client.get(READS[name](rng, args), headers={'X-Admin-Token': ADMIN_TOKEN})
+            else:
+                name = 'writes'
+                response = write(client, rng, args)
+            latencies[name].append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        with lock:
+            for name, values in latencies.items():
+                results[name].extend(values)
+            for status, count in statuses.items():
+                results['statuses'][status] = results['statuses'].get(status, 0) + count
+
+    threads = [threading.Thread(target=worker, args=(n, False)) for n in range(args.writers)]
+    threads += [threading.Thread(target=worker, args=(args.writers + n, True)) for n in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark one database against N shards.")
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--services', type=int, default=20)
+    parser.add_argument('--subscriptions', type=int, default=40000)
+    parser.add_argument('--shards', type=int, nargs='+', default=[4])
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        template = os.path.join(directory, 'template.db')
+        generate_database(template, args.users, args.services, args.subscriptions).close()
+
+        import app as app_module
+        import sharding
+        flask_app = app_module.app
+        flask_app.config.update(SESSION_AUTH_REQUIRED=False, EXPIRY_SCHEDULER_ENABLED=False,
+                                LOGIN_GUARD_ENABLED=False, DB_POOL_TIMEOUT=30.0, ADMIN_TOKEN=ADMIN_TOKEN)
+
+        print(f"{'layout':<10} {'writes/s':>8} {'write p50':>10} {'write p99':>10}  "
+              + '  '.join(f"{name + ' p50/p99':>28}" for name in READS) + "  statuses")
+        for seed, count in enumerate([0] + args.shards):
+            # Every layout starts from a copy of the same generated data.
+            database = os.path.join(directory, f'bench_sharding_{count}.db')
+            shutil.copyfile(template, database)
+            if count:
+                sharding.reshard(database, count, delete_source=True)
+            flask_app.config.update(DATABASE=database, SHARDS=count)
+
+            results = run(flask_app, args, seed)
+            writes = sorted(results['writes'])
+            line = (f"{count or 'single':<10} {len(writes) / args.duration:8.0f} "
+                    f"{percentile(writes, 0.5) * 1000:8.2f}ms {percentile(writes, 0.99) * 1000:8.2f}ms")
+            for name in READS:
+                latency = sorted(results[name])
+                line += f"  {percentile(latency, 0.5) * 1000:16.2f}ms/{percentile(latency, 0.99) * 1000:7.2f}ms" \
+                    if latency else f"  {'-':>28}"
+            print(f"{line}  {dict(sorted(results['statuses'].items()))}")
+        if app_module._shards is not None:
+            app_module._shards.close()
+        if app_module._group_writer is not None:
+            app_module._group_writer.stop()
+        app_module.get_password_hasher().shutdown()
+
+if __name__ == '__main__':
+    main()
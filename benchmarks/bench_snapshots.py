@@ -0,0 +1,143 @@
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datagen import generate_database
+from load_test import percentile
+
+# Reporting reads on the primary vs on read snapshots (snapshots.py).
+# Reporter threads export the whole users table (GET /users?format=ndjson) and
+# scan subscriptions (GET /subscriptions) in a loop, while a writer creates
+# users at a steady pace and readers fetch single profiles. Reports the export
+# rate, the writer and profile latencies, the largest WAL file seen (long read
+# transactions on the primary keep checkpoints from recycling it) and the cost
+# of a snapshot refresh.
+#   python benchmarks/bench_snapshots.py --users 100000 --duration 15
+
+ADMIN_TOKEN = 'bench-snapshots' # GET /subscriptions needs it
+
+def truncate_wal(database):
+    # Each run starts from an empty WAL file, so that WAL max is that run's own growth.
+    conn = sqlite3.connect(database)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+    finally:
+        conn.close()
+
+def run(flask_app, args, database, snapshots_enabled):
+    import app as app_module
+    truncate_wal(database)
+    flask_app.config['SNAPSHOT_READS_ENABLED'] = snapshots_enabled
+    if app_module._snapshots is not None:
+        app_module._snapshots.close()
+        app_module._snapshots = None
+    if snapshots_enabled:
+        # Taken up front, so the measured window only sees scheduled refreshes.
+        snapshots = app_module.get_snapshots()
+        for replica in range(len(snapshots.replicas)):
+            snapshots.refresh(replica)
+        snapshots.start()
+
+    lock = threading.Lock()
+    results = {'exports': 0, 'write': [], 'profile': [], 'wal_max': 0, 'snapshot_ages': []}
+    deadline = time.monotonic() + args.duration
+    run_id = time.monotonic_ns()
+
+    def reporter(worker):
+        client = flask_app.test_client()
+        rng = random.Random(worker)
+        while time.monotonic() < deadline:
+            response = client.get('/users?format=ndjson')
+            response.get_data()
+            age = response.headers.get('X-Snapshot-Age')
+            client.get(f'/subscriptions?limit=500&after={app_module.encode_cursor(rng.randint(0, args.users))}',
+                       headers={'X-Admin-Token': ADMIN_TOKEN})
+            with lock:
+                results['exports'] += 1
+                if age is not None:
+                    results['snapshot_ages'].append(float(age))
+
+    def writer():
+        client = flask_app.test_client()
+        i = 0
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            client.post('/users', json={'email': f'snap{run_id}-{i}@bench.example', 'password': 'x',
+                                        'first_name': 'Snap', 'last_name': 'Shot'})
+            with lock:
+                results['write'].append(time.perf_counter() - started)
+                results['wal_max'] = max(results['wal_max'], os.path.getsize(database + '-wal'))
+            i += 1
+            time.sleep(1.0 / args.write_rate)
+
+    def profile_reader(worker):
+        client = flask_app.test_client()
+        rng = random.Random(worker)
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            client.get(f'/users/{rng.randint(1, args.users)}')
+            with lock:
+                results['profile'].append(time.perf_counter() - started)
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=reporter, args=(n,)) for n in range(args.reporters)]
+    threads += [threading.Thread(target=profile_reader, args=(n,)) for n in range(2)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if snapshots_enabled:
+        results['refresh'] = app_module._snapshots.status()
+        app_module._snapshots.close()
+        app_module._snapshots = None
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark reporting reads on the primary vs read snapshots.")
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--services', type=int, default=20)
+    parser.add_argument('--subscriptions', type=int, default=300000)
+    parser.add_argument('--duration', type=float, default=15.0)
+    parser.add_argument('--reporters', type=int, default=2, help="Threads exporting in a loop")
+    parser.add_argument('--write-rate', type=float, default=50.0, help="User creations per second")
+    parser.add_argument('--interval', type=float, default=5.0, help="SNAPSHOT_INTERVAL")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'bench_snapshots.db')
+        generate_database(database, args.users, args.services, args.subscriptions).close()
+
+        import app as app_module
+        flask_app = app_module.app
+        flask_app.config.update(DATABASE=database, BCRYPT_ROUNDS=4, SESSION_AUTH_REQUIRED=False,
+                                EXPIRY_SCHEDULER_ENABLED=False, LOGIN_GUARD_ENABLED=False,
+                                SNAPSHOT_INTERVAL=args.interval, SNAPSHOT_REFRESH_COMMITS=0, ADMIN_TOKEN=ADMIN_TOKEN)
+
+        print(f"{'reads from':<10} {'exports':>7} {'write p50':>9} {'write p99':>9} {'profile p99':>11} "
+              f"{'WAL max':>9} {'age max':>7}")
+        for enabled in (False, True):
+            results = run(flask_app, args, database, enabled)
+            ages = results['snapshot_ages']
+            write, profile = sorted(results['write']), sorted(results['profile'])
+            print(f"{'snapshots' if enabled else 'primary':<10} {results['exports']:7d} "
+                  f"{percentile(write, 0.5) * 1000:7.1f}ms {percentile(write, 0.99) * 1000:7.1f}ms "
+                  f"{percentile(profile, 0.99) * 1000:9.1f}ms {results['wal_max'] / 1e6:7.1f}MB "
+                  f"{max(ages) if ages else 0.0:6.1f}s")
+            if enabled:
+                refresh = results['refresh']
+                print(f"refreshes: {refresh['refreshes']} (unchanged {refresh['unchanged']}), "
+                      f"max {refresh['refresh_seconds_max'] * 1000:.0f} ms, "
+                      f"copy {refresh['replicas'][0]['file_bytes'] / 1e6:.1f} MB")
+        app_module.get_password_hasher().shutdown()
+
+if __name__ == '__main__':
+    main()
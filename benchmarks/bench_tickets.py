@@ -0,0 +1,155 @@
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datagen import generate_database, generate_tickets
+from load_test import percentile
+
+# Support ticket queues (tickets.py) as the number of tickets grows. For each
+# size in --tickets the database is topped up with generated tickets, then:
+#   * every ticket route is timed through Flask's test client;
+#   * the work queue head is read with the maintained premium column and
+#     idx_tickets_queue, and with premium computed per ticket from the
+#     subscriptions (what the queue would cost without the denormalized copy);
+#   * --bulk ids are assigned and closed with one json_each() statement, and
+#     with one UPDATE per id. Both rolled back, so every size sees the same data.
+#   python benchmarks/bench_tickets.py --users 100000 --subscriptions 300000 --tickets 10000 100000 1000000
+
+ADMIN_TOKEN = 'bench-tickets'
+
+def route_calls(rng, args, ticket_count):
+    user_id = rng.randint(1, args.users)
+    ticket_id = rng.randint(1, ticket_count)
+    agent = f'agent{rng.randint(1, 20)}'
+    return {
+        'GET /admin/tickets/queue': ('GET', '/admin/tickets/queue?limit=20', None),
+        'POST /admin/tickets/next': ('POST', '/admin/tickets/next', {'assignee': agent}),
+        'GET /admin/tickets/sla': ('GET', '/admin/tickets/sla?limit=20&breached=1', None),
+        'GET /admin/tickets': ('GET', f'/admin/tickets?assignee={agent}&limit=50', None),
+        'GET /admin/tickets/<id>': ('GET', f'/admin/tickets/{ticket_id}', None),
+        'POST /admin/tickets/<id>/messages': ('POST', f'/admin/tickets/{ticket_id}/messages',
+                                              {'agent': agent, 'body': 'Looking into it'}),
+        'POST /users/<id>/tickets': ('POST', f'/users/{user_id}/tickets',
+                                     {'subject': 'Bench', 'body': 'Something is wrong', 'priority': 'high'}),
+        'GET /users/<id>/tickets': ('GET', f'/users/{user_id}/tickets', None),
+    }
+
+def time_routes(client, args, ticket_count):
+    rng = random.Random(ticket_count)
+    latencies = {}
+    for _ in range(args.requests):
+        for name, (method, url, body) in route_calls(rng, args, ticket_count).items():
+            started = time.perf_counter()
+            response = client.open(url, method=method, json=body, headers={'X-Admin-Token': ADMIN_TOKEN})
+            response.get_data()
+            latencies.setdefault(name, []).append(time.perf_counter() - started)
+            if response.status_code not in (200, 201, 409):
+                raise RuntimeError(f"{name}: {response.status_code} {response.get_json()}")
+    return {name: sorted(values) for name, values in latencies.items()}
+
+def timed(fn, repeat):
+    # Median of `repeat` runs, in milliseconds.
+    values = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        values.append(time.perf_counter() - started)
+    return sorted(values)[len(values) // 2] * 1000
+
+def compare_queries(conn, args, ticket_count):
+    import tickets
+    indexed = f"SELECT id FROM tickets WHERE status = 'open' ORDER BY {tickets.QUEUE_ORDER} LIMIT 20;"
+    joined = (f"SELECT id FROM tickets WHERE status = 'open' ORDER BY "
+              f"{tickets.PREMIUM_SUPPORT.format(user='tickets.user_id')} DESC, priority, sla_due_at, id LIMIT 20;")
+    results = {
+        'queue, premium column': timed(lambda: conn.execute(indexed).fetchall(), args.repeat),
+        'queue, premium joined': timed(lambda: conn.execute(joined).fetchall(), max(1, args.repeat // 5)),
+    }
+    rng = random.Random(ticket_count)
+
+    def rolled_back(fn):
+        def run():
+            ids = rng.sample(range(1, ticket_count + 1), args.bulk)
+            conn.execute("BEGIN;")
+            try:
+                fn(ids)
+            finally:
+                conn.rollback()
+        return run
+
+    def assign_one_by_one(ids):
+        for ticket_id in ids:
+            conn.execute("UPDATE tickets SET assignee = ?, status = 'assigned', updated_at = ? "
+                         "WHERE id = ? AND status <> 'closed';", ('agent1', tickets.utc_now(), ticket_id))
+
+    def close_one_by_one(ids):
+        now = tickets.utc_now()
+        for ticket_id in ids:
+            conn.execute("UPDATE tickets SET status = 'closed', closed_at = ?, updated_at = ? "
+                         "WHERE id = ? AND status <> 'closed';", (now, now, ticket_id))
+
+    results[f'assign {args.bulk}, json_each'] = timed(
+        rolled_back(lambda ids: tickets.assign_tickets(conn, ids, 'agent1')), args.repeat)
+    results[f'assign {args.bulk}, per id'] = timed(rolled_back(assign_one_by_one), args.repeat)
+    results[f'close {args.bulk}, json_each'] = timed(rolled_back(lambda ids: tickets.close_tickets(conn, ids)), args.repeat)
+    results[f'close {args.bulk}, per id'] = timed(rolled_back(close_one_by_one), args.repeat)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the support ticket queues as tickets accumulate.")
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--services', type=int, default=20)
+    parser.add_argument('--subscriptions', type=int, default=300000)
+    parser.add_argument('--tickets', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help="Total ticket counts to measure, in increasing order")
+    parser.add_argument('--requests', type=int, default=200, help="Calls per route and size")
+    parser.add_argument('--bulk', type=int, default=1000, help="Ids per bulk assignment / closing")
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'bench_tickets.db')
+        generate_database(database, args.users, args.services, args.subscriptions).close()
+
+        import app as app_module
+        flask_app = app_module.app
+        flask_app.config.update(DATABASE=database, SESSION_AUTH_REQUIRED=False, EXPIRY_SCHEDULER_ENABLED=False,
+                                ADMIN_TOKEN=ADMIN_TOKEN)
+        client = flask_app.test_client()
+
+        generated = 0
+        for target in sorted(args.tickets):
+            conn = sqlite3.connect(database, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout = 30000;")
+            started = time.perf_counter()
+            conn.execute("BEGIN;")
+            generate_tickets(conn, target - generated, args.users, seed=target)
+            conn.execute("COMMIT;")
+            conn.execute("ANALYZE;")
+            ticket_count = conn.execute("SELECT MAX(id) FROM tickets;").fetchone()[0]
+            print(f"\n{ticket_count} tickets (generated in {time.perf_counter() - started:.1f}s, "
+                  f"{os.path.getsize(database) / 2**20:.0f} MB)")
+
+            print(f"  {'query':<36} {'median ms':>10}")
+            for name, elapsed in compare_queries(conn, args, ticket_count).items():
+                print(f"  {name:<36} {elapsed:10.2f}")
+
+            print(f"  {'route':<36} {'p50 ms':>10} {'p99 ms':>10}")
+            for name, latency in time_routes(client, args, ticket_count).items():
+                print(f"  {name:<36} {percentile(latency, 0.5) * 1000:10.2f} {percentile(latency, 0.99) * 1000:10.2f}")
+            # POST /users/<id>/tickets added some; the next top-up starts after them.
+            generated = conn.execute("SELECT COUNT(*) FROM tickets;").fetchone()[0]
+            conn.close()
+
+        if app_module._group_writer is not None:
+            app_module._group_writer.stop()
+        app_module.get_password_hasher().shutdown()
+
+if __name__ == '__main__':
+    main()
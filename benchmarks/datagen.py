@@ -0,0 +1,126 @@
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import migrate
+from passwords import _hash_password
+from tickets import CLOSED, OPEN, ASSIGNED, PREMIUM_SUPPORT, sla_deadline
+
+# Synthetic database generator for the benchmarks: N users, M services and K
+# subscriptions, deterministic for a given seed. Every user's password is
+# BENCH_PASSWORD, hashed once with the requested bcrypt cost. Service 1 comes
+# with priority support; optional support tickets are spread over the last 90
+# days, most of them closed.
+#   python benchmarks/datagen.py bench.db --users 100000 --services 50 --subscriptions 300000 [--tickets 1000000]
+
+BENCH_PASSWORD = 'benchpass'
+FIRST_NAMES = ('Alice', 'Bob', 'Charlie', 'Diane', 'Emile', 'Fanny', 'Gaston', 'Hélène', 'Igor', 'Julie')
+LAST_NAMES = ('Martin', 'Bernard', 'Dubois', 'Thomas', 'Robert', 'Richard', 'Petit', 'Durand', 'Leroy', 'Moreau')
+
+def user_email(user_id):
+    return f'user{user_id}@bench.example'
+
+def generate_database(path, users, services, subscriptions, seed=42, rounds=4, batch_size=10000, tickets=0):
+    if subscriptions > users * services:
+        raise ValueError("subscriptions cannot exceed users x services")
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute("PRAGMA synchronous = OFF;") # generation only, durability is irrelevant
+    migrate(conn)
+    cursor = conn.cursor()
+
+    hashed = _hash_password(BENCH_PASSWORD, rounds)
+    for start in range(1, users + 1, batch_size):
+        cursor.executemany(
+            "INSERT INTO users (id, email, password, first_name, last_name) VALUES (?, ?, ?, ?, ?);",
+            ((i, user_email(i), hashed, rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+             for i in range(start, min(start + batch_size, users + 1)))
+        )
+    cursor.executemany(
+        "INSERT INTO services (id, name, description, price, features, priority_support) VALUES (?, ?, ?, ?, '[]', ?);",
+        ((i, f'Service {i}', f'Synthetic service number {i}', round(rng.uniform(5, 200), 2), int(i == 1))
+         for i in range(1, services + 1))
+    )
+
+    today = date.today()
+    pairs = rng.sample(range(users * services), subscriptions)
+    for start in range(0, subscriptions, batch_size):
+        rows = []
+        for pair in pairs[start:start + batch_size]:
+            started = today - timedelta(days=rng.randint(0, 720))
+            ends = started + timedelta(days=rng.choice((30, 90, 365))) if rng.random() < 0.7 else None
+            active = 0 if ends is not None and ends < today else 1
+            rows.append((pair // services + 1, pair % services + 1, active, started.isoformat(),
+                         ends.isoformat() if ends else None))
+        cursor.executemany(
+            "INSERT INTO user_services (user_id, service_id, active, start_date, end_date) VALUES (?, ?, ?, ?, ?);",
+            rows
+        )
+    if tickets:
+        generate_tickets(conn, tickets, users, seed, batch_size=batch_size)
+    conn.commit()
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute("ANALYZE;")
+    return conn
+
+def generate_tickets(conn, tickets, users, seed=42, agents=20, batch_size=10000):
+    # Appends `tickets` tickets of random users, each with its first message: 70 % closed,
+    # 10 % assigned to one of `agents` agents, 20 % waiting in the work queue. Not committed.
+    rng = random.Random(seed)
+    premium = {row[0] for row in conn.execute(
+        "SELECT id FROM users WHERE " + PREMIUM_SUPPORT.format(user='users.id') + ";")}
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    first = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM tickets;").fetchone()[0]
+    for start in range(first, first + tickets, batch_size):
+        rows = []
+        messages = []
+        for ticket_id in range(start, min(start + batch_size, first + tickets)):
+            user_id = rng.randint(1, users)
+            priority = rng.choices(range(4), weights=(1, 3, 10, 6))[0]
+            created = now - timedelta(minutes=rng.randint(0, 90 * 24 * 60))
+            created_at = created.strftime('%Y-%m-%dT%H:%M:%SZ')
+            kind = rng.random()
+            status = CLOSED if kind < 0.7 else ASSIGNED if kind < 0.8 else OPEN
+            responded_at = closed_at = assignee = None
+            if status != OPEN:
+                assignee = f'agent{rng.randint(1, agents)}'
+                responded_at = min(created + timedelta(minutes=rng.randint(5, 48 * 60)), now).strftime('%Y-%m-%dT%H:%M:%SZ')
+            if status == CLOSED:
+                closed_at = responded_at
+            rows.append((ticket_id, user_id, f'Ticket {ticket_id}', status, priority, int(user_id in premium), assignee,
+                         created_at, closed_at or responded_at or created_at,
+                         sla_deadline(created_at, priority, user_id in premium), responded_at, closed_at))
+            messages.append((ticket_id, f'Synthetic ticket number {ticket_id}', created_at))
+        conn.executemany(
+            "INSERT INTO tickets (id, user_id, subject, status, priority, premium, assignee, created_at, updated_at, "
+            "sla_due_at, responded_at, closed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);", rows)
+        conn.executemany("INSERT INTO ticket_messages (ticket_id, body, created_at) VALUES (?, ?, ?);", messages)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic benchmark database.")
+    parser.add_argument('path')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--services', type=int, default=20)
+    parser.add_argument('--subscriptions', type=int, default=30000)
+    parser.add_argument('--tickets', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--rounds', type=int, default=4, help="bcrypt cost of the shared password hash")
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        parser.error(f"{args.path} already exists")
+    started = time.perf_counter()
+    generate_database(args.path, args.users, args.services, args.subscriptions, args.seed, args.rounds,
+                      tickets=args.tickets).close()
+    print(f"{args.path}: {args.users} users, {args.services} services, {args.subscriptions} subscriptions, "
+          f"{args.tickets} tickets in {time.perf_counter() - started:.1f}s")
+
+if __name__ == '__main__':
+    main()
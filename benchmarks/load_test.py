@@ -0,0 +1,400 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import secrets
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datagen import BENCH_PASSWORD, generate_database, user_email
+
+# Load test for every route of app.py, driven concurrently through Flask's
+# test client against a generated database.
+#
+#   python benchmarks/load_test.py                       # run and print the table
+#   python benchmarks/load_test.py --save-baseline       # store benchmarks/baseline.json
+#   python benchmarks/load_test.py --compare             # fail on regressions vs the baseline
+#
+# Each route is a phase: `requests` calls spread over `concurrency` threads,
+# repeated `repeat` times. Per route it keeps the median of each metric
+# (throughput, p50/p99 latency) over the repeats, and the process peak RSS.
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+EXCLUDED_ENDPOINTS = {'static'}
+
+class Context:
+    def __init__(self, users, services, subscription_pairs, seed):
+        self.users = users
+        self.services = services
+        self.subscription_pairs = subscription_pairs
+        self.seed = seed
+        self.run_tag = f'{int(time.time())}'
+        self.created_user_ids = []
+        self.lock = threading.Lock()
+        self.signer = None # app.get_token_signer(), set once the app is configured
+        self.admin_token = secrets.token_urlsafe(16) # ADMIN_TOKEN, sent by the /admin scenarios
+        self.ticket_pairs = [] # (user_id, ticket_id) of generated tickets
+
+    def rng(self, i):
+        return random.Random(self.seed * 1000003 + i)
+
+    def random_user(self, i):
+        return self.rng(i).randint(1, self.users)
+
+    def random_service(self, i):
+        return self.rng(i).randint(1, self.services)
+
+    def pair(self, i):
+        return self.subscription_pairs[i % len(self.subscription_pairs)]
+
+    def ticket(self, i):
+        return self.ticket_pairs[self.rng(i).randrange(len(self.ticket_pairs))]
+
+    def ticket_ids(self, i, count=100):
+        rng = self.rng(i)
+        return [rng.randrange(len(self.ticket_pairs)) + 1 for _ in range(count)]
+
+def remember_user(response, ctx):
+    if response.status_code == 201:
+        with ctx.lock:
+            ctx.created_user_ids.append(response.get_json()['user_id'])
+
+def as_user(ctx, template, user_id, *args, **kwargs):
+    # Token signed directly (epoch 0 in a generated database): these scenarios measure the route, not /login.
+    kwargs['headers'] = {'Authorization': f'Bearer {ctx.signer.issue(user_id, 0)}'}
+    return template.format(user_id, *args), kwargs
+
+def as_admin(ctx, url):
+    # Routes outside /admin that still need the admin token (run_phase adds it to the /admin ones).
+    return url, {'headers': {'X-Admin-Token': ctx.admin_token}}
+
+def created_user(ctx, i):
+    return ctx.created_user_ids[i % len(ctx.created_user_ids)]
+
+def client_address(i):
+    return f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}'
+
+def bulk_body(i, ctx, rows=100):
+    return '\n'.join(json.dumps({
+        'email': f'bulk{ctx.run_tag}-{i}-{r}@bench.example', 'password': 'p', 'first_name': 'Bulk', 'last_name': str(r)
+    }) for r in range(rows))
+
+# (method, rule) -> dict(request=fn(i, ctx) -> (url, kwargs), expect=statuses, requests=override, after=fn)
+SCENARIOS = {
+    ('GET', '/'): dict(request=lambda i, ctx: ('/', {})),
+    ('POST', '/users'): dict(
+        request=lambda i, ctx: ('/users', {'json': {
+            'email': f'load{ctx.run_tag}-{i}@bench.example', 'password': 'p', 'first_name': 'Load', 'last_name': 'Test'}}),
+        expect={201}, after=remember_user),
+    ('POST', '/admin/users/bulk'): dict(
+        request=lambda i, ctx: ('/admin/users/bulk?format=ndjson', {'data': bulk_body(i, ctx),
+                                                                     'content_type': 'application/x-ndjson'}),
+        expect={201}, requests=10),
+    ('GET', '/users'): dict(request=lambda i, ctx: ('/users?limit=100', {})),
+    ('GET', '/users/<int:user_id>'): dict(request=lambda i, ctx: as_user(ctx, '/users/{}', ctx.random_user(i))),
+    ('PUT', '/users/<int:user_id>'): dict(
+        request=lambda i, ctx: as_user(ctx, '/users/{}', ctx.random_user(i), json={'first_name': f'Renamed{i}'})),
+    ('DELETE', '/users/<int:user_id>'): dict(
+        request=lambda i, ctx: as_user(ctx, '/users/{}', created_user(ctx, i)), expect={200, 401, 404}),
+    ('POST', '/logout'): dict(
+        # Created users only, so the other scenarios' epoch-0 tokens stay valid.
+        request=lambda i, ctx: as_user(ctx, '/logout', created_user(ctx, i)), expect={200, 401}),
+    ('POST', '/login'): dict(
+        # One client address per request, as many real users would be: the login guard limits per IP.
+        request=lambda i, ctx: ('/login', {'json': {'email': user_email(ctx.random_user(i)), 'password': BENCH_PASSWORD},
+                                           'environ_base': {'REMOTE_ADDR': client_address(i)}})),
+    ('GET', '/search/users'): dict(
+        request=lambda i, ctx: (f'/search/users?email=user{ctx.random_user(i)}&limit=20', {}), expect={200, 404}),
+    ('GET', '/changes'): dict(
+        request=lambda i, ctx: as_admin(ctx, f'/changes?since={ctx.rng(i).randint(0, ctx.users)}&limit=100')),
+    ('GET', '/metrics'): dict(request=lambda i, ctx: ('/metrics', {}), requests=50),
+    ('GET', '/metrics/slow-queries'): dict(request=lambda i, ctx: ('/metrics/slow-queries', {})),
+    ('POST', '/admin/profiler'): dict(
+        request=lambda i, ctx: ('/admin/profiler', {'json': {'enabled': i % 2 == 0}}), requests=20),
+    ('GET', '/admin/profiler'): dict(request=lambda i, ctx: ('/admin/profiler?limit=20', {})),
+    ('GET', '/admin/expiry'): dict(request=lambda i, ctx: ('/admin/expiry', {})),
+    ('POST', '/admin/expiry/run'): dict(request=lambda i, ctx: ('/admin/expiry/run', {}), requests=10),
+    ('GET', '/admin/stats'): dict(request=lambda i, ctx: ('/admin/stats', {})),
+    ('GET', '/admin/shards'): dict(request=lambda i, ctx: ('/admin/shards', {})),
+    ('GET', '/admin/snapshots'): dict(request=lambda i, ctx: ('/admin/snapshots', {})),
+    ('POST', '/admin/snapshots/refresh'): dict(request=lambda i, ctx: ('/admin/snapshots/refresh', {}),
+                                              expect={200, 409}, requests=5),
+    ('GET', '/metrics/db-pool'): dict(request=lambda i, ctx: ('/metrics/db-pool', {})),
+    ('GET', '/metrics/password-pool'): dict(request=lambda i, ctx: ('/metrics/password-pool', {})),
+    ('GET', '/metrics/login-guard'): dict(request=lambda i, ctx: ('/metrics/login-guard', {})),
+    ('GET', '/metrics/catalog-cache'): dict(request=lambda i, ctx: ('/metrics/catalog-cache', {})),
+    ('GET', '/services'): dict(request=lambda i, ctx: ('/services', {})),
+    ('GET', '/services/<int:service_id>'): dict(request=lambda i, ctx: (f'/services/{ctx.random_service(i)}', {})),
+    ('GET', '/admin/promotions'): dict(request=lambda i, ctx: ('/admin/promotions', {})),
+    ('POST', '/admin/promotions'): dict(
+        request=lambda i, ctx: ('/admin/promotions', {'json': {'kind': 'percent', 'value': 5 + i % 20,
+                                                               'service_id': ctx.random_service(i)}}),
+        expect={201}, requests=20),
+    ('GET', '/pricing/quote'): dict(request=lambda i, ctx: (f'/pricing/quote?user_id={ctx.random_user(i)}', {})),
+    ('POST', '/admin/pricing/reprice'): dict(request=lambda i, ctx: ('/admin/pricing/reprice', {}), requests=3),
+    ('GET', '/subscriptions'): dict(
+        request=lambda i, ctx: as_admin(ctx, '/subscriptions?user_ids=' + ','.join(str(ctx.random_user(i * 50 + k))
+                                                                                 for k in range(50)))),
+    ('GET', '/users/<int:user_id>/subscriptions'): dict(
+        request=lambda i, ctx: as_user(ctx, '/users/{}/subscriptions', ctx.random_user(i)), expect={200, 404}),
+    ('GET', '/users/<int:user_id>/subscriptions/<int:service_id>'): dict(
+        request=lambda i, ctx: as_user(ctx, '/users/{}/subscriptions/{}', *ctx.pair(i))),
+    ('POST', '/users/<int:user_id>/subscriptions'): dict(
+        request=lambda i, ctx: as_user(ctx, '/users/{}/subscriptions', ctx.random_user(i),
+                                       json={'service_id': ctx.random_service(i)}),
+        expect={201, 409}),
+    ('PUT', '/users/<int:user_id>/subscriptions/<int:service_id>'): dict(
+        request=lambda i, ctx: as_user(ctx, '/users/{}/subscriptions/{}', *ctx.pair(i), json={'active': i % 2})),
+    ('DELETE', '/users/<int:user_id>/subscriptions/<int:service_id>'): dict(
+        request=lambda i, ctx: as_user(ctx, '/users/{}/subscriptions/{}', *ctx.pair(-1 - i)), expect={200, 404}),
+    ('POST', '/users/<int:user_id>/tickets'): dict(
+        request=lambda i, ctx: as_user(ctx, '/users/{}/tickets', ctx.random_user(i), json={
+            'subject': f'Load ticket {i}', 'body': 'Something is wrong', 'priority': ['high', 'normal', 'low'][i % 3]}),
+        expect={201}),
+    ('GET', '/users/<int:user_id>/tickets'): dict(
+        request=lambda i, ctx: as_user(ctx, '/users/{}/tickets', ctx.ticket(i)[0])),
+    ('GET', '/users/<int:user_id>/tickets/<int:ticket_id>'): dict(
+        request=lambda i, ctx: as_user(ctx, '/users/{}/tickets/{}', *ctx.ticket(i))),
+    ('POST', '/users/<int:user_id>/tickets/<int:ticket_id>/messages'): dict(
+        request=lambda i, ctx: as_user(ctx, '/users/{}/tickets/{}/messages', *ctx.ticket(i), json={'body': 'Any news?'}),
+        expect={201, 409}),
+    ('GET', '/admin/tickets/queue'): dict(request=lambda i, ctx: ('/admin/tickets/queue?limit=20', {})),
+    ('POST', '/admin/tickets/next'): dict(
+        request=lambda i, ctx: ('/admin/tickets/next', {'json': {'assignee': f'agent{i % 20 + 1}'}}), expect={200, 404}),
+    ('GET', '/admin/tickets/sla'): dict(request=lambda i, ctx: (f'/admin/tickets/sla?limit=20&breached={i % 2}', {})),
+    ('GET', '/admin/tickets'): dict(request=lambda i, ctx: (f'/admin/tickets?assignee=agent{i % 20 + 1}', {})),
+    ('GET', '/admin/tickets/<int:ticket_id>'): dict(
+        request=lambda i, ctx: (f'/admin/tickets/{ctx.ticket(i)[1]}', {})),
+    ('POST', '/admin/tickets/<int:ticket_id>/messages'): dict(
+        request=lambda i, ctx: (f'/admin/tickets/{ctx.ticket(i)[1]}/messages',
+                                {'json': {'agent': f'agent{i % 20 + 1}', 'body': 'Looking into it'}}),
+        expect={201, 409}),
+    ('POST', '/admin/tickets/bulk/assign'): dict(
+        request=lambda i, ctx: ('/admin/tickets/bulk/assign',
+                                {'json': {'ids': ctx.ticket_ids(i), 'assignee': f'agent{i % 20 + 1}' if i % 4 else None}}),
+        requests=50),
+    ('POST', '/admin/tickets/bulk/close'): dict(
+        request=lambda i, ctx: ('/admin/tickets/bulk/close', {'json': {'ids': ctx.ticket_ids(i)}}), requests=20),
+    ('GET', '/admin/archive'): dict(request=lambda i, ctx: ('/admin/archive', {})),
+    ('POST', '/admin/archive/run'): dict(
+        request=lambda i, ctx: ('/admin/archive/run', {'json': {'days': 90}}), expect={200, 409}, requests=3),
+    ('GET', '/admin/archive/users/<int:user_id>'): dict(
+        request=lambda i, ctx: (f'/admin/archive/users/{ctx.random_user(i)}', {}), expect={200, 404}),
+    ('GET', '/users/<int:user_id>/subscriptions/history'): dict(
+        request=lambda i, ctx: as_user(ctx, '/users/{}/subscriptions/history', ctx.random_user(i)), expect={200, 404}),
+}
+
+# Phases run in this order (creations before the deletions that consume them); others follow.
+PHASE_ORDER = [('POST', '/users'), ('POST', '/logout'), ('DELETE', '/users/<int:user_id>')]
+
+def list_routes(flask_app):
+    routes = []
+    for rule in flask_app.url_map.iter_rules():
+        if rule.endpoint in EXCLUDED_ENDPOINTS:
+            continue
+        for method in sorted(rule.methods - {'HEAD', 'OPTIONS'}):
+            routes.append((method, rule.rule))
+    return routes
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def run_phase(flask_app, ctx, method, rule, scenario, requests, concurrency, offset=0):
+    local = threading.local()
+    expect = scenario.get('expect', {200})
+
+    def call(i):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = flask_app.test_client()
+        url, kwargs = scenario['request'](i, ctx)
+        if url.startswith('/admin/'):
+            kwargs['headers'] = {**kwargs.get('headers', {}), 'X-Admin-Token': ctx.admin_token}
+        started = time.perf_counter()
+        response = client.open(url, method=method, **kwargs)
+        response.get_data()
+        elapsed = time.perf_counter() - started
+        if scenario.get('after'):
+            scenario['after'](response, ctx)
+        return elapsed, response.status_code in expect
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(call, range(offset, offset + requests)))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(elapsed for elapsed, _ in outcomes)
+    return {
+        'requests': requests,
+        'errors': sum(1 for _, ok in outcomes if not ok),
+        'throughput': requests / wall if wall else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def median_result(runs):
+    result = {}
+    for field in runs[0]:
+        values = sorted(run[field] for run in runs)
+        result[field] = values[len(values) // 2]
+    result['errors'] = sum(run['errors'] for run in runs)
+    result['requests'] = sum(run['requests'] for run in runs)
+    result['peak_rss_mb'] = runs[-1]['peak_rss_mb']
+    return result
+
+# Run settings that must match the baseline's for the comparison to mean anything.
+COMPARABLE_META = ('users', 'services', 'subscriptions', 'tickets', 'requests', 'concurrency', 'repeat',
+                   'bcrypt_rounds', 'seed')
+
+def run_meta(args):
+    return {key: getattr(args, key) for key in COMPARABLE_META}
+
+def meta_mismatches(meta, baseline):
+    # (key, baseline value, current value) for each setting that differs; a missing key differs too.
+    recorded = baseline.get('meta', {})
+    return [(key, recorded.get(key), value) for key, value in meta.items() if recorded.get(key) != value]
+
+def compare(results, baseline, tolerance, min_delta_ms, p99_min_delta_ms):
+    # Returns the list of regressions (route, metric, baseline, current).
+    regressions = []
+    for key, current in results['routes'].items():
+        before = baseline['routes'].get(key)
+        if before is None:
+            continue
+        for metric, noise_ms in (('p50_ms', min_delta_ms), ('p99_ms', max(min_delta_ms, p99_min_delta_ms))):
+            if current[metric] > before[metric] * (1 + tolerance) and current[metric] - before[metric] > noise_ms:
+                regressions.append((key, metric, before[metric], current[metric]))
+        if current['throughput'] < before['throughput'] * (1 - tolerance):
+            regressions.append((key, 'throughput', before['throughput'], current['throughput']))
+        if current['errors'] > before['errors']:
+            regressions.append((key, 'errors', before['errors'], current['errors']))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test every app.py route against a generated database.")
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--services', type=int, default=20)
+    parser.add_argument('--subscriptions', type=int, default=30000)
+    parser.add_argument('--tickets', type=int, default=20000)
+    parser.add_argument('--requests', type=int, default=200, help="Requests per route (some routes use fewer)")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per route, the median is kept")
+    parser.add_argument('--bcrypt-rounds', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--only', action='append', help="Run only routes whose rule contains this text")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--save-baseline', action='store_true', help=f"Store the results in {BASELINE_PATH}")
+    parser.add_argument('--compare', action='store_true', help="Compare with the stored baseline")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=0.3, help="Allowed relative slowdown")
+    parser.add_argument('--min-delta-ms', type=float, default=5.0, help="Ignore latency changes smaller than this")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        mismatches = meta_mismatches(run_meta(args), baseline)
+        for key, recorded, value in mismatches:
+            print(f"baseline recorded with {key}={recorded}, this run uses {value}")
+        if mismatches:
+            print("not comparable: rerun with the baseline's settings, or record a new one with --save-baseline")
+            return 2
+
+    import app as app_module
+    flask_app = app_module.app
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'load_test.db')
+        started = time.perf_counter()
+        conn = generate_database(database, args.users, args.services, args.subscriptions, args.seed, args.bcrypt_rounds,
+                                 tickets=args.tickets)
+        pairs = conn.execute("SELECT user_id, service_id FROM user_services ORDER BY id LIMIT 20000;").fetchall()
+        ticket_pairs = conn.execute("SELECT user_id, id FROM tickets ORDER BY id;").fetchall()
+        conn.close()
+        print(f"database generated in {time.perf_counter() - started:.1f}s")
+
+        flask_app.config['DATABASE'] = database
+        flask_app.config['BCRYPT_ROUNDS'] = args.bcrypt_rounds
+        ctx = Context(args.users, args.services, pairs, args.seed)
+        ctx.signer = app_module.get_token_signer()
+        flask_app.config['ADMIN_TOKEN'] = ctx.admin_token
+        ctx.ticket_pairs = ticket_pairs
+
+        routes = list_routes(flask_app)
+        missing = [route for route in routes if route not in SCENARIOS]
+        for method, rule in missing:
+            print(f"WARNING: no load scenario for {method} {rule}")
+        ordered = [r for r in PHASE_ORDER if r in routes] + [r for r in routes if r not in PHASE_ORDER]
+        if args.only:
+            ordered = [r for r in ordered if any(text in r[1] for text in args.only)]
+
+        results = {
+            'meta': {
+                **run_meta(args),
+                'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version, 'cpus': os.cpu_count(),
+            },
+            'routes': {},
+            'missing': [f'{m} {r}' for m, r in missing],
+        }
+        print(f"{'route':<62} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6} {'rss MB':>7}")
+        for method, rule in ordered:
+            scenario = SCENARIOS.get((method, rule))
+            if scenario is None:
+                continue
+            requests = min(args.requests, scenario.get('requests', args.requests))
+            result = median_result([
+                run_phase(flask_app, ctx, method, rule, scenario, requests, args.concurrency, offset=rep * requests)
+                for rep in range(args.repeat)
+            ])
+            key = f'{method} {rule}'
+            results['routes'][key] = result
+            print(f"{key:<62} {result['throughput']:9.1f} {result['p50_ms']:8.2f} {result['p99_ms']:8.2f} "
+                  f"{result['errors']:6d} {result['peak_rss_mb']:7.1f}")
+
+        app_module.profiler.stop()
+        app_module.get_password_hasher().shutdown()
+
+    results['meta']['peak_rss_mb'] = peak_rss_mb()
+    print(f"peak RSS: {results['meta']['peak_rss_mb']:.1f} MB")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"baseline written to {args.baseline}")
+    if args.compare:
+        unmeasured = sorted(set(results['routes']) - set(baseline['routes']))
+        for key in unmeasured:
+            print(f"not in the baseline: {key}")
+        # With more threads than cores, a request can wait one GIL switch interval per other thread:
+        # p99 changes below that are scheduling noise, not route cost.
+        p99_min_delta_ms = sys.getswitchinterval() * 1000 * max(0, args.concurrency - (os.cpu_count() or 1))
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms, p99_min_delta_ms)
+        for key, metric, before, after in regressions:
+            print(f"REGRESSION {key}: {metric} {before:.2f} -> {after:.2f}")
+        if regressions:
+            return 1
+        print(f"no regression beyond {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
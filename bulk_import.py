@@ -0,0 +1,225 @@
+import argparse
+import csv
+import json
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+
+from passwords import DEFAULT_ROUNDS, get_hasher
+
+# --- Bulk User Import ---
+# Rows are read as a stream, validated, deduplicated and hashed in parallel one
+# chunk at a time, then inserted with a single executemany per chunk inside one
+# transaction. The write connection is only held for the insert itself.
+#
+# The report keeps the counts of every row but the details of the first
+# `report_limit` rows only (by row number), so that its size does not grow
+# with the input; `on_created(emails)` is called for each inserted chunk.
+
+REQUIRED_FIELDS = ('email', 'password', 'first_name', 'last_name')
+DEFAULT_CHUNK_SIZE = 1000
+SQL_VARIABLE_BATCH = 500 # stay well below SQLITE_MAX_VARIABLE_NUMBER
+
+def iter_records(lines, fmt):
+    # Yields (row_number, record) where record is a dict, or (row_number, error message).
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row_number, row in enumerate(reader, start=1):
+            yield row_number, row
+    elif fmt == 'ndjson':
+        for row_number, line in enumerate(lines, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield row_number, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield row_number, "Each line must be a JSON object"
+                continue
+            yield row_number, record
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+def validate_record(record):
+    # Returns an error message, or None if the record can be inserted.
+    if isinstance(record, str):
+        return record
+    missing = [field for field in REQUIRED_FIELDS if not record.get(field)]
+    if missing:
+        return f"Missing fields: {', '.join(missing)}"
+    not_strings = [field for field in REQUIRED_FIELDS if not isinstance(record[field], str)]
+    if not_strings: # NDJSON can carry numbers, lists...
+        return f"Fields must be strings: {', '.join(not_strings)}"
+    if '@' not in record['email']:
+        return "Invalid email"
+    return None
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def find_existing_emails(conn, emails):
+    existing = set()
+    emails = list(emails)
+    for start in range(0, len(emails), SQL_VARIABLE_BATCH):
+        batch = emails[start:start + SQL_VARIABLE_BATCH]
+        placeholders = ', '.join('?' * len(batch))
+        rows = conn.execute(f"SELECT email FROM users WHERE email IN ({placeholders});", batch)
+        existing.update(row[0] for row in rows)
+    return existing
+
+def fetch_ids_by_email(conn, emails):
+    ids = {}
+    emails = list(emails)
+    for start in range(0, len(emails), SQL_VARIABLE_BATCH):
+        batch = emails[start:start + SQL_VARIABLE_BATCH]
+        placeholders = ', '.join('?' * len(batch))
+        rows = conn.execute(f"SELECT id, email FROM users WHERE email IN ({placeholders});", batch)
+        ids.update((row[1], row[0]) for row in rows)
+    return ids
+
+def insert_chunk(conn, rows):
+    # rows: list of (row_number, email, hashed_password, first_name, last_name).
+    # Returns {row_number: user_id or None}, None meaning the email already existed.
+    params = [(email, hashed, first_name, last_name) for _, email, hashed, first_name, last_name in rows]
+    try:
+        with conn:
+            conn.executemany(
+                "INSERT INTO users (email, password, first_name, last_name) VALUES (?, ?, ?, ?);",
+                params
+            )
+    except sqlite3.IntegrityError:
+        # Someone inserted one of these emails since we checked: redo the chunk row by row.
+        results = {}
+        with conn:
+            for (row_number, *_), values in zip(rows, params):
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO users (email, password, first_name, last_name) VALUES (?, ?, ?, ?);",
+                    values
+                )
+                results[row_number] = cursor.lastrowid if cursor.rowcount else None
+        return results
+
+    ids = fetch_ids_by_email(conn, (email for _, email, *_ in rows))
+    return {row_number: ids.get(email) for row_number, email, *_ in rows}
+
+def import_users(records, hasher, connection, chunk_size=DEFAULT_CHUNK_SIZE, report_limit=None, on_created=None):
+    # connection: context manager factory yielding a write connection for one chunk.
+    # report_limit: rows detailed in report['rows'] (None = all), the others are counted in 'rows_omitted'.
+    report = {'created': 0, 'duplicate': 0, 'invalid': 0, 'rows': [], 'rows_omitted': 0}
+    seen_emails = set()
+    chunk_rows = []
+
+    def record_row(row_number, status, email=None, **extra):
+        report[status] += 1
+        chunk_rows.append(dict(row=row_number, status=status, email=email, **extra))
+
+    def import_chunk(chunk):
+        candidates = []
+        for row_number, record in chunk:
+            error = validate_record(record)
+            if error:
+                email = record.get('email') if isinstance(record, dict) else None
+                record_row(row_number, 'invalid', email if isinstance(email, str) else None, reason=error)
+            elif record['email'] in seen_emails:
+                record_row(row_number, 'duplicate', record['email'], reason='Duplicate email in input')
+            else:
+                seen_emails.add(record['email'])
+                candidates.append((row_number, record))
+
+        if not candidates:
+            return
+
+        with connection() as conn:
+            existing = find_existing_emails(conn, (record['email'] for _, record in candidates))
+        new_rows = []
+        for row_number, record in candidates:
+            if record['email'] in existing:
+                record_row(row_number, 'duplicate', record['email'], reason='Email already registered')
+            else:
+                new_rows.append((row_number, record))
+
+        if not new_rows:
+            return
+
+        # Parallel hashing happens outside of any transaction.
+        hashed = hasher.hash_many(record['password'] for _, record in new_rows)
+        rows = [
+            (row_number, record['email'], hashed_pass, record['first_name'], record['last_name'])
+            for (row_number, record), hashed_pass in zip(new_rows, hashed)
+        ]
+        with connection() as conn:
+            results = insert_chunk(conn, rows)
+        created = []
+        for row_number, email, *_ in rows:
+            user_id = results.get(row_number)
+            if user_id:
+                record_row(row_number, 'created', email, user_id=user_id)
+                created.append(email)
+            else:
+                record_row(row_number, 'duplicate', email, reason='Email already registered')
+        if on_created is not None and created:
+            on_created(created)
+
+    for chunk in chunked(records, chunk_size):
+        import_chunk(chunk)
+        # Chunks come in row order: the rows kept are the first ones of the input.
+        chunk_rows.sort(key=lambda row: row['row'])
+        kept = chunk_rows if report_limit is None else chunk_rows[:max(0, report_limit - len(report['rows']))]
+        report['rows'].extend(kept)
+        report['rows_omitted'] += len(chunk_rows) - len(kept)
+        chunk_rows.clear()
+    return report
+
+# --- Command Line Interface ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import users from a CSV or NDJSON file.")
+    parser.add_argument('path', help="Input file, or - for stdin")
+    parser.add_argument('--format', choices=('csv', 'ndjson'), help="Defaults to the file extension")
+    parser.add_argument('--database', default='extended_database.db')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--rounds', type=int, default=DEFAULT_ROUNDS, help="bcrypt cost factor")
+    parser.add_argument('--workers', type=int, default=None, help="Hashing processes")
+    parser.add_argument('--report', help="Write the per-row report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ('csv' if args.path.endswith('.csv') else 'ndjson')
+    conn = sqlite3.connect(args.database)
+    conn.execute("PRAGMA foreign_keys = ON;")
+
+    @contextmanager
+    def connection():
+        yield conn
+
+    hasher = get_hasher(rounds=args.rounds, workers=args.workers)
+    started = time.perf_counter()
+    try:
+        stream = sys.stdin if args.path == '-' else open(args.path, newline='', encoding='utf-8')
+        with stream:
+            report = import_users(iter_records(stream, fmt), hasher, connection, args.chunk_size)
+    finally:
+        conn.close()
+        hasher.shutdown()
+    elapsed = time.perf_counter() - started
+
+    total = report['created'] + report['duplicate'] + report['invalid']
+    print(f"{total} rows in {elapsed:.2f}s ({total / elapsed if elapsed else 0:.0f} rows/s): "
+          f"{report['created']} created, {report['duplicate']} duplicate, {report['invalid']} invalid.")
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f)
+    return 0 if report['invalid'] == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
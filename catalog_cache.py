@@ -0,0 +1,63 @@
+import hashlib
+import threading
+import time
+
+from serialization import get_encoder
+from services_manager import SELECT_SERVICES, row_to_service
+
+# --- Service Catalog Cache ---
+# The catalog is read on nearly every request but almost never written. It is
+# kept in memory, keyed by the catalog_version row that triggers on `services`
+# bump on every write. The version is re-read at most once per
+# `revalidate_seconds`, so writes (from this process or another) are seen
+# within that delay. Response bodies are encoded once per version, with the
+# same encoder as the other JSON responses.
+
+class CatalogSnapshot:
+    def __init__(self, version, services, encode):
+        self.version = version
+        self.services = services
+        self.by_id = {service['id']: service for service in services}
+        self.body = encode(services)
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+        self.bodies_by_id = {sid: encode(service) for sid, service in self.by_id.items()}
+        self.etags_by_id = {sid: hashlib.sha256(body).hexdigest()[:32] for sid, body in self.bodies_by_id.items()}
+
+class CatalogCache:
+    def __init__(self, revalidate_seconds=1.0, encode=None):
+        self.revalidate_seconds = revalidate_seconds
+        self.encode = encode or get_encoder() # obj -> UTF-8 bytes
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked_at = 0.0
+        self.hits = 0
+        self.reloads = 0
+
+    def get(self, conn):
+        now = time.monotonic()
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and now - self._checked_at < self.revalidate_seconds:
+                self.hits += 1
+                return snapshot
+
+        version = conn.execute("SELECT version FROM catalog_version WHERE id = 1;").fetchone()[0]
+        if snapshot is None or snapshot.version != version:
+            rows = conn.execute(SELECT_SERVICES + " ORDER BY id;").fetchall()
+            snapshot = CatalogSnapshot(version, [row_to_service(row) for row in rows], self.encode)
+            with self._lock:
+                self.reloads += 1
+        with self._lock:
+            # Another thread may have loaded a newer version meanwhile; keep the newest.
+            if self._snapshot is None or self._snapshot.version <= snapshot.version:
+                self._snapshot = snapshot
+            self._checked_at = now
+            return self._snapshot
+
+    def stats(self):
+        with self._lock:
+            return {
+                'version': self._snapshot.version if self._snapshot else None,
+                'hits': self.hits,
+                'reloads': self.reloads,
+            }
@@ -0,0 +1,37 @@
+import json
+import threading
+
+# --- Change Feed ---
+# Reads the `changes` outbox filled by triggers (see migrations.py).
+# Consumers keep the last `seq` they processed and ask for what follows.
+# ChangeNotifier wakes waiting long-polls as soon as this process commits a
+# write; writes from other processes are picked up by the periodic re-check.
+
+CHANGES_QUERY = "SELECT seq, entity, entity_id, op, data, at FROM changes WHERE seq > ? ORDER BY seq LIMIT ?;"
+
+def fetch_changes(conn, since, limit):
+    changes = []
+    for seq, entity, entity_id, op, data, at in conn.execute(CHANGES_QUERY, (since, limit)):
+        changes.append({'seq': seq, 'entity': entity, 'entity_id': entity_id, 'op': op,
+                        'data': json.loads(data), 'at': at})
+    return changes
+
+def format_sse(change):
+    # One Server-Sent Event; the id lets EventSource resume with Last-Event-ID.
+    return f"id: {change['seq']}\nevent: change\ndata: {json.dumps(change)}\n\n"
+
+class ChangeNotifier:
+    def __init__(self):
+        self._condition = threading.Condition()
+        self.version = 0
+
+    def notify(self):
+        with self._condition:
+            self.version += 1
+            self._condition.notify_all()
+
+    def wait(self, version, timeout):
+        # Returns once notify() has been called since `version` was read, or after timeout.
+        with self._condition:
+            self._condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
@@ -0,0 +1,157 @@
+import sqlite3
+import threading
+import time
+import queue
+
+# --- SQLite Connection Pooling ---
+# Connections are opened and configured once, then handed out to requests and
+# given back on teardown instead of being closed.
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,       # milliseconds
+    'mmap_size': 268435456,     # 256 MB
+    'cache_size': -20000,       # negative = KiB, so ~20 MB per connection
+    'foreign_keys': 'ON',
+}
+
+class PoolTimeout(Exception):
+    pass
+
+def open_connection(database, pragmas, read_only=False, factory=sqlite3.Connection, trace=None):
+    conn = sqlite3.connect(database, check_same_thread=False, factory=factory)
+    conn.row_factory = sqlite3.Row # This makes rows behave like dicts
+    if trace is not None:
+        conn.set_trace_callback(trace)
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value};")
+    if read_only:
+        conn.execute("PRAGMA query_only = ON;")
+    return conn
+
+class ConnectionPool:
+    def __init__(self, database, size, pragmas, read_only=False, name='pool', factory=sqlite3.Connection, trace=None):
+        self.database = database
+        self.size = size
+        self.pragmas = pragmas
+        self.read_only = read_only
+        self.name = name
+        self.factory = factory
+        self.trace = trace
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._checkout_started = {}
+        # Metrics
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.checkout_seconds_total = 0.0
+        self.checkout_seconds_max = 0.0
+
+    def _try_open(self):
+        with self._lock:
+            if self._opened >= self.size:
+                return None
+            self._opened += 1
+        try:
+            return open_connection(self.database, self.pragmas, self.read_only, self.factory, self.trace)
+        except sqlite3.Error:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    def acquire(self, timeout=None):
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._try_open()
+            if conn is None:
+                try:
+                    conn = self._idle.get(timeout=timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self.timeouts += 1
+                    raise PoolTimeout(f"No connection available in '{self.name}' after {timeout}s")
+        now = time.perf_counter()
+        waited = now - started
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+            self._checkout_started[id(conn)] = now
+        return conn
+
+    def release(self, conn):
+        # Never hand a connection with a half-finished transaction to the next request.
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            started = self._checkout_started.pop(id(conn), None)
+            if started is not None:
+                held = time.perf_counter() - started
+                self.checkout_seconds_total += held
+                self.checkout_seconds_max = max(self.checkout_seconds_max, held)
+        self._idle.put_nowait(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._opened = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'size': self.size,
+                'opened': self._opened,
+                'in_use': len(self._checkout_started),
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': self.wait_seconds_total,
+                'wait_seconds_max': self.wait_seconds_max,
+                'checkout_seconds_total': self.checkout_seconds_total,
+                'checkout_seconds_max': self.checkout_seconds_max,
+            }
+
+class PoolSet:
+    """A single writer connection plus a pool of query_only readers on the same file."""
+
+    def __init__(self, database, read_pool_size, pragmas, **options):
+        # options (factory, trace) are passed on to every connection.
+        self.database = database
+        # The writer is opened first so journal_mode=WAL is in place before readers attach.
+        self.writer = ConnectionPool(database, 1, pragmas, read_only=False, name='writer', **options)
+        self.writer._idle.put_nowait(self.writer._try_open())
+        self.readers = ConnectionPool(database, read_pool_size, pragmas, read_only=True, name='readers', **options)
+
+    def close(self):
+        self.writer.close()
+        self.readers.close()
+
+    def stats(self):
+        return {'writer': self.writer.stats(), 'readers': self.readers.stats()}
+
+_pool_sets = {}
+_pool_sets_lock = threading.Lock()
+
+def get_pool_set(database, read_pool_size, pragmas, **options):
+    # One PoolSet per database file for the whole process.
+    with _pool_sets_lock:
+        pool_set = _pool_sets.get(database)
+        if pool_set is None:
+            pool_set = _pool_sets[database] = PoolSet(database, read_pool_size, pragmas, **options)
+        return pool_set
+
+def close_all_pools():
+    with _pool_sets_lock:
+        for pool_set in _pool_sets.values():
+            pool_set.close()
+        _pool_sets.clear()
@@ -0,0 +1,212 @@
+import argparse
+import json
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import date, timedelta
+
+# --- Subscription Expiry ---
+# Deactivates subscriptions whose end_date has passed and announces the ones
+# about to expire. Both sweeps walk the (active, end_date) index in small
+# batches, one short transaction each, with a pause in between so API writes
+# are never stuck behind the job for long. A subscription is "expired" the day
+# after its end_date; an "expiring" event is emitted once per end_date
+# (remembered in user_services.expiry_notice_for).
+
+EXPIRED = 'subscription.expired'
+EXPIRING = 'subscription.expiring'
+
+def _event(kind, row, at):
+    subscription_id, user_id, service_id, end_date = row
+    return {'type': kind, 'subscription_id': subscription_id, 'user_id': user_id, 'service_id': service_id,
+            'end_date': end_date, 'at': at}
+
+def expire_subscriptions(conn, today=None, batch_size=500, pause=0.01, emit=None):
+    """Sets active = 0 on active subscriptions ended before `today`; returns (count, batches)."""
+    today = today or date.today().isoformat()
+    expired = batches = 0
+    while True:
+        with conn:
+            rows = conn.execute(
+                "UPDATE user_services SET active = 0 WHERE id IN ("
+                " SELECT id FROM user_services WHERE active = 1 AND end_date < ? ORDER BY end_date LIMIT ?"
+                ") RETURNING id, user_id, service_id, end_date;",
+                (today, batch_size)
+            ).fetchall()
+        batches += 1
+        expired += len(rows)
+        if emit:
+            at = time.time()
+            for row in rows:
+                emit(_event(EXPIRED, row, at))
+        if len(rows) < batch_size:
+            return expired, batches
+        time.sleep(pause) # let queued writers in between batches
+
+def notify_expiring(conn, today=None, days=7, batch_size=500, pause=0.01, emit=None):
+    """Emits one EXPIRING event per active subscription ending within `days`; returns (count, batches)."""
+    today = today or date.today().isoformat()
+    horizon = (date.fromisoformat(today) + timedelta(days=days)).isoformat()
+    notified = batches = 0
+    while True:
+        with conn:
+            rows = conn.execute(
+                "UPDATE user_services SET expiry_notice_for = end_date WHERE id IN ("
+                " SELECT id FROM user_services WHERE active = 1 AND end_date BETWEEN ? AND ?"
+                " AND (expiry_notice_for IS NULL OR expiry_notice_for <> end_date) LIMIT ?"
+                ") RETURNING id, user_id, service_id, end_date;",
+                (today, horizon, batch_size)
+            ).fetchall()
+        batches += 1
+        notified += len(rows)
+        if emit:
+            at = time.time()
+            for row in rows:
+                emit(_event(EXPIRING, row, at))
+        if len(rows) < batch_size:
+            return notified, batches
+        time.sleep(pause)
+
+def sweep(conn, today=None, notice_days=7, batch_size=500, pause=0.01, emit=None):
+    started = time.perf_counter()
+    today = today or date.today().isoformat()
+    expired, expire_batches = expire_subscriptions(conn, today, batch_size, pause, emit)
+    expiring, notice_batches = notify_expiring(conn, today, notice_days, batch_size, pause, emit)
+    return {
+        'as_of': today,
+        'expired': expired,
+        'expiring': expiring,
+        'batches': expire_batches + notice_batches,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+def combine_reports(reports):
+    # One report for the sweeps of several databases (shards).
+    if len(reports) == 1:
+        return reports[0]
+    combined = {'as_of': reports[0]['as_of']}
+    for key in ('expired', 'expiring', 'batches', 'seconds'):
+        combined[key] = sum(report[key] for report in reports)
+    combined['seconds'] = round(combined['seconds'], 3)
+    return combined
+
+# --- Background Scheduler ---
+
+class ExpiryScheduler:
+    """Runs sweep() every `interval` seconds on a daemon thread, with its own connection."""
+
+    def __init__(self, connect, interval=3600.0, notice_days=7, batch_size=500, pause=0.01, history=200):
+        self.connect = connect # callable returning a new sqlite3 connection, or a list of them (one per shard)
+        self.interval = interval
+        self.notice_days = notice_days
+        self.batch_size = batch_size
+        self.pause = pause
+        self.listeners = []
+        self.recent_events = deque(maxlen=history)
+        self.last_report = None
+        self.sweeps = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock() # one sweep at a time (thread or run_once)
+        self._thread = None
+        self._stop = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def add_listener(self, listener):
+        # listener(event) is called from the sweeping thread for every emitted event.
+        self.listeners.append(listener)
+
+    def _emit(self, event):
+        self.recent_events.append(event)
+        for listener in self.listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                print(f"Expiry event listener failed: {e}")
+
+    def run_once(self, today=None):
+        with self._sweep_lock:
+            conns = self.connect()
+            conns = conns if isinstance(conns, list) else [conns]
+            try:
+                report = combine_reports([sweep(conn, today, self.notice_days, self.batch_size, self.pause, self._emit)
+                                          for conn in conns])
+            finally:
+                for conn in conns:
+                    conn.close()
+            self.sweeps += 1
+            self.last_report = report
+            return report
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return False
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop,), name='expiry-scheduler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        with self._lock:
+            thread, stop = self._thread, self._stop
+            self._thread = self._stop = None
+        if thread is not None:
+            stop.set()
+            thread.join()
+
+    def _run(self, stop):
+        # First sweep right away, to catch up on whatever expired while the app was down.
+        while not stop.is_set():
+            # Any failure is logged and retried on the next interval: a dead thread would be restarted by
+            # app.start_background_jobs() on the next request, sweeping again on every request.
+            try:
+                self.run_once()
+            except sqlite3.Error as e:
+                self.errors += 1
+                print(f"Database error during expiry sweep: {e}")
+            except Exception:
+                self.errors += 1
+                print("Expiry sweep failed:")
+                traceback.print_exc()
+            stop.wait(self.interval)
+
+    def status(self):
+        return {
+            'running': self.running,
+            'interval': self.interval,
+            'notice_days': self.notice_days,
+            'sweeps': self.sweeps,
+            'errors': self.errors,
+            'last_report': self.last_report,
+        }
+
+# --- Command Line Interface ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Deactivate expired subscriptions and list upcoming expiries.")
+    parser.add_argument('--database', default='extended_database.db')
+    parser.add_argument('--as-of', help="Sweep date (YYYY-MM-DD), defaults to today")
+    parser.add_argument('--notice-days', type=int, default=7)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--events', action='store_true', help="Print every event as a JSON line")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.database)
+    conn.execute("PRAGMA busy_timeout = 5000;")
+    emit = (lambda event: print(json.dumps(event))) if args.events else None
+    try:
+        result = sweep(conn, args.as_of, args.notice_days, args.batch_size, emit=emit)
+    finally:
+        conn.close()
+    print(json.dumps(result))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,197 @@
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+from db_pool import PoolTimeout
+
+# --- Group Commit ---
+# Request-path writes are queued to a single writer thread with its own
+# connection. It runs the mutations waiting in the queue in one transaction,
+# each under its own SAVEPOINT so that a failing one (IntegrityError...) only
+# undoes itself, and commits once for the whole batch. Callers wait on a
+# Future that is resolved after the COMMIT: each gets its own result or
+# exception, and nothing is reported before it is committed.
+#
+# Sparse writes get no added latency: a lone mutation is committed at once.
+# The writer only lingers up to `max_delay` seconds for more mutations (at
+# most `max_batch`) when its previous batch held several, i.e. during a burst.
+#
+# Mutations are fn(conn, *args): they run in the writer's transaction and
+# must neither commit nor roll back themselves.
+#
+# The statements and SQL time of each mutation (its SAVEPOINT and RELEASE
+# included, in place of a BEGIN and COMMIT of its own) are counted on the
+# writer thread and added to the caller's metrics.RequestStats by execute().
+
+class GroupCommitWriter:
+    """Single writer thread committing queued mutations in batches."""
+
+    def __init__(self, connect, max_batch=64, max_delay=0.002):
+        self.connect = connect # callable returning a new sqlite3 connection
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_batch_size = 0
+        # Metrics
+        self.batches = 0
+        self.mutations = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.batch_size_max = 0
+        self.queue_seconds_total = 0.0
+        self.commit_seconds_total = 0.0
+        self.commit_seconds_max = 0.0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return False
+            self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        # Mutations already queued are committed before the thread exits.
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def submit(self, fn, *args):
+        if not self.running:
+            self.start()
+        future = Future()
+        self._queue.put((future, fn, args, time.perf_counter()))
+        return future
+
+    def execute(self, fn, *args, timeout=None):
+        """Runs fn(conn, *args) in the next batch and returns its result once committed."""
+        future = self.submit(fn, *args)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            if future.cancel(): # still queued: it will never run
+                self.cancelled += 1
+                raise PoolTimeout(f"Write not started after {timeout}s")
+            return future.result() # already in a batch, about to be committed
+        finally:
+            metrics.add_to_request(getattr(future, 'sql_stats', None))
+
+    def _run(self):
+        conn = self.connect()
+        conn.isolation_level = None # BEGIN / SAVEPOINT / COMMIT are explicit
+        try:
+            stopping = False
+            while not stopping:
+                item = self._queue.get()
+                if item is None:
+                    break
+                batch, stopping = self._collect(item)
+                try:
+                    self._run_batch(conn, batch)
+                except Exception as e:
+                    # Never leave a caller waiting, whatever went wrong with the connection.
+                    for future, _, _, _ in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK;")
+        finally:
+            conn.close()
+
+    def _collect(self, first):
+        # (batch, stop requested); lingers for more mutations only while a burst is going on.
+        batch = [first]
+        deadline = time.perf_counter() + (self.max_delay if self._last_batch_size > 1 else 0.0)
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run_batch(self, conn, batch):
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE;")
+        done = [] # (future, result, exception) of the mutations in the open transaction
+        for future, fn, args, queued in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            self.queue_seconds_total += started - queued
+            metrics.begin_request() # this mutation's statements, handed to its caller
+            conn.execute("SAVEPOINT mutation;")
+            try:
+                result = fn(conn, *args)
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK TO mutation;")
+                    conn.execute("RELEASE mutation;")
+                    done.append((future, None, e))
+                else:
+                    # SQLite rolled the whole transaction back (I/O error, disk full...):
+                    # the earlier mutations of the batch are lost with it.
+                    future.sql_stats = metrics.end_request()
+                    self._resolve([(f, None, e) for f, _, _ in done] + [(future, None, e)])
+                    done = []
+                    conn.execute("BEGIN IMMEDIATE;")
+                    continue
+            else:
+                conn.execute("RELEASE mutation;")
+                done.append((future, result, None))
+            future.sql_stats = metrics.end_request()
+        try:
+            conn.execute("COMMIT;")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK;")
+            done = [(future, None, e) for future, _, _ in done]
+        self._resolve(done)
+
+        elapsed = time.perf_counter() - started
+        self._last_batch_size = len(batch)
+        self.batches += 1
+        self.batch_size_max = max(self.batch_size_max, len(batch))
+        self.commit_seconds_total += elapsed
+        self.commit_seconds_max = max(self.commit_seconds_max, elapsed)
+
+    def _resolve(self, outcomes):
+        for future, result, error in outcomes:
+            self.mutations += 1
+            if error is not None:
+                self.failed += 1
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'queued': self._queue.qsize(),
+            'batches': self.batches,
+            'mutations': self.mutations,
+            'failed': self.failed,
+            'cancelled': self.cancelled,
+            'batch_size_max': self.batch_size_max,
+            'queue_seconds_total': self.queue_seconds_total,
+            'commit_seconds_total': self.commit_seconds_total,
+            'commit_seconds_max': self.commit_seconds_max,
+        }
@@ -0,0 +1,199 @@
+import threading
+import time
+from collections import OrderedDict
+
+# --- Login Guard ---
+# Sheds credential-stuffing load before any database or bcrypt work:
+#   * a token bucket per client IP and per account (request rate + burst);
+#   * a sliding-window counter of failed logins per account and client IP
+#     (lockout): wrong passwords sent from elsewhere never lock the real user
+#     out, while each attacking address is cut off after `failure_limit`;
+#   * a short-lived negative cache of emails that do not exist.
+# Emails are normalized (account_key) for every structure.
+# Every structure is an LRU map capped at `max_keys`, so memory stays bounded
+# whatever the number of distinct IPs or emails an attacker cycles through.
+# Answers for unknown emails are delayed by the typical bcrypt verify time,
+# so they cannot be told apart from a wrong password by timing.
+
+class LoginRateLimited(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Login rate limited ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+class LRUMap:
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self.evictions = 0
+        self._items = OrderedDict()
+
+    def get(self, key):
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_keys:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key):
+        return self._items.pop(key, None)
+
+    def __len__(self):
+        return len(self._items)
+
+class TokenBucket:
+    """Per-key token buckets: `rate` tokens per second, at most `burst` stored."""
+
+    def __init__(self, rate, burst, max_keys):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = LRUMap(max_keys)
+
+    def take(self, key, now):
+        # Returns 0 when a token was taken, otherwise the seconds until one is available.
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = [float(self.burst), now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        if tokens >= 1:
+            self.buckets.set(key, [tokens - 1, now])
+            return 0.0
+        self.buckets.set(key, [tokens, now])
+        return (1 - tokens) / self.rate
+
+class SlidingWindowCounter:
+    """Approximate count of events over the last `window` seconds (two fixed windows, weighted)."""
+
+    def __init__(self, window, max_keys):
+        self.window = window
+        self.counters = LRUMap(max_keys)
+
+    def _current(self, key, now):
+        start = now - now % self.window
+        counter = self.counters.get(key)
+        if counter is None or counter[0] <= start - 2 * self.window:
+            return [start, 0, 0]
+        if counter[0] < start:
+            # Rolled over: the current window becomes the previous one (or nothing if older).
+            previous = counter[2] if counter[0] == start - self.window else 0
+            return [start, previous, 0]
+        return counter
+
+    def count(self, key, now):
+        start, previous, current = self._current(key, now)
+        return previous * (1 - (now - start) / self.window) + current
+
+    def add(self, key, now):
+        counter = self._current(key, now)
+        counter[2] += 1
+        self.counters.set(key, counter)
+
+    def reset(self, key):
+        self.counters.pop(key)
+
+class NegativeCache:
+    """Keys known not to exist, each remembered for `ttl` seconds."""
+
+    def __init__(self, ttl, max_keys):
+        self.ttl = ttl
+        self.entries = LRUMap(max_keys)
+
+    def contains(self, key, now):
+        expires = self.entries.get(key)
+        if expires is None:
+            return False
+        if expires <= now:
+            self.entries.pop(key)
+            return False
+        return True
+
+    def add(self, key, now):
+        self.entries.set(key, now + self.ttl)
+
+    def discard(self, key):
+        self.entries.pop(key)
+
+class LoginGuard:
+    def __init__(self, ip_rate=1.0, ip_burst=20, account_rate=0.2, account_burst=5, failure_limit=10,
+                 failure_window=900.0, negative_ttl=60.0, max_keys=100000):
+        self.ip_buckets = TokenBucket(ip_rate, ip_burst, max_keys)
+        self.account_buckets = TokenBucket(account_rate, account_burst, max_keys)
+        self.failure_limit = failure_limit
+        self.failures = SlidingWindowCounter(failure_window, max_keys)
+        self.missing = NegativeCache(negative_ttl, max_keys)
+        self.verify_seconds = None # moving average of real bcrypt verifies
+        self.counters = {'allowed': 0, 'rejected_ip': 0, 'rejected_account': 0, 'rejected_lockout': 0,
+                         'negative_hits': 0, 'negative_stores': 0, 'failures': 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def account_key(email):
+        # Case variations of one address share the same limits.
+        return str(email).strip().lower()
+
+    def check(self, ip, email):
+        """Raises LoginRateLimited, or consumes one token from the IP and account buckets."""
+        account = self.account_key(email)
+        now = time.monotonic()
+        with self._lock:
+            if self.failures.count((account, ip), now) >= self.failure_limit:
+                self.counters['rejected_lockout'] += 1
+                raise LoginRateLimited('lockout', self.failures.window - now % self.failures.window)
+            retry_after = self.ip_buckets.take(ip, now)
+            if retry_after:
+                self.counters['rejected_ip'] += 1
+                raise LoginRateLimited('ip', retry_after)
+            retry_after = self.account_buckets.take(account, now)
+            if retry_after:
+                self.counters['rejected_account'] += 1
+                raise LoginRateLimited('account', retry_after)
+            self.counters['allowed'] += 1
+
+    def is_known_missing(self, email):
+        with self._lock:
+            hit = self.missing.contains(self.account_key(email), time.monotonic())
+            if hit:
+                self.counters['negative_hits'] += 1
+            return hit
+
+    def remember_missing(self, email):
+        with self._lock:
+            self.missing.add(self.account_key(email), time.monotonic())
+            self.counters['negative_stores'] += 1
+
+    def forget_missing(self, emails):
+        # Called when users are created or renamed, so a cached miss never hides a real account.
+        with self._lock:
+            for email in emails:
+                self.missing.discard(self.account_key(email))
+
+    def record_failure(self, ip, email):
+        with self._lock:
+            self.failures.add((self.account_key(email), ip), time.monotonic())
+            self.counters['failures'] += 1
+
+    def record_success(self, ip, email):
+        with self._lock:
+            self.failures.reset((self.account_key(email), ip))
+
+    def observe_verify(self, seconds):
+        with self._lock:
+            self.verify_seconds = seconds if self.verify_seconds is None else 0.9 * self.verify_seconds + 0.1 * seconds
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.counters,
+                'tracked_ips': len(self.ip_buckets.buckets),
+                'tracked_accounts': len(self.account_buckets.buckets),
+                'tracked_failures': len(self.failures.counters),
+                'cached_missing': len(self.missing.entries),
+                'evictions': (self.ip_buckets.buckets.evictions + self.account_buckets.buckets.evictions
+                              + self.failures.counters.evictions + self.missing.entries.evictions),
+                'verify_seconds': self.verify_seconds,
+            }
@@ -0,0 +1,196 @@
+import sqlite3
+import threading
+import time
+from collections import deque
+
+# --- Metrics Registry ---
+# Minimal Prometheus-style counters and histograms, plus SQLite instrumentation.
+# Everything is in-process and lock-protected; recording a sample is a dict
+# lookup and a few additions, cheap enough to leave on in production.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for name, value in labels:
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{escaped}"')
+    return '{' + ','.join(parts) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(key)} {_format_value(value)}')
+        return lines
+
+class Gauge:
+    # Value read from a callback at scrape time.
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge']
+        for labels, value in self.read():
+            lines.append(f'{self.name}{_format_labels(tuple(sorted(labels.items())))} {_format_value(value)}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series = {} # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(key + (("le", _format_value(bound)),))} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(key + (("le", "+Inf"),))} {series[-1]}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {_format_value(series[-2])}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {series[-1]}')
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+http_request_duration = registry.register(Histogram(
+    'http_request_duration_seconds', 'Request latency by route.'))
+http_requests = registry.register(Counter(
+    'http_requests_total', 'Requests by route and status code.'))
+sql_statements_per_request = registry.register(Histogram(
+    'sql_statements_per_request', 'SQLite statements executed per request (trigger bodies included).', COUNT_BUCKETS))
+sql_seconds_per_request = registry.register(Histogram(
+    'sql_seconds_per_request', 'Total statement time per request.'))
+sql_query_duration = registry.register(Histogram(
+    'sql_query_duration_seconds', 'Statement execute() time on instrumented connections (first row for SELECTs).'))
+sql_slow_queries = registry.register(Counter(
+    'sql_slow_queries_total', 'Statements slower than the slow query threshold.'))
+password_duration = registry.register(Histogram(
+    'password_hash_duration_seconds', 'Time spent waiting for bcrypt work (hash or verify).'))
+
+# --- Per-request SQL accounting ---
+# The request middleware calls begin_request()/end_request(); the SQLite hooks
+# below add to whatever request is active on the current thread.
+
+_local = threading.local()
+slow_query_threshold = 0.1 # seconds, updated from app.config
+slow_queries = deque(maxlen=100)
+
+class RequestStats:
+    __slots__ = ('statements', 'sql_seconds')
+
+    def __init__(self):
+        self.statements = 0
+        self.sql_seconds = 0.0
+
+def begin_request():
+    _local.stats = RequestStats()
+    return _local.stats
+
+def end_request():
+    stats = getattr(_local, 'stats', None)
+    _local.stats = None
+    return stats
+
+def add_to_request(stats):
+    # Statements another thread ran on behalf of the current request (the group-commit writer).
+    current = getattr(_local, 'stats', None)
+    if current is not None and stats is not None:
+        current.statements += stats.statements
+        current.sql_seconds += stats.sql_seconds
+
+def trace_statement(statement):
+    # sqlite3 trace callback: fires for every statement SQLite runs, including trigger bodies.
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats.statements += 1
+
+def _record_query(sql, elapsed):
+    sql_query_duration.observe(elapsed)
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats.sql_seconds += elapsed
+    if elapsed >= slow_query_threshold:
+        sql_slow_queries.inc()
+        slow_queries.append({'sql': ' '.join(sql.split())[:500], 'seconds': round(elapsed, 6), 'at': time.time()})
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - started)
+
+class InstrumentedConnection(sqlite3.Connection):
+    # Connection.execute() would bypass the cursor subclass, so route it explicitly.
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
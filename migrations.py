@@ -0,0 +1,559 @@
+import argparse
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from admin_stats import rebuild_stats
+from archive import SUBSCRIPTION_COLUMNS
+from tickets import PREMIUM_SUPPORT
+
+# --- Schema Migrations ---
+# The schema is built by an ordered list of migrations. The version reached is
+# stored twice: in the database header (PRAGMA user_version), which startup
+# reads to skip everything when the schema is current, and in the
+# schema_version table, which keeps the history.
+#
+# Plain migrations run in one transaction with their version bump. "Online"
+# migrations are for large tables: each index build, or each chunk of a
+# backfill, gets its own short transaction, so WAL readers are never blocked
+# and API writers only wait for one chunk at a time. They must be idempotent,
+# since an interrupted run starts over from the beginning of that migration.
+#
+# The early migrations use IF NOT EXISTS / add_missing_columns, so databases
+# created before this module existed are adopted without changes. A database
+# created by the runner gets auto_vacuum = INCREMENTAL (see archive.py).
+#   python migrations.py --database extended_database.db [--status]
+
+class Migration:
+    def __init__(self, version, name, apply, online=False):
+        self.version = version
+        self.name = name
+        self.apply = apply # apply(cursor) in a transaction, or apply(conn) when online
+        self.online = online
+
+@contextmanager
+def transaction(conn):
+    # Explicit BEGIN IMMEDIATE/COMMIT, the connection is in autocommit mode during migrations.
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK;")
+        raise
+    conn.execute("COMMIT;")
+
+def create_index_online(conn, name, table, columns):
+    # SQLite builds an index in a single statement: give each one its own transaction
+    # rather than holding the write lock for a whole migration.
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?;", (name,)).fetchone():
+        return False
+    started = time.perf_counter()
+    with transaction(conn):
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns});")
+    print(f"Index '{name}' built in {time.perf_counter() - started:.2f}s.")
+    return True
+
+def backfill_in_chunks(conn, table, assignments, where, chunk_size=5000, pause=0.01):
+    # UPDATE ... by rowid ranges, one transaction per range; returns the number of rows changed.
+    last_rowid = conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table};").fetchone()[0]
+    updated = 0
+    for low in range(0, last_rowid, chunk_size):
+        with transaction(conn):
+            changed = conn.execute(
+                f"UPDATE {table} SET {assignments} WHERE rowid > ? AND rowid <= ? AND ({where});",
+                (low, low + chunk_size)
+            ).rowcount
+        updated += changed
+        if changed:
+            time.sleep(pause) # let queued writers in between chunks
+    return updated
+
+# --- Migration steps ---
+
+def create_tables(cursor):
+    # 1. Create users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL
+        );
+    ''')
+    print("Table 'users' created or already exists.")
+
+    # 2. Create services table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS services (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            description TEXT,
+            price REAL NOT NULL DEFAULT 0,
+            features TEXT NOT NULL DEFAULT '[]' -- JSON list
+        );
+    ''')
+    print("Table 'services' created or already exists.")
+
+    # 3. Create user_services liaison table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_services (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            service_id INTEGER NOT NULL,
+            active INTEGER DEFAULT 1,
+            start_date TEXT NOT NULL,
+            end_date TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (service_id) REFERENCES services(id) ON DELETE CASCADE,
+            UNIQUE(user_id, service_id)
+        );
+    ''')
+    print("Table 'user_services' created or already exists.")
+
+def add_missing_columns(cursor, table, columns):
+    # Brings databases created with an older schema up to date; columns is a list of (name, definition).
+    cursor.execute(f"PRAGMA table_info({table});")
+    existing = {row[1] for row in cursor.fetchall()}
+    for name, definition in columns:
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition};")
+            print(f"Column '{table}.{name}' added.")
+
+def add_missing_service_columns(cursor):
+    add_missing_columns(cursor, 'services', [
+        ('price', "REAL NOT NULL DEFAULT 0"),
+        ('features', "TEXT NOT NULL DEFAULT '[]'"),
+    ])
+
+def create_pricing_tables(cursor):
+    # Promotion rules evaluated by pricing.py, and the billed price stored on each subscription.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS promotions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT UNIQUE, -- NULL = applied automatically
+            kind TEXT NOT NULL CHECK (kind IN ('percent', 'fixed')),
+            value REAL NOT NULL CHECK (value >= 0),
+            service_id INTEGER, -- NULL = every service
+            user_id INTEGER, -- NULL = every customer
+            starts_at TEXT,
+            ends_at TEXT,
+            active INTEGER NOT NULL DEFAULT 1,
+            FOREIGN KEY (service_id) REFERENCES services(id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        );
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_promotions_active_window ON promotions (active, starts_at, ends_at);")
+    print("Table 'promotions' created or already exists.")
+
+    add_missing_columns(cursor, 'user_services', [
+        ('price', "REAL"), # NULL until the first repricing
+        ('promotion_id', "INTEGER REFERENCES promotions(id) ON DELETE SET NULL"),
+        ('promo_code', "TEXT"),
+    ])
+
+def add_expiry_columns(cursor):
+    add_missing_columns(cursor, 'user_services', [
+        ('expiry_notice_for', "TEXT"), # end_date for which the "expiring" event was sent (expiry.py)
+    ])
+
+def create_search_index(cursor):
+    # Trigram FTS5 index over the searchable user columns, kept in sync by triggers.
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users_fts';")
+    already_exists = cursor.fetchone() is not None
+
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+            email,
+            first_name,
+            last_name,
+            content='users',
+            content_rowid='id',
+            tokenize='trigram'
+        );
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+            INSERT INTO users_fts (rowid, email, first_name, last_name)
+            VALUES (new.id, new.email, new.first_name, new.last_name);
+        END;
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+            INSERT INTO users_fts (users_fts, rowid, email, first_name, last_name)
+            VALUES ('delete', old.id, old.email, old.first_name, old.last_name);
+        END;
+    ''')
+    # Only fires when a searchable column changes, password updates skip the index.
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF email, first_name, last_name ON users BEGIN
+            INSERT INTO users_fts (users_fts, rowid, email, first_name, last_name)
+            VALUES ('delete', old.id, old.email, old.first_name, old.last_name);
+            INSERT INTO users_fts (rowid, email, first_name, last_name)
+            VALUES (new.id, new.email, new.first_name, new.last_name);
+        END;
+    ''')
+
+    if not already_exists:
+        # Existing databases: index the users that were inserted before the triggers existed.
+        cursor.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild');")
+        print("Search index 'users_fts' built.")
+    else:
+        print("Search index 'users_fts' already exists.")
+
+def create_catalog_version(cursor):
+    # Single-row counter bumped on every services write; the API's catalog cache is keyed on it.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        );
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 1);")
+    for event, trigger in (('INSERT', 'services_version_ai'), ('UPDATE', 'services_version_au'),
+                           ('DELETE', 'services_version_ad')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {trigger} AFTER {event} ON services BEGIN
+                UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+            END;
+        ''')
+    print("Table 'catalog_version' created or already exists.")
+
+USER_CHANGE_DATA = "json_object('id', {row}.id, 'email', {row}.email, 'first_name', {row}.first_name, 'last_name', {row}.last_name)"
+SUBSCRIPTION_CHANGE_DATA = ("json_object('id', {row}.id, 'user_id', {row}.user_id, 'service_id', {row}.service_id, "
+                            "'active', {row}.active, 'start_date', {row}.start_date, 'end_date', {row}.end_date)")
+
+def create_change_feed(cursor):
+    # Ordered outbox read by GET /changes. Triggers append to it inside the writing
+    # transaction, so every mutation path (API, bulk import, expiry sweeps) is covered.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity TEXT NOT NULL, -- 'user' or 'subscription'
+            entity_id INTEGER NOT NULL,
+            op TEXT NOT NULL, -- 'insert', 'update' or 'delete'
+            data TEXT NOT NULL, -- JSON, never contains the password
+            at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+        );
+    ''')
+    triggers = (
+        ('users_changes_ai', 'AFTER INSERT ON users', 'user', 'new', 'insert', USER_CHANGE_DATA),
+        ('users_changes_au', 'AFTER UPDATE OF email, first_name, last_name ON users', 'user', 'new', 'update',
+         USER_CHANGE_DATA),
+        ('users_changes_ad', 'AFTER DELETE ON users', 'user', 'old', 'delete', "json_object('id', {row}.id)"),
+        ('user_services_changes_ai', 'AFTER INSERT ON user_services', 'subscription', 'new', 'insert',
+         SUBSCRIPTION_CHANGE_DATA),
+        # price/promotion_id (repricing) and expiry_notice_for are derived columns, not feed events
+        ('user_services_changes_au', 'AFTER UPDATE OF user_id, service_id, active, start_date, end_date ON user_services',
+         'subscription', 'new', 'update', SUBSCRIPTION_CHANGE_DATA),
+        ('user_services_changes_ad', 'AFTER DELETE ON user_services', 'subscription', 'old', 'delete',
+         SUBSCRIPTION_CHANGE_DATA),
+    )
+    for name, event, entity, row, op, data in triggers:
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN
+                INSERT INTO changes (entity, entity_id, op, data) VALUES ('{entity}', {row}.id, '{op}', {data.format(row=row)});
+            END;
+        ''')
+    print("Table 'changes' created or already exists.")
+
+def add_session_columns(cursor):
+    add_missing_columns(cursor, 'users', [
+        ('token_epoch', "INTEGER NOT NULL DEFAULT 0"), # bumped to revoke every session token (session_tokens.py)
+    ])
+
+def subscription_stats_sql(row, sign):
+    # Adds (sign '+') or removes (sign '-') one subscription row from the dashboard aggregates.
+    active = f"({row}.active IS 1)"
+    sql = f'''
+        INSERT OR IGNORE INTO service_stats (service_id) VALUES ({row}.service_id);
+        UPDATE service_stats SET
+            active = active {sign} {active},
+            inactive = inactive {sign} ({row}.active IS NOT 1),
+            revenue_cents = revenue_cents {sign} (CASE WHEN {active} THEN COALESCE(CAST(ROUND({row}.price * 100) AS INTEGER), 0) ELSE 0 END),
+            unpriced = unpriced {sign} ({active} AND {row}.price IS NULL)
+        WHERE service_id = {row}.service_id;
+        INSERT INTO expiry_stats (end_date, service_id, active)
+        SELECT {row}.end_date, {row}.service_id, {sign}1 WHERE {active} AND {row}.end_date IS NOT NULL
+        ON CONFLICT (end_date, service_id) DO UPDATE SET active = active {sign} 1;
+    '''
+    if sign == '-':
+        # Past end dates would otherwise pile up as zero rows once swept.
+        sql += f"DELETE FROM expiry_stats WHERE end_date = {row}.end_date AND service_id = {row}.service_id AND active = 0;"
+    return sql
+
+def create_dashboard_stats(cursor):
+    # Aggregates behind GET /admin/stats (admin_stats.py), maintained by triggers.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dashboard_totals (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            users INTEGER NOT NULL
+        );
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS service_stats (
+            service_id INTEGER PRIMARY KEY,
+            active INTEGER NOT NULL DEFAULT 0,
+            inactive INTEGER NOT NULL DEFAULT 0,
+            revenue_cents INTEGER NOT NULL DEFAULT 0, -- billed price of the active subscriptions
+            unpriced INTEGER NOT NULL DEFAULT 0 -- active subscriptions not repriced yet (price NULL)
+        );
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS expiry_stats (
+            end_date TEXT NOT NULL,
+            service_id INTEGER NOT NULL,
+            active INTEGER NOT NULL, -- active subscriptions ending that day
+            PRIMARY KEY (end_date, service_id)
+        ) WITHOUT ROWID;
+    ''')
+    triggers = (
+        ('users_stats_ai', 'AFTER INSERT ON users', "UPDATE dashboard_totals SET users = users + 1 WHERE id = 1;"),
+        ('users_stats_ad', 'AFTER DELETE ON users', "UPDATE dashboard_totals SET users = users - 1 WHERE id = 1;"),
+        ('user_services_stats_ai', 'AFTER INSERT ON user_services', subscription_stats_sql('new', '+')),
+        ('user_services_stats_au', 'AFTER UPDATE OF service_id, active, end_date ON user_services '
+         'WHEN old.service_id IS NOT new.service_id OR old.active IS NOT new.active OR old.end_date IS NOT new.end_date',
+         subscription_stats_sql('old', '-') + subscription_stats_sql('new', '+')),
+        # Repricing only changes the price of active rows: a single revenue adjustment.
+        ('user_services_stats_au_price', 'AFTER UPDATE OF price ON user_services '
+         'WHEN new.active IS 1 AND old.price IS NOT new.price AND old.service_id IS new.service_id '
+         'AND old.active IS new.active AND old.end_date IS new.end_date',
+         '''UPDATE service_stats SET
+                revenue_cents = revenue_cents - COALESCE(CAST(ROUND(old.price * 100) AS INTEGER), 0)
+                                              + COALESCE(CAST(ROUND(new.price * 100) AS INTEGER), 0),
+                unpriced = unpriced - (old.price IS NULL) + (new.price IS NULL)
+            WHERE service_id = new.service_id;'''),
+        ('user_services_stats_ad', 'AFTER DELETE ON user_services', subscription_stats_sql('old', '-')),
+    )
+    for name, event, body in triggers:
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END;")
+    # Existing rows: one scan of user_services, in the migration's transaction.
+    result = rebuild_stats(cursor)
+    print(f"Dashboard aggregates built ({result['users']} users, {result['services']} services).")
+
+def create_subscription_lookup_indexes(conn):
+    # Covering indexes for the batch subscription lookups (GET /subscriptions): per user with an
+    # optional active filter, and per service/active with the user id in index order for paging.
+    create_index_online(conn, 'idx_user_services_user_active', 'user_services', 'user_id, active, service_id')
+    create_index_online(conn, 'idx_user_services_service_active', 'user_services', 'service_id, active, user_id')
+
+def create_expiry_index(conn):
+    # Range scans of the expiry sweeps (expiry.py): active subscriptions by end_date.
+    create_index_online(conn, 'idx_user_services_active_end_date', 'user_services', 'active, end_date')
+
+def normalize_subscription_fields(conn):
+    # The API used to store whatever it was sent: an empty end_date would sort before every
+    # date and be expired at once, a NULL active would never be swept.
+    updated = backfill_in_chunks(
+        conn, 'user_services',
+        "end_date = NULLIF(TRIM(end_date), ''), active = COALESCE(active, 1)",
+        "(end_date IS NOT NULL AND TRIM(end_date) = '') OR active IS NULL"
+    )
+    print(f"{updated} subscriptions normalized.")
+
+def create_support_tickets(cursor):
+    # Tickets and their messages (tickets.py). The queues are partial indexes: the open tickets in
+    # handling order, and the tickets still waiting for a first answer by SLA deadline.
+    add_missing_columns(cursor, 'services', [
+        ('priority_support', "INTEGER NOT NULL DEFAULT 0"), # subscribers' tickets go first in the queue
+    ])
+    cursor.execute("UPDATE services SET priority_support = 1 WHERE name = 'Premium Support';")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tickets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            subscription_id INTEGER, -- the subscription the ticket is about, if any
+            subject TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'open' CHECK (status IN ('open', 'assigned', 'closed')),
+            priority INTEGER NOT NULL DEFAULT 2 CHECK (priority BETWEEN 0 AND 3), -- 0 = urgent
+            premium INTEGER NOT NULL DEFAULT 0, -- customer has priority support, kept by triggers
+            assignee TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            sla_due_at TEXT NOT NULL, -- first-response deadline
+            responded_at TEXT, -- first agent message
+            closed_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (subscription_id) REFERENCES user_services(id) ON DELETE SET NULL
+        );
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ticket_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticket_id INTEGER NOT NULL,
+            agent TEXT, -- NULL = written by the customer
+            body TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (ticket_id) REFERENCES tickets(id) ON DELETE CASCADE
+        );
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tickets_queue ON tickets (premium DESC, priority, sla_due_at) "
+                   "WHERE status = 'open';")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tickets_sla ON tickets (sla_due_at) "
+                   "WHERE responded_at IS NULL AND status <> 'closed';")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tickets_assignee ON tickets (assignee, sla_due_at) "
+                   "WHERE status = 'assigned';")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tickets_user ON tickets (user_id);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tickets_subscription ON tickets (subscription_id);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ticket_messages_ticket ON ticket_messages (ticket_id);")
+
+    # Subscription changes only touch the customer's own tickets, and only for priority-support services.
+    recompute = ("UPDATE tickets SET premium = " + PREMIUM_SUPPORT.format(user='{row}.user_id') +
+                 " WHERE user_id = {row}.user_id AND status <> 'closed';")
+    priority = "(SELECT priority_support FROM services WHERE id = {row}.service_id) IS 1"
+    triggers = (
+        ('user_services_tickets_ai', 'AFTER INSERT ON user_services WHEN new.active IS 1 AND ' + priority.format(row='new'),
+         "UPDATE tickets SET premium = 1 WHERE user_id = new.user_id AND status <> 'closed' AND premium = 0;"),
+        ('user_services_tickets_au', 'AFTER UPDATE OF user_id, service_id, active ON user_services WHEN ' +
+         priority.format(row='old') + ' OR ' + priority.format(row='new'),
+         recompute.format(row='old') + recompute.format(row='new')),
+        ('user_services_tickets_ad', 'AFTER DELETE ON user_services WHEN ' + priority.format(row='old'),
+         recompute.format(row='old')),
+        ('services_tickets_au', 'AFTER UPDATE OF priority_support ON services '
+         'WHEN old.priority_support IS NOT new.priority_support',
+         "UPDATE tickets SET premium = " + PREMIUM_SUPPORT.format(user='tickets.user_id') +
+         " WHERE status <> 'closed' AND user_id IN (SELECT user_id FROM user_services WHERE service_id = new.id);"),
+    )
+    for name, event, body in triggers:
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END;")
+    print("Tables 'tickets' and 'ticket_messages' created or already exist.")
+
+def create_deleted_users(cursor):
+    # Accounts deleted since the last archive run (archive.py), with the subscriptions the delete cascades to.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS deleted_users (
+            id INTEGER PRIMARY KEY, -- users.id, never reused (AUTOINCREMENT)
+            data TEXT NOT NULL, -- JSON account and subscriptions, never the password
+            deleted_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%SZ', 'now'))
+        );
+    ''')
+    # BEFORE: the subscriptions are still there. json() keeps the subquery's array from being quoted as a string.
+    subscription = ', '.join(f"'{column}', {column}" for column in SUBSCRIPTION_COLUMNS)
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS users_archive_bd BEFORE DELETE ON users BEGIN
+            INSERT OR REPLACE INTO deleted_users (id, data) VALUES (old.id, json_object(
+                'email', old.email, 'first_name', old.first_name, 'last_name', old.last_name,
+                'subscriptions', json((SELECT json_group_array(json_object({subscription}))
+                                       FROM user_services WHERE user_id = old.id))
+            ));
+        END;
+    ''')
+    print("Table 'deleted_users' created or already exists.")
+
+MIGRATIONS = [
+    Migration(1, 'base tables', create_tables),
+    Migration(2, 'service price and features', add_missing_service_columns),
+    Migration(3, 'users full-text search', create_search_index),
+    Migration(4, 'catalog version', create_catalog_version),
+    Migration(5, 'pricing and promotions', create_pricing_tables),
+    Migration(6, 'subscription lookup indexes', create_subscription_lookup_indexes, online=True),
+    Migration(7, 'expiry notice column', add_expiry_columns),
+    Migration(8, 'expiry index', create_expiry_index, online=True),
+    Migration(9, 'change feed', create_change_feed),
+    Migration(10, 'normalize subscription end_date/active', normalize_subscription_fields, online=True),
+    Migration(11, 'session token epoch', add_session_columns),
+    Migration(12, 'dashboard aggregates', create_dashboard_stats),
+    Migration(13, 'support tickets', create_support_tickets),
+    Migration(14, 'deleted users queue', create_deleted_users),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+# --- Runner ---
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version;").fetchone()[0]
+
+def is_current(conn):
+    return schema_version(conn) >= LATEST_VERSION
+
+def record_version(conn, migration, seconds):
+    conn.execute(
+        "INSERT OR REPLACE INTO schema_version (version, name, applied_at, seconds) VALUES (?, ?, ?, ?);",
+        (migration.version, migration.name, datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'), round(seconds, 3))
+    )
+    conn.execute(f"PRAGMA user_version = {int(migration.version)};")
+
+def migrate(conn, target=None):
+    """Applies the pending migrations up to `target` (default: all); returns the applied ones."""
+    target = LATEST_VERSION if target is None else target
+    if schema_version(conn) >= target:
+        return [] # fast path: a single header read
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None # autocommit, transactions are explicit below
+    applied = []
+    try:
+        if conn.execute("SELECT COUNT(*) FROM sqlite_master;").fetchone()[0] == 0:
+            # Only possible before the first table. VACUUM applies it even if journal_mode = WAL
+            # already wrote the header; on an empty file it costs nothing.
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+            conn.execute("VACUUM;")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TEXT NOT NULL,
+                seconds REAL NOT NULL
+            );
+        ''')
+        for migration in MIGRATIONS:
+            if migration.version > target:
+                break
+            if schema_version(conn) >= migration.version:
+                continue
+            started = time.perf_counter()
+            if migration.online:
+                migration.apply(conn)
+                with transaction(conn):
+                    record_version(conn, migration, time.perf_counter() - started)
+            else:
+                with transaction(conn):
+                    if schema_version(conn) >= migration.version:
+                        continue # applied by another process while we waited for the lock
+                    migration.apply(conn.cursor())
+                    record_version(conn, migration, time.perf_counter() - started)
+            seconds = time.perf_counter() - started
+            applied.append({'version': migration.version, 'name': migration.name, 'seconds': round(seconds, 3)})
+            print(f"Migration {migration.version} '{migration.name}' applied in {seconds:.2f}s.")
+    finally:
+        conn.isolation_level = isolation_level
+    return applied
+
+def ensure_schema(database, busy_timeout=5000):
+    """Startup check: migrates `database` if it is behind, otherwise returns at once."""
+    conn = sqlite3.connect(database)
+    try:
+        if is_current(conn):
+            return []
+        conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout)};")
+        return migrate(conn)
+    finally:
+        conn.close()
+
+# --- Command Line Interface ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations.")
+    parser.add_argument('--database', default='extended_database.db')
+    parser.add_argument('--target', type=int, help="Stop at this version")
+    parser.add_argument('--status', action='store_true', help="Show the applied and pending migrations only")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.database)
+    conn.execute("PRAGMA busy_timeout = 5000;")
+    try:
+        if args.status:
+            version = schema_version(conn)
+            for migration in MIGRATIONS:
+                state = 'applied' if migration.version <= version else 'pending'
+                print(f"{migration.version:4d}  {state:<8} {migration.name}")
+            return 0
+        applied = migrate(conn, args.target)
+        print(f"Schema at version {schema_version(conn)} ({len(applied)} migrations applied).")
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+
+# --- Password Hashing Worker Pool ---
+# bcrypt is deliberately slow and CPU bound, so it runs in a small process pool
+# instead of on the request threads. The number of pending jobs is capped: past
+# the cap callers get PasswordPoolBusy (503) instead of piling up.
+
+DEFAULT_ROUNDS = 12
+
+class PasswordPoolBusy(Exception):
+    pass
+
+def _hash_password(password, rounds):
+    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds))
+    return hashed.decode('utf-8') # Store as UTF-8 string
+
+def _check_password(hashed_password, provided_password):
+    return bcrypt.checkpw(provided_password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+def get_rounds(hashed_password):
+    # bcrypt hashes look like $2b$12$<salt+hash>, the second field is the cost.
+    try:
+        return int(hashed_password.split('$')[2])
+    except (IndexError, ValueError):
+        return 0
+
+class PasswordHasher:
+    def __init__(self, rounds=DEFAULT_ROUNDS, workers=None, max_pending=64):
+        self.rounds = rounds
+        self.workers = workers or max(1, (os.cpu_count() or 2) // 2)
+        self.max_pending = max_pending
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.rejected = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn keeps the workers free of the parent's threads and SQLite handles.
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def _submit(self, fn, *args):
+        # Returns a concurrent.futures.Future; async callers wrap it with asyncio.wrap_future.
+        executor = self._get_executor()
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise PasswordPoolBusy(f"{self._pending} password jobs already pending")
+            self._pending += 1
+        try:
+            future = executor.submit(fn, *args)
+        except Exception:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def submit_hash(self, password):
+        return self._submit(_hash_password, password, self.rounds)
+
+    def submit_verify(self, hashed_password, provided_password):
+        return self._submit(_check_password, hashed_password, provided_password)
+
+    def hash(self, password):
+        return self.submit_hash(password).result()
+
+    def verify(self, hashed_password, provided_password):
+        return self.submit_verify(hashed_password, provided_password).result()
+
+    def needs_rehash(self, hashed_password):
+        return get_rounds(hashed_password) < self.rounds
+
+    def hash_many(self, passwords, chunksize=16):
+        # Batch jobs (seeding, imports) bypass the pending cap: they wait, they don't get shed.
+        passwords = list(passwords)
+        return list(self._get_executor().map(
+            _hash_password, passwords, [self.rounds] * len(passwords), chunksize=chunksize
+        ))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'rounds': self.rounds,
+                'pending': self._pending,
+                'max_pending': self.max_pending,
+                'rejected': self.rejected,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+def get_hasher(rounds=DEFAULT_ROUNDS, workers=None, max_pending=64):
+    # Process-wide hasher; rebuilt only if its settings change.
+    global _hasher
+    with _hasher_lock:
+        if _hasher is None or (_hasher.rounds, _hasher.max_pending) != (rounds, max_pending) \
+                or (workers and _hasher.workers != workers):
+            if _hasher is not None:
+                _hasher.shutdown()
+            _hasher = PasswordHasher(rounds, workers, max_pending)
+        return _hasher
@@ -0,0 +1,245 @@
+import argparse
+import sqlite3
+import sys
+import time
+from datetime import date
+
+import numpy as np
+
+# --- Pricing & Promotions Engine ---
+# Promotions are evaluated column-wise over arrays of (user, service, code)
+# rows instead of row by row in Python:
+#   * date windows and the active flag are scalar per promotion, so they are
+#     filtered once when the promotions are loaded;
+#   * "generic" promotions (any customer) are applied with one vectorized mask
+#     per promotion over the whole batch;
+#   * customer-specific promotions are joined to the rows by user id through a
+#     sorted search, so their cost does not grow with rows x promotions.
+# Promotions do not stack: each row keeps the single lowest resulting price.
+
+PERCENT = 'percent'
+FIXED = 'fixed'
+NO_PROMOTION = -1
+
+PROMOTION_COLUMNS = ('id', 'code', 'kind', 'value', 'service_id', 'user_id', 'starts_at', 'ends_at', 'active')
+
+class Promotions:
+    """Active promotions at a given date, as parallel NumPy arrays."""
+
+    def __init__(self, rows, as_of):
+        self.as_of = as_of
+        self.codes = {}
+        rows = list(rows)
+        self.ids = np.array([r['id'] for r in rows], dtype=np.int64)
+        self.is_percent = np.array([r['kind'] == PERCENT for r in rows], dtype=bool)
+        self.values = np.array([r['value'] for r in rows], dtype=np.float64)
+        self.service_ids = np.array([r['service_id'] if r['service_id'] is not None else NO_PROMOTION
+                                     for r in rows], dtype=np.int64)
+        self.user_ids = np.array([r['user_id'] if r['user_id'] is not None else NO_PROMOTION
+                                  for r in rows], dtype=np.int64)
+        self.code_ids = np.array([self.code_id(r['code']) for r in rows], dtype=np.int64)
+
+    def code_id(self, code, create=True):
+        # Codes are compared as small integers inside the vectorized passes.
+        if not code:
+            return NO_PROMOTION
+        if code not in self.codes:
+            if not create:
+                return -2 # a code no promotion uses: matches nothing
+            self.codes[code] = len(self.codes)
+        return self.codes[code]
+
+    def encode_codes(self, codes):
+        return np.array([self.code_id(code, create=False) for code in codes], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+def load_promotions(conn, as_of=None, subscription=None):
+    # subscription: (user_id, service_id, code) to load only the promotions that can apply to that row.
+    as_of = as_of or date.today().isoformat()
+    query = (f"SELECT {', '.join(PROMOTION_COLUMNS)} FROM promotions "
+             "WHERE active = 1 AND (starts_at IS NULL OR starts_at <= ?) AND (ends_at IS NULL OR ends_at >= ?)")
+    params = [as_of, as_of]
+    if subscription is not None:
+        user_id, service_id, code = subscription
+        query += (" AND (user_id IS NULL OR user_id = ?) AND (service_id IS NULL OR service_id = ?)"
+                  " AND (code IS NULL OR code = ?)")
+        params += [user_id, service_id, code]
+    cursor = conn.execute(query + ";", params)
+    return Promotions((dict(zip(PROMOTION_COLUMNS, row)) for row in cursor), as_of)
+
+def discounted(base_prices, is_percent, value):
+    if is_percent:
+        prices = base_prices * (1.0 - value / 100.0)
+    else:
+        prices = base_prices - value
+    return np.maximum(prices, 0.0)
+
+def _apply(best, best_promo, base_prices, mask, promo_index, promotions):
+    candidate = discounted(base_prices, promotions.is_percent[promo_index], promotions.values[promo_index])
+    better = mask & (candidate < best)
+    best[better] = candidate[better]
+    best_promo[better] = promotions.ids[promo_index]
+
+def compute_prices(base_prices, service_ids, user_ids, code_ids, promotions):
+    # All inputs are equal-length arrays. Returns (final_prices, promotion_ids),
+    # promotion_ids being NO_PROMOTION where no promotion applied.
+    base_prices = np.asarray(base_prices, dtype=np.float64)
+    service_ids = np.asarray(service_ids, dtype=np.int64)
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    code_ids = np.asarray(code_ids, dtype=np.int64)
+
+    best = base_prices.copy()
+    best_promo = np.full(len(base_prices), NO_PROMOTION, dtype=np.int64)
+    if len(promotions) == 0 or len(base_prices) == 0:
+        return best, best_promo
+
+    generic = np.flatnonzero(promotions.user_ids == NO_PROMOTION)
+    for p in generic:
+        mask = np.ones(len(base_prices), dtype=bool)
+        if promotions.service_ids[p] != NO_PROMOTION:
+            mask &= service_ids == promotions.service_ids[p]
+        if promotions.code_ids[p] != NO_PROMOTION:
+            mask &= code_ids == promotions.code_ids[p]
+        _apply(best, best_promo, base_prices, mask, p, promotions)
+
+    specific = np.flatnonzero(promotions.user_ids != NO_PROMOTION)
+    if len(specific):
+        # Sort the rows by user once, then locate each customer's rows by binary search.
+        order = np.argsort(user_ids, kind='stable')
+        sorted_users = user_ids[order]
+        promo_users = promotions.user_ids[specific]
+        lo = np.searchsorted(sorted_users, promo_users, side='left')
+        hi = np.searchsorted(sorted_users, promo_users, side='right')
+        for p, start, end in zip(specific, lo, hi):
+            if start == end:
+                continue
+            rows = order[start:end]
+            mask = np.ones(len(rows), dtype=bool)
+            if promotions.service_ids[p] != NO_PROMOTION:
+                mask &= service_ids[rows] == promotions.service_ids[p]
+            if promotions.code_ids[p] != NO_PROMOTION:
+                mask &= code_ids[rows] == promotions.code_ids[p]
+            sub_best = best[rows]
+            sub_promo = best_promo[rows]
+            _apply(sub_best, sub_promo, base_prices[rows], mask, p, promotions)
+            best[rows] = sub_best
+            best_promo[rows] = sub_promo
+
+    return np.round(best, 2), best_promo
+
+def load_base_prices(conn):
+    # Dense lookup array indexed by service id; unknown ids price at 0.
+    rows = conn.execute("SELECT id, price FROM services;").fetchall()
+    max_id = max((row[0] for row in rows), default=0)
+    prices = np.zeros(max_id + 1, dtype=np.float64)
+    for service_id, price in rows:
+        prices[service_id] = price
+    return prices
+
+def quote(conn, user_id, service_ids=None, code=None, as_of=None):
+    """Prices for one customer over the given services (default: the whole catalog).
+
+    Raises LookupError listing the ids that are not in the services table.
+    """
+    catalog = dict(conn.execute("SELECT id, price FROM services ORDER BY id;").fetchall())
+    if service_ids is None:
+        service_ids = list(catalog)
+    unknown = [sid for sid in service_ids if sid not in catalog]
+    if unknown:
+        raise LookupError(f"Service not found: {', '.join(map(str, unknown))}")
+    service_ids = np.array(service_ids, dtype=np.int64)
+    promotions = load_promotions(conn, as_of)
+    bases = np.array([catalog[sid] for sid in service_ids.tolist()], dtype=np.float64)
+    prices, promo_ids = compute_prices(
+        bases, service_ids, np.full(len(service_ids), user_id), promotions.encode_codes([code] * len(service_ids)),
+        promotions
+    )
+    return [
+        {
+            'service_id': int(sid),
+            'base_price': float(base),
+            'price': float(price),
+            'promotion_id': int(promo) if promo != NO_PROMOTION else None,
+        }
+        for sid, base, price, promo in zip(service_ids, bases, prices, promo_ids)
+    ]
+
+def price_subscription(conn, user_id, service_id, code=None, as_of=None):
+    """(price, promotion_id) of one subscription, as reprice_active_subscriptions() sets them."""
+    row = conn.execute("SELECT id, price FROM services WHERE id = ?;", (service_id,)).fetchone()
+    if row is None:
+        return None, None # the INSERT/UPDATE reports the missing service
+    service_id, base_price = row
+    promotions = load_promotions(conn, as_of, (user_id, service_id, code))
+    prices, promo_ids = compute_prices([base_price], [service_id], [user_id], promotions.encode_codes([code]), promotions)
+    return float(prices[0]), int(promo_ids[0]) if promo_ids[0] != NO_PROMOTION else None
+
+def reprice_active_subscriptions(conn, as_of=None, chunk_size=200000):
+    """Recomputes price/promotion_id of every active subscription; only changed rows are written."""
+    started = time.perf_counter()
+    base_prices = load_base_prices(conn)
+    promotions = load_promotions(conn, as_of)
+    scanned = updated = 0
+    last_id = 0
+
+    while True:
+        rows = conn.execute(
+            "SELECT id, user_id, service_id, promo_code, price, promotion_id FROM user_services "
+            "WHERE active = 1 AND id > ? ORDER BY id LIMIT ?;",
+            (last_id, chunk_size)
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        scanned += len(rows)
+
+        ids, user_ids, service_ids, codes, old_prices, old_promos = zip(*rows)
+        service_ids = np.array(service_ids, dtype=np.int64)
+        known = service_ids < len(base_prices)
+        bases = np.where(known, base_prices[np.where(known, service_ids, 0)], 0.0)
+        prices, promo_ids = compute_prices(bases, service_ids, user_ids, promotions.encode_codes(codes), promotions)
+
+        old_prices = np.array([p if p is not None else np.nan for p in old_prices], dtype=np.float64)
+        old_promos = np.array([p if p is not None else NO_PROMOTION for p in old_promos], dtype=np.int64)
+        changed = np.flatnonzero((old_prices != prices) | (old_promos != promo_ids))
+        if len(changed):
+            ids = np.array(ids, dtype=np.int64)
+            promo_values = [None if p == NO_PROMOTION else p for p in promo_ids[changed].tolist()]
+            with conn:
+                conn.executemany(
+                    "UPDATE user_services SET price = ?, promotion_id = ? WHERE id = ?;",
+                    zip(prices[changed].tolist(), promo_values, ids[changed].tolist())
+                )
+            updated += len(changed)
+
+    return {
+        'as_of': promotions.as_of,
+        'promotions': len(promotions),
+        'scanned': scanned,
+        'updated': updated,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+# --- Command Line Interface ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reprice all active subscriptions.")
+    parser.add_argument('--database', default='extended_database.db')
+    parser.add_argument('--as-of', help="Pricing date (YYYY-MM-DD), defaults to today")
+    parser.add_argument('--chunk-size', type=int, default=200000)
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.database)
+    conn.execute("PRAGMA foreign_keys = ON;")
+    try:
+        result = reprice_active_subscriptions(conn, args.as_of, args.chunk_size)
+    finally:
+        conn.close()
+    print(f"{result['scanned']} active subscriptions scanned, {result['updated']} repriced "
+          f"with {result['promotions']} promotions in {result['seconds']}s.")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+import sys
+import threading
+import time
+from collections import Counter
+
+# --- Sampling Profiler ---
+# Opt-in, off by default. While enabled, a background thread snapshots the
+# stacks of the other threads every `interval` seconds and counts identical
+# stacks. The output is in "collapsed stack" format (frame;frame;frame count),
+# which flame graph tools read directly.
+
+class SamplingProfiler:
+    def __init__(self, max_depth=64, max_stacks=5000):
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+        self.interval = 0.01
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = None
+        self.samples = 0
+        self.started_at = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=0.01):
+        with self._lock:
+            if self.running:
+                return False
+            self.interval = interval
+            self._stacks.clear()
+            self.samples = 0
+            self.started_at = time.time()
+            # Each sampling thread gets its own stop event, so a quick stop/start can't revive an old one.
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop,), name='sampling-profiler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        with self._lock:
+            thread, stop = self._thread, self._stop
+            self._thread = self._stop = None
+        if thread is not None:
+            stop.set()
+            thread.join()
+
+    def _run(self, stop):
+        own_id = threading.get_ident()
+        while not stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, frame in frames.items():
+                    if thread_id == own_id:
+                        continue
+                    stack = []
+                    while frame is not None and len(stack) < self.max_depth:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                        frame = frame.f_back
+                    key = ';'.join(reversed(stack))
+                    if key in self._stacks or len(self._stacks) < self.max_stacks:
+                        self._stacks[key] += 1
+                self.samples += 1
+
+    def collapsed(self, limit=None):
+        with self._lock:
+            return '\n'.join(f'{stack} {count}' for stack, count in self._stacks.most_common(limit)) + '\n'
+
+    def status(self):
+        return {
+            'running': self.running,
+            'interval': self.interval,
+            'samples': self.samples,
+            'distinct_stacks': len(self._stacks),
+            'started_at': self.started_at,
+        }
@@ -9,6 +9,12 @@ function displayResponse(elementId, data, isError = false) {
 }
 
 let loggedInUserId = null; // Variable pour stocker l'ID de l'utilisateur connecté
+let sessionToken = null; // Jeton de session renvoyé par /login, envoyé aux routes profil et abonnements
+
+// En-têtes avec le jeton de session (Authorization: Bearer ...) quand l'utilisateur est connecté
+function authHeaders(headers = {}) {
+    return sessionToken ? { ...headers, 'Authorization': `Bearer ${sessionToken}` } : headers;
+}
 
 // --- Fonctions de Gestion des Utilisateurs ---
 
@@ -52,11 +58,13 @@ async function loginUser() {
         const data = await response.json();
         if (response.ok) {
             loggedInUserId = data.user_id;
+            sessionToken = data.token;
             document.getElementById('loggedInUserId').textContent = loggedInUserId;
             displayResponse('loginResponse', data);
             // Vous pouvez stocker loggedInUserId dans sessionStorage ou localStorage ici pour persister la connexion
         } else {
             loggedInUserId = null;
+            sessionToken = null;
             document.getElementById('loggedInUserId').textContent = 'None';
             displayResponse('loginResponse', data, true);
         }
@@ -92,7 +100,8 @@ async function searchUsers() {
 
 async function getAllServices() {
     try {
-        const response = await fetch(`${API_BASE_URL}/services`);
+        // 'no-cache' : le navigateur revalide avec If-None-Match et reçoit un 304 si le catalogue n'a pas changé
+        const response = await fetch(`${API_BASE_URL}/services`, { cache: 'no-cache' });
         const data = await response.json();
         if (response.ok) {
             displayResponse('servicesResponse', data);
@@ -114,7 +123,7 @@ async function getUserSubscriptions() {
     }
 
     try {
-        const response = await fetch(`${API_BASE_URL}/users/${userId}/subscriptions`);
+        const response = await fetch(`${API_BASE_URL}/users/${userId}/subscriptions`, { headers: authHeaders() });
         const data = await response.json();
         if (response.ok) {
             displayResponse('subsResponse', data);
@@ -150,9 +159,9 @@ async function addSubscription() {
     try {
         const response = await fetch(`${API_BASE_URL}/users/${userId}/subscriptions`, {
             method: 'POST',
-            headers: {
+            headers: authHeaders({
                 'Content-Type': 'application/json',
-            },
+            }),
             body: JSON.stringify(body),
         });
         const data = await response.json();
@@ -194,9 +203,9 @@ async function updateSubscription() {
     try {
         const response = await fetch(`${API_BASE_URL}/users/${userId}/subscriptions/${serviceId}`, {
             method: 'PUT',
-            headers: {
+            headers: authHeaders({
                 'Content-Type': 'application/json',
-            },
+            }),
             body: JSON.stringify(body),
         });
         const data = await response.json();
@@ -223,9 +232,9 @@ async function deleteSubscription() {
     try {
         const response = await fetch(`${API_BASE_URL}/users/${userId}/subscriptions/${serviceId}`, {
             method: 'DELETE',
-            headers: {
+            headers: authHeaders({
                 'Content-Type': 'application/json',
-            },
+            }),
         });
         const data = await response.json();
         if (response.ok) {
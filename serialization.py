@@ -0,0 +1,118 @@
+import gzip
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson # optional, several times faster than the stdlib encoder
+except ImportError:
+    orjson = None
+try:
+    import brotli # optional, enables Content-Encoding: br
+except ImportError:
+    brotli = None
+
+# --- Response Serialization ---
+# Rows are read as plain tuples (no sqlite3.Row per row) and zipped with the
+# column names from the cursor metadata into the dicts handed to the encoder.
+# The encoder is pluggable: orjson when installed, the C-accelerated stdlib
+# encoder otherwise, or anything registered with register_encoder(). Keys keep
+# the SELECT order instead of being sorted.
+#
+# ?fields=a,b is validated against a whitelist and pushed down into the
+# SELECT list, so unrequested columns are never read nor encoded. Large
+# bodies are compressed (br, then gzip) when the client accepts it.
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain')
+
+_stdlib_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=DefaultJSONProvider.default)
+
+def _stdlib_dumps(obj):
+    return _stdlib_encoder.encode(obj).encode('utf-8')
+
+ENCODERS = {'json': _stdlib_dumps}
+if orjson is not None:
+    ENCODERS['orjson'] = lambda obj: orjson.dumps(obj, default=DefaultJSONProvider.default,
+                                                  option=orjson.OPT_NON_STR_KEYS)
+
+def register_encoder(name, dumps):
+    # dumps(obj) -> UTF-8 bytes
+    ENCODERS[name] = dumps
+
+def get_encoder(name='auto'):
+    if name == 'auto':
+        name = 'orjson' if 'orjson' in ENCODERS else 'json'
+    if name not in ENCODERS:
+        raise ValueError(f"Unknown JSON encoder {name!r} (available: {', '.join(sorted(ENCODERS))})")
+    return ENCODERS[name]
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider (jsonify, app.json) backed by get_encoder()."""
+
+    def __init__(self, app, encoder='auto'):
+        super().__init__(app)
+        self.encoder_name = encoder
+        self.encode = get_encoder(encoder)
+
+    def dumps(self, obj, **kwargs):
+        return self.encode(obj).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        # Bytes straight to the response, without the str round trip of the default provider.
+        return self._app.response_class(self.encode(self._prepare_response_obj(args, kwargs)), mimetype=self.mimetype)
+
+# --- Rows ---
+
+def tuple_cursor(conn):
+    cursor = conn.cursor()
+    cursor.row_factory = None # plain tuples, whatever the connection's row_factory
+    return cursor
+
+def to_records(names, rows):
+    # zip() stops at the shortest: extra trailing columns (e.g. a pagination key) are left out.
+    return [dict(zip(names, row)) for row in rows]
+
+def fetch_records(conn, query, params=()):
+    cursor = tuple_cursor(conn)
+    cursor.execute(query, params)
+    return to_records([column[0] for column in cursor.description], cursor.fetchall())
+
+def fetch_record(conn, query, params=()):
+    cursor = tuple_cursor(conn)
+    row = cursor.execute(query, params).fetchone()
+    return dict(zip([column[0] for column in cursor.description], row)) if row is not None else None
+
+def parse_fields(value, allowed, default=None):
+    """?fields=a,b -> list of field names; `allowed` lists (or maps) the selectable ones."""
+    if not value:
+        return list(default or allowed)
+    fields = list(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in allowed]
+    if unknown or not fields:
+        raise ValueError(f"Unknown fields: {', '.join(unknown) or '(none given)'}; allowed: {', '.join(allowed)}")
+    return fields
+
+def select_list(fields, columns):
+    # columns maps each field to its SQL expression
+    return ', '.join(field if columns[field] == field else f'{columns[field]} AS {field}' for field in fields)
+
+# --- Compression ---
+
+def accepted_encoding(accept_encoding):
+    # Preferred available coding of an Accept-Encoding header, or None.
+    accepted = set()
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(coding.strip().lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+def compress(body, encoding, level=5):
+    if encoding == 'br':
+        return brotli.compress(body, quality=level)
+    return gzip.compress(body, compresslevel=level, mtime=0)
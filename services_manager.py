@@ -1,81 +1,144 @@
-
-
-import pandas as pd
-
-# Initialisation d'un DataFrame vide pour les services
-# Dans une application réelle, ces données viendraient d'une base de données
-services_df = pd.DataFrame(columns=['id', 'name', 'description', 'price', 'features'])
-
-def get_next_service_id():
-    """Génère un ID unique pour un nouveau service."""
-    global services_df
-    if services_df.empty:
-        return 1
-    return services_df['id'].max() + 1
+import json
+import sqlite3
+from contextlib import contextmanager
+
+# Le catalogue des services vit dans la table `services` de la base SQLite, celle
+# que sert app.py. Les recherches par ID passent par la clé primaire et les
+# insertions multiples par un seul executemany. pandas n'est importé qu'à la
+# demande, par get_services_dataframe().
+
+DB_NAME = 'extended_database.db'
+
+SERVICE_COLUMNS = ('id', 'name', 'description', 'price', 'features')
+SELECT_SERVICES = "SELECT id, name, description, price, features FROM services"
+
+def connect(db_name=DB_NAME):
+    """Ouvre une connexion configurée pour le catalogue."""
+    conn = sqlite3.connect(db_name)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON;")
+    return conn
+
+@contextmanager
+def _connection(conn=None):
+    # Réutilise la connexion fournie, sinon en ouvre une pour la durée de l'appel.
+    if conn is not None:
+        yield conn
+        return
+    conn = connect()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def row_to_service(row):
+    """Convertit une ligne de la table `services` en dictionnaire (features décodées)."""
+    service = dict(zip(SERVICE_COLUMNS, row))
+    service['features'] = json.loads(service['features']) if service['features'] else []
+    return service
 
 # --- Fonctions de gestion des services ---
 
-def add_service(name, description, price, features):
-    """Ajoute un nouveau service au DataFrame."""
-    global services_df
-    service_id = get_next_service_id()
-    new_service = pd.DataFrame([{'id': service_id, 'name': name, 'description': description, 'price': price, 'features': features}])
-    services_df = pd.concat([services_df, new_service], ignore_index=True)
+def add_service(name, description, price, features, conn=None):
+    """Ajoute un nouveau service au catalogue et retourne son ID."""
+    with _connection(conn) as conn:
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO services (name, description, price, features) VALUES (?, ?, ?, ?) RETURNING id;",
+                (name, description, price, json.dumps(features or []))
+            )
+            service_id = cursor.fetchone()[0]
     print(f"Service '{name}' (ID: {service_id}) ajouté.")
     return service_id
 
-def get_all_services():
-    """Retourne tous les services disponibles."""
-    global services_df
-    return services_df
-
-def get_service_by_id(service_id):
+def add_services(services, conn=None):
+    """Ajoute plusieurs services (tuples name, description, price, features) en une transaction."""
+    params = [(name, description, price, json.dumps(features or []))
+              for name, description, price, features in services]
+    with _connection(conn) as conn:
+        with conn:
+            conn.executemany(
+                "INSERT INTO services (name, description, price, features) VALUES (?, ?, ?, ?);",
+                params
+            )
+    print(f"{len(params)} services ajoutés.")
+    return len(params)
+
+def get_all_services(conn=None):
+    """Retourne tous les services disponibles, triés par ID."""
+    with _connection(conn) as conn:
+        rows = conn.execute(SELECT_SERVICES + " ORDER BY id;").fetchall()
+    return [row_to_service(row) for row in rows]
+
+def get_services_dataframe(conn=None):
+    """Retourne le catalogue sous forme de DataFrame pandas (import à la demande)."""
+    import pandas as pd
+    return pd.DataFrame(get_all_services(conn), columns=list(SERVICE_COLUMNS))
+
+def get_service_by_id(service_id, conn=None):
     """Retourne un service par son ID."""
-    global services_df
-    service_found = services_df[services_df['id'] == service_id]
-    return service_found.to_dict(orient='records')[0] if not service_found.empty else None
+    with _connection(conn) as conn:
+        row = conn.execute(SELECT_SERVICES + " WHERE id = ?;", (service_id,)).fetchone()
+    return row_to_service(row) if row else None
 
-def update_service(service_id, name=None, description=None, price=None, features=None):
+def update_service(service_id, name=None, description=None, price=None, features=None, conn=None):
     """Met à jour les informations d'un service existant."""
-    global services_df
-    idx = services_df[services_df['id'] == service_id].index
-    if not idx.empty:
-        if name: services_df.loc[idx, 'name'] = name
-        if description: services_df.loc[idx, 'description'] = description
-        if price is not None: services_df.loc[idx, 'price'] = price
-        if features: services_df.loc[idx, 'features'] = features
+    updates = []
+    params = []
+    if name:
+        updates.append("name = ?")
+        params.append(name)
+    if description:
+        updates.append("description = ?")
+        params.append(description)
+    if price is not None:
+        updates.append("price = ?")
+        params.append(price)
+    if features:
+        updates.append("features = ?")
+        params.append(json.dumps(features))
+    if not updates:
+        return False
+    params.append(service_id)
+
+    with _connection(conn) as conn:
+        with conn:
+            cursor = conn.execute(f"UPDATE services SET {', '.join(updates)} WHERE id = ?;", params)
+    if cursor.rowcount > 0:
         print(f"Service ID {service_id} mis à jour.")
         return True
     print(f"Service ID {service_id} non trouvé.")
     return False
 
-def delete_service(service_id):
+def delete_service(service_id, conn=None):
     """Supprime un service par son ID."""
-    global services_df
-    initial_rows = len(services_df)
-    services_df = services_df[services_df['id'] != service_id].reset_index(drop=True)
-    if len(services_df) < initial_rows:
+    with _connection(conn) as conn:
+        with conn:
+            cursor = conn.execute("DELETE FROM services WHERE id = ?;", (service_id,))
+    if cursor.rowcount > 0:
         print(f"Service ID {service_id} supprimé.")
         return True
     print(f"Service ID {service_id} non trouvé.")
     return False
 
 
-# Exemple d'utilisation (vous pouvez mettre cela dans un script séparé ou après la définition des fonctions)
+# Exemple d'utilisation (nécessite une base initialisée par initialize_database.py)
 if __name__ == '__main__':
     print("--- Exécution des exemples de gestion des services ---")
     add_service("Hébergement Basique", "Espace disque 10GB, Trafic 100GB", 9.99, ["10GB SSD", "100GB Trafic", "1 Domaine"])
     add_service("Hébergement Premium", "Espace disque 50GB, Trafic Illimité, SSL", 24.99, ["50GB SSD", "Trafic Illimité", "5 Domaines", "Certificat SSL"])
-    add_service("Serveur Dédié", "Serveur puissant pour gros projets", 99.99, ["CPU 4 cœurs", "RAM 16GB", "Disque 1TB SSD", "IP dédiée"])
+    serveur_id = add_service("Serveur Dédié", "Serveur puissant pour gros projets", 99.99, ["CPU 4 cœurs", "RAM 16GB", "Disque 1TB SSD", "IP dédiée"])
 
     print("\n--- Tous les services ---")
-    print(get_all_services())
+    for service in get_all_services():
+        print(service)
 
-    print("\n--- Service ID 2 ---")
-    print(get_service_by_id(2))
+    print(f"\n--- Service ID {serveur_id} ---")
+    print(get_service_by_id(serveur_id))
 
-    update_service(1, description="Espace disque 20GB, Trafic 200GB", price=12.99)
-    delete_service(3)
+    update_service(serveur_id, description="Serveur puissant, 32GB RAM", price=119.99)
+    delete_service(serveur_id)
 
     print("\n--- Services après modifications ---")
-    print(get_all_services())
+    for service in get_all_services():
+        print(service)
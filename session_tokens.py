@@ -0,0 +1,80 @@
+import base64
+import hashlib
+import hmac
+import threading
+import time
+
+from login_guard import LRUMap
+
+# --- Session Tokens ---
+# Stateless bearer tokens issued by /login: "<user_id>.<epoch>.<expires>.<mac>",
+# the MAC being HMAC-SHA256 of the first three fields with the server secret.
+# Checking one costs a hash, not a database query or a bcrypt verify.
+#
+# Revocation goes through users.token_epoch: logout and password changes bump
+# it, and a token is only accepted while it carries the user's current epoch.
+# EpochCache keeps those epochs in memory for `ttl` seconds, so a user costs
+# one primary-key lookup per ttl; revocations made by this process are seen at
+# once, those made by other processes within ttl.
+
+DELETED = -1 # cached epoch of a user that no longer exists, matches no token
+
+class InvalidSession(Exception):
+    pass
+
+def _mac(secret, payload):
+    digest = hmac.new(secret, payload.encode('utf-8'), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+class TokenSigner:
+    def __init__(self, secret, ttl=3600):
+        self.secret = secret.encode('utf-8') if isinstance(secret, str) else secret
+        self.ttl = ttl
+
+    def issue(self, user_id, epoch, now=None):
+        expires = int((now or time.time()) + self.ttl)
+        payload = f'{int(user_id)}.{int(epoch)}.{expires}'
+        return f'{payload}.{_mac(self.secret, payload)}'
+
+    def verify(self, token, now=None):
+        """Returns (user_id, epoch) of a well-signed, unexpired token; raises InvalidSession otherwise."""
+        payload, _, mac = token.rpartition('.')
+        # Compared as bytes: compare_digest() raises TypeError on non-ASCII strings.
+        if not payload or not hmac.compare_digest(mac.encode('utf-8'), _mac(self.secret, payload).encode('ascii')):
+            raise InvalidSession('Invalid session token')
+        try:
+            user_id, epoch, expires = (int(field) for field in payload.split('.'))
+        except ValueError:
+            raise InvalidSession('Invalid session token')
+        if expires <= (now or time.time()):
+            raise InvalidSession('Session token expired')
+        return user_id, epoch
+
+class EpochCache:
+    """Current token epoch per user id, each entry trusted for `ttl` seconds."""
+
+    def __init__(self, ttl=30.0, max_keys=100000):
+        self.ttl = ttl
+        self.entries = LRUMap(max_keys)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        # None when unknown or stale: the caller loads the epoch and calls set().
+        with self._lock:
+            entry = self.entries.get(user_id)
+            if entry is None or entry[1] <= time.monotonic():
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def set(self, user_id, epoch):
+        with self._lock:
+            self.entries.set(user_id, (epoch, time.monotonic() + self.ttl))
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'cached': len(self.entries),
+                    'evictions': self.entries.evictions}
@@ -0,0 +1,451 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
+from db_pool import get_pool_set, open_connection
+from group_commit import GroupCommitWriter
+from migrations import ensure_schema as migrate_database
+from services_manager import SELECT_SERVICES, row_to_service
+
+# --- Sharded Storage ---
+# Optional layout (SHARDS in app.py) spreading users and their subscriptions
+# over several SQLite files, so that writes for different users take
+# different write locks:
+#   * the main database keeps the services catalog, the promotions and the user
+#     directory: user_directory hands out every user id and keeps emails
+#     unique across shards (one small write per user creation or email change);
+#   * a user and all their user_services rows live in shard shard_index(id),
+#     a multiplicative hash of the user id. Each shard has the full schema and
+#     a copy of the services table (foreign keys, joins), replaced whenever the
+#     main catalog_version moves on;
+#   * subscription ids stay unique across shards: shard i of N only hands out
+#     ids congruent to i modulo N, above the largest id that existed when its
+#     file was built (view next_subscription_id);
+#   * reads spanning several users run on every shard in parallel and are
+#     merged by the caller.
+# Shard files are named shard-<i>-of-<N>.db: a reshard builds the new layout
+# next to the current one, with the application stopped, then the application
+# is restarted with SHARDS = N. --shards 0 moves everything back into the main
+# database.
+#   python sharding.py --database extended_database.db --shards 4 [--delete-source]
+
+# SQLite attaches at most 10 databases by default.
+ATTACH_BATCH = 10
+
+SUBSCRIPTION_INSERT = (
+    "INSERT INTO user_services (id, user_id, service_id, active, start_date, end_date) "
+    "VALUES ((SELECT id FROM next_subscription_id), ?, ?, ?, ?, ?) RETURNING id;"
+)
+
+# Deleting the users moved away queued them for the archive (deleted_users): a move is not a deletion.
+# Run where user_directory lists every live user, in the transaction of the delete.
+FORGET_MOVED_USERS = "DELETE FROM deleted_users WHERE id IN (SELECT id FROM user_directory);"
+
+def delete_moved_rows(conn):
+    # Empties users and user_services of the main database, in the caller's transaction. The
+    # triggers log every row as deleted: like copy_users(), drop those entries from the change feed.
+    last_change = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes;").fetchone()[0]
+    conn.execute("DELETE FROM user_services;")
+    conn.execute("DELETE FROM users;")
+    conn.execute(FORGET_MOVED_USERS)
+    conn.execute("DELETE FROM changes WHERE seq > ?;", (last_change,))
+
+def shard_index(user_id, count):
+    # Fibonacci hashing: consecutive ids are spread evenly, the high bits pick the shard.
+    return ((user_id * 2654435761) & 0xFFFFFFFF) * count >> 32
+
+def shard_paths(database, count, directory=None):
+    directory = directory or database + '.shards'
+    return [os.path.join(directory, f'shard-{index}-of-{count}.db') for index in range(count)]
+
+def create_home_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_directory (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE NOT NULL
+        );
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sharding (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            shards INTEGER NOT NULL -- 0 = users live in this database
+        );
+    ''')
+    conn.execute("INSERT OR IGNORE INTO sharding (id, shards) VALUES (1, 0);")
+
+def create_shard_tables(conn, index, count, subscription_id_floor):
+    conn.execute('''
+        CREATE TABLE shard_layout (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            shard INTEGER NOT NULL,
+            shards INTEGER NOT NULL,
+            subscription_id_floor INTEGER NOT NULL,
+            catalog_version INTEGER NOT NULL DEFAULT 0 -- main catalog_version of the services copy
+        );
+    ''')
+    conn.execute("INSERT INTO shard_layout (id, shard, shards, subscription_id_floor) VALUES (1, ?, ?, ?);",
+                 (index, count, subscription_id_floor))
+    # Smallest id above both the floor and every id used so far (sqlite_sequence) that belongs to this shard.
+    conn.execute('''
+        CREATE VIEW next_subscription_id AS
+        SELECT (MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'user_services'), 0),
+                    subscription_id_floor) + shards - shard) / shards * shards + shard AS id
+        FROM shard_layout;
+    ''')
+
+def configured_shards(conn):
+    # Shard count recorded in the main database by the last reshard (0 = not sharded).
+    try:
+        return conn.execute("SELECT shards FROM sharding WHERE id = 1;").fetchone()[0]
+    except sqlite3.OperationalError: # never sharded: no table yet
+        return 0
+
+# --- Mutations (run in the caller's transaction, see app.run_write) ---
+
+def allocate_user_id(conn, email):
+    # Raises IntegrityError when the email is taken on any shard.
+    return conn.execute("INSERT INTO user_directory (email) VALUES (?) RETURNING id;", (email,)).fetchone()[0]
+
+def release_user_id(conn, user_id):
+    conn.execute("DELETE FROM user_directory WHERE id = ?;", (user_id,))
+
+def rename_user(conn, user_id, email):
+    # Returns the previous email, None for an unknown user; raises IntegrityError when the email is taken.
+    row = conn.execute("SELECT email FROM user_directory WHERE id = ?;", (user_id,)).fetchone()
+    if row is None:
+        return None
+    conn.execute("UPDATE user_directory SET email = ? WHERE id = ?;", (email, user_id))
+    return row[0]
+
+def lookup_user_id(conn, email):
+    row = conn.execute("SELECT id FROM user_directory WHERE email = ?;", (email,)).fetchone()
+    return row[0] if row is not None else None
+
+def replicate_catalog(conn, version, services):
+    # services: dicts as loaded by catalog_cache. Deleting a service cascades to its subscriptions,
+    # as it does on the main database.
+    conn.executemany(
+        "INSERT INTO services (id, name, description, price, features) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (id) DO UPDATE SET name = excluded.name, description = excluded.description, "
+        "price = excluded.price, features = excluded.features;",
+        [(s['id'], s['name'], s['description'], s['price'], json.dumps(s['features'])) for s in services]
+    )
+    conn.execute("DELETE FROM services WHERE id NOT IN (SELECT value FROM json_each(?));",
+                 (json.dumps([s['id'] for s in services]),))
+    conn.execute("UPDATE shard_layout SET catalog_version = ? WHERE id = 1;", (version,))
+
+def shard_totals(conn):
+    # Row counts from the trigger-maintained dashboard aggregates: no table scan.
+    users = conn.execute("SELECT users FROM dashboard_totals WHERE id = 1;").fetchone()[0]
+    active, inactive = conn.execute(
+        "SELECT COALESCE(SUM(active), 0), COALESCE(SUM(inactive), 0) FROM service_stats;").fetchone()
+    return {'users': users, 'subscriptions': active + inactive}
+
+class ShardSet:
+    """Connection pools and writers of the shards of a sharded layout."""
+
+    def __init__(self, database, count, directory=None, read_pool_size=4, pragmas=None, group_commit=None,
+                 **options):
+        # group_commit: (max_batch, max_delay) for one GroupCommitWriter per shard, None to commit on
+        # each shard's writer connection. options (factory, trace) are passed on to every connection.
+        self.database = database
+        self.count = count
+        self.paths = shard_paths(database, count, directory)
+        self._check_layout()
+        for path in self.paths:
+            migrate_database(path)
+        self.pools = [get_pool_set(path, read_pool_size, pragmas or {}, **options) for path in self.paths]
+        self.writers = None
+        if group_commit is not None:
+            self.writers = [GroupCommitWriter(partial(open_connection, path, pragmas or {}, **options), *group_commit)
+                            for path in self.paths]
+        self._executor = ThreadPoolExecutor(max_workers=count, thread_name_prefix='shard-read')
+        self._catalog_lock = threading.Lock()
+        self._catalog_checked_at = 0.0
+        self.catalog_versions = []
+        for index in range(count):
+            with self.reader(index) as conn:
+                self.catalog_versions.append(
+                    conn.execute("SELECT catalog_version FROM shard_layout WHERE id = 1;").fetchone()[0])
+        # Metrics
+        self.reads = [0] * count
+        self.writes = [0] * count
+        self.fan_outs = 0
+        self.catalog_syncs = 0
+
+    def _check_layout(self):
+        # Refuse to serve from files that do not match the layout recorded by the last reshard.
+        conn = sqlite3.connect(self.database)
+        try:
+            recorded = configured_shards(conn)
+        finally:
+            conn.close()
+        if recorded != self.count:
+            raise RuntimeError(f"{self.database} is laid out for {recorded} shards, not {self.count}: "
+                               f"run python sharding.py --database {self.database} --shards {self.count}")
+        for index, path in enumerate(self.paths):
+            if not os.path.exists(path):
+                raise RuntimeError(f"Missing shard file {path}")
+            conn = sqlite3.connect(path)
+            try:
+                layout = conn.execute("SELECT shard, shards FROM shard_layout WHERE id = 1;").fetchone()
+            except sqlite3.OperationalError:
+                layout = None
+            finally:
+                conn.close()
+            if layout != (index, self.count):
+                raise RuntimeError(f"{path} is not shard {index} of {self.count} (found {layout})")
+
+    def index(self, user_id):
+        return shard_index(user_id, self.count)
+
+    @contextmanager
+    def reader(self, index, timeout=None):
+        pool = self.pools[index].readers
+        conn = pool.acquire(timeout=timeout)
+        try:
+            yield conn
+        finally:
+            pool.release(conn)
+
+    def _read(self, index, timeout, fn, args):
+        with self.reader(index, timeout) as conn:
+            self.reads[index] += 1
+            return fn(conn, *args)
+
+    def map(self, fn, args_by_shard, timeout=None):
+        """Runs fn(conn, *args) on a reader of each given shard in parallel; results in the order of the keys."""
+        self.fan_outs += 1
+        futures = [self._executor.submit(self._read, index, timeout, fn, args)
+                   for index, args in args_by_shard.items()]
+        return [future.result() for future in futures]
+
+    def broadcast(self, fn, *args, timeout=None):
+        """fn(conn, *args) on every shard, in parallel."""
+        return self.map(fn, {index: args for index in range(self.count)}, timeout)
+
+    def write(self, index, fn, *args, timeout=None):
+        """Runs the mutation fn(conn, *args) on the shard and returns its result once committed."""
+        self.writes[index] += 1
+        if self.writers is not None:
+            return self.writers[index].execute(fn, *args, timeout=timeout)
+        pool = self.pools[index].writer
+        conn = pool.acquire(timeout=timeout)
+        try:
+            result = fn(conn, *args)
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+            return result
+        finally:
+            pool.release(conn)
+
+    def catalog_due(self, revalidate_seconds):
+        return time.monotonic() - self._catalog_checked_at >= revalidate_seconds
+
+    def sync_catalog(self, version, services, timeout=None):
+        # Brings every shard's services copy to `version` of the main catalog.
+        with self._catalog_lock:
+            for index in range(self.count):
+                if self.catalog_versions[index] != version:
+                    self.write(index, replicate_catalog, version, services, timeout=timeout)
+                    self.catalog_versions[index] = version
+                    self.catalog_syncs += 1
+            self._catalog_checked_at = time.monotonic()
+
+    def close(self):
+        if self.writers is not None:
+            for writer in self.writers:
+                writer.stop()
+        self._executor.shutdown(wait=False)
+
+    def status(self):
+        totals = self.broadcast(shard_totals)
+        return {
+            'shards': self.count,
+            'fan_outs': self.fan_outs,
+            'catalog_syncs': self.catalog_syncs,
+            'shard_list': [
+                {'shard': index, 'path': path, **totals[index], 'reads': self.reads[index],
+                 'writes': self.writes[index], 'catalog_version': self.catalog_versions[index],
+                 'group_commit': self.writers[index].stats() if self.writers is not None else None}
+                for index, path in enumerate(self.paths)
+            ],
+        }
+
+# --- Resharding ---
+
+def copy_columns(conn, table, source):
+    # Columns present on both sides, in the target's order.
+    target = [row[1] for row in conn.execute(f"PRAGMA main.table_info({table});")]
+    present = {row[1] for row in conn.execute(f"PRAGMA {source}.table_info({table});")}
+    return ', '.join(column for column in target if column in present)
+
+def copy_users(conn, sources, index, count):
+    # Rows of every source whose user hashes to `index`, ids preserved; count 0 copies everything.
+    # Sources are attached outside the transaction (SQLite refuses ATTACH / DETACH inside one),
+    # ATTACH_BATCH at a time.
+    conn.create_function('shard_of', 1, lambda user_id: shard_index(user_id, count) if count else 0,
+                         deterministic=True)
+    users = subscriptions = 0
+    for start in range(0, len(sources), ATTACH_BATCH):
+        batch = sources[start:start + ATTACH_BATCH]
+        for number, source in enumerate(batch):
+            conn.execute(f"ATTACH DATABASE ? AS source{number};", (source,))
+        try:
+            conn.execute("BEGIN IMMEDIATE;")
+            last_change = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes;").fetchone()[0]
+            for number in range(len(batch)):
+                for table, key in (('users', 'id'), ('user_services', 'user_id')):
+                    columns = copy_columns(conn, table, f'source{number}')
+                    copied = conn.execute(f"INSERT INTO main.{table} ({columns}) SELECT {columns} "
+                                          f"FROM source{number}.{table} WHERE shard_of({key}) = ? ORDER BY id;",
+                                          (index,)).rowcount
+                    if table == 'users':
+                        users += copied
+                    else:
+                        subscriptions += copied
+            # The triggers logged every copied row: a move is not a change for feed consumers.
+            conn.execute("DELETE FROM changes WHERE seq > ?;", (last_change,))
+            conn.execute("COMMIT;")
+        finally:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK;")
+            for number in range(len(batch)):
+                conn.execute(f"DETACH DATABASE source{number};")
+    return users, subscriptions
+
+def remove_database(path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+def reshard(database, count, directory=None, delete_source=False):
+    """Copies users and subscriptions from the current layout into `count` shards (0 = the main database)."""
+    started = time.perf_counter()
+    migrate_database(database)
+    home = sqlite3.connect(database, isolation_level=None)
+    home.execute("PRAGMA busy_timeout = 5000;")
+    try:
+        create_home_tables(home)
+        current = configured_shards(home)
+        if current == count:
+            raise ValueError(f"{database} is already laid out for {count} shards")
+        sources = shard_paths(database, current, directory) if current else [database]
+        targets = shard_paths(database, count, directory) if count else [database]
+        if count and not current and home.execute("SELECT EXISTS (SELECT 1 FROM tickets);").fetchone()[0]:
+            raise ValueError(f"{database} holds support tickets, which sharded storage does not carry")
+        if count:
+            for path in targets:
+                if os.path.exists(path):
+                    raise ValueError(f"{path} already exists (left over from an earlier layout?): remove it first")
+            os.makedirs(os.path.dirname(targets[0]), exist_ok=True)
+        elif home.execute("SELECT EXISTS (SELECT 1 FROM users);").fetchone()[0]:
+            raise ValueError(f"{database} still holds the users copied from before sharding: "
+                             "reshard with --delete-source, or delete them first")
+
+        floor = 0
+        for source in sources:
+            conn = sqlite3.connect(source)
+            try:
+                floor = max(floor, conn.execute("SELECT COALESCE(MAX(id), 0) FROM user_services;").fetchone()[0])
+            finally:
+                conn.close()
+        version = home.execute("SELECT version FROM catalog_version WHERE id = 1;").fetchone()[0]
+        services = [row_to_service(row) for row in home.execute(SELECT_SERVICES + " ORDER BY id;")]
+
+        users = subscriptions = 0
+        for index, target in enumerate(targets):
+            migrate_database(target)
+            conn = sqlite3.connect(target, isolation_level=None)
+            try:
+                # Copied rows keep their promotion_id, whose promotions stay on the main database.
+                conn.execute("PRAGMA foreign_keys = OFF;")
+                conn.execute("PRAGMA journal_mode = WAL;")
+                if count:
+                    conn.execute("BEGIN IMMEDIATE;")
+                    create_shard_tables(conn, index, count, floor)
+                    replicate_catalog(conn, version, services)
+                    conn.execute("COMMIT;")
+                copied = copy_users(conn, sources, index, count)
+                # Without statistics the planner picks worse indexes on a freshly filled file.
+                conn.execute("ANALYZE;")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK;")
+                if not count:
+                    # The main database held no users before the copy.
+                    conn.execute("BEGIN IMMEDIATE;")
+                    delete_moved_rows(conn)
+                    conn.execute("COMMIT;")
+                conn.close()
+                # New shard files only hold copies: drop them so the command can be run again.
+                for path in targets[:index + 1] if count else ():
+                    remove_database(path)
+                raise
+            finally:
+                conn.close()
+            users += copied[0]
+            subscriptions += copied[1]
+            print(f"{target}: {copied[0]} users, {copied[1]} subscriptions.")
+
+        home.execute("BEGIN IMMEDIATE;")
+        if not current:
+            # First sharding: the directory takes over id allocation where the users table left it.
+            home.execute("DELETE FROM user_directory;")
+            home.execute("INSERT INTO user_directory (id, email) SELECT id, email FROM users;")
+            sequence = home.execute(
+                "SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'users'), 0), "
+                "COALESCE((SELECT MAX(id) FROM users), 0));").fetchone()[0]
+            home.execute("DELETE FROM sqlite_sequence WHERE name = 'user_directory';")
+            home.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('user_directory', ?);", (sequence,))
+        elif not count:
+            # Back to one database: users ids continue after the last one the directory handed out.
+            sequence = home.execute("SELECT seq FROM sqlite_sequence WHERE name = 'user_directory';").fetchone()
+            if sequence is not None:
+                home.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'users';", (sequence[0],))
+        home.execute("UPDATE sharding SET shards = ? WHERE id = 1;", (count,))
+        if delete_source and not current:
+            delete_moved_rows(home)
+        home.execute("COMMIT;")
+    finally:
+        if home.in_transaction:
+            home.execute("ROLLBACK;")
+        home.close()
+    if delete_source and current:
+        for source in sources:
+            remove_database(source)
+    return {'from': current, 'to': count, 'users': users, 'subscriptions': subscriptions,
+            'seconds': round(time.perf_counter() - started, 3)}
+
+# --- Command Line Interface ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move users and subscriptions to a new shard layout.")
+    parser.add_argument('--database', default='extended_database.db', help="Main database (catalog, directory)")
+    parser.add_argument('--shards', type=int, required=True, help="Target shard count, 0 = back to one database")
+    parser.add_argument('--directory', help="Shard files directory, defaults to <database>.shards")
+    parser.add_argument('--delete-source', action='store_true',
+                        help="Delete the copied rows (main database) or the previous shard files afterwards")
+    args = parser.parse_args(argv)
+    if args.shards < 0:
+        parser.error("--shards must be 0 or more")
+    try:
+        result = reshard(args.database, args.shards, args.directory, args.delete_source)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(json.dumps(result))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,267 @@
+import os
+import sqlite3
+import threading
+import time
+
+from db_pool import ConnectionPool
+
+# --- Read Snapshots ---
+# Optional read-replica mode for heavy reporting reads (full user lists,
+# subscription scans): they run against copies of the database taken with the
+# SQLite online backup API, so their long read transactions neither compete
+# with the request readers for the primary's page cache nor pin its WAL.
+#
+# Each replica is refreshed every `interval` seconds, or sooner once `commits`
+# writes have been recorded. A refresh copies into a new file (one read
+# transaction on the primary, writers are not blocked in WAL mode) and swaps
+# it in; the previous copy is deleted once its last connection is released,
+# so readers never wait for a refresh. When PRAGMA data_version shows that
+# nothing was committed since a replica was taken, the copy is kept and only
+# its timestamp is moved forward.
+#
+# acquire() only hands out a replica within the caller's staleness bound;
+# the caller falls back to the primary otherwise.
+
+class Snapshot:
+    """One copy of the database and the read-only pool opened on it."""
+
+    def __init__(self, replica, path, taken_at, data_version, pool):
+        self.replica = replica
+        self.path = path
+        self.taken_at = taken_at # wall clock time up to which the copy is known current
+        self.data_version = data_version
+        self.pool = pool
+        self.in_use = 0
+        self.retired = False
+
+    @property
+    def age(self):
+        return max(0.0, time.time() - self.taken_at)
+
+class SnapshotManager:
+    def __init__(self, database, directory=None, replicas=1, interval=30.0, commits=1000, read_pool_size=4,
+                 pragmas=None, **options):
+        # options (factory, trace) are passed on to every snapshot connection.
+        self.database = database
+        self.directory = directory or f'{database}.snapshots'
+        self.interval = interval
+        self.commits = commits
+        self.read_pool_size = read_pool_size
+        # The copies are switched to a rollback journal, and are never written to.
+        self.pragmas = {name: value for name, value in (pragmas or {}).items() if name != 'journal_mode'}
+        self.options = options
+        self.replicas = [None] * replicas
+        self.prefix = os.path.basename(database) + '.'
+        self.refreshes = 0
+        self.unchanged = 0 # refreshes that found nothing committed and kept the copy
+        self.errors = 0
+        self.served = 0
+        self.too_stale = 0
+        self.refresh_seconds_total = 0.0
+        self.refresh_seconds_max = 0.0
+        self._pending_commits = 0
+        self._generation = 0
+        self._source = None
+        self._checked_out = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock() # one refresh at a time (thread or refresh())
+        self._wake = threading.Event()
+        self._thread = None
+        self._stop = None
+        os.makedirs(self.directory, exist_ok=True)
+        self._remove_leftovers()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _remove_leftovers(self):
+        # Copies left behind by a previous process are never reused.
+        for name in os.listdir(self.directory):
+            if name.startswith(self.prefix) and '.snapshot-' in name:
+                _remove(os.path.join(self.directory, name))
+
+    # --- Reads ---
+
+    def acquire(self, max_staleness, timeout=None):
+        # (connection, snapshot) from the least busy replica within max_staleness seconds, or None.
+        with self._lock:
+            candidates = [s for s in self.replicas if s is not None and s.age <= max_staleness]
+            if not candidates:
+                self.too_stale += 1
+                return None
+            snapshot = min(candidates, key=lambda s: (s.in_use, s.age))
+            snapshot.in_use += 1
+        try:
+            conn = snapshot.pool.acquire(timeout=timeout)
+        except Exception:
+            self._done_with(snapshot)
+            raise
+        with self._lock:
+            self._checked_out[id(conn)] = snapshot
+            self.served += 1
+        return conn, snapshot
+
+    def release(self, conn):
+        with self._lock:
+            snapshot = self._checked_out.pop(id(conn))
+        snapshot.pool.release(conn)
+        self._done_with(snapshot)
+
+    def _done_with(self, snapshot):
+        with self._lock:
+            snapshot.in_use -= 1
+            discard = snapshot.retired and snapshot.in_use == 0
+        if discard:
+            self._discard(snapshot)
+
+    def _discard(self, snapshot):
+        snapshot.pool.close()
+        _remove(snapshot.path)
+
+    # --- Refreshes ---
+
+    def record_commit(self, count=1):
+        # Called by the application after each successful write.
+        with self._lock:
+            self._pending_commits += count
+            if self.commits and self._pending_commits >= self.commits:
+                self._wake.set()
+
+    def _data_version(self):
+        if self._source is None:
+            self._source = sqlite3.connect(self.database, check_same_thread=False)
+            self._source.execute("PRAGMA busy_timeout = 5000;")
+        return self._source.execute("PRAGMA data_version;").fetchone()[0]
+
+    def refresh(self, replica=None):
+        """Refresh one replica (by default the stalest, or an empty slot) and return its snapshot."""
+        with self._refresh_lock:
+            started = time.perf_counter()
+            taken_at = time.time()
+            with self._lock:
+                if replica is None:
+                    replica = min(range(len(self.replicas)),
+                                  key=lambda i: self.replicas[i].taken_at if self.replicas[i] else float('-inf'))
+                current = self.replicas[replica]
+                self._pending_commits = 0
+            version = self._data_version()
+            if current is not None and current.data_version == version:
+                current.taken_at = taken_at
+                self.unchanged += 1
+                return current
+
+            self._generation += 1
+            path = os.path.join(self.directory, f'{self.prefix}{replica}.{self._generation}.snapshot-db')
+            self._copy(path)
+            pool = ConnectionPool(path, self.read_pool_size, self.pragmas, read_only=True,
+                                  name=f'snapshot-{replica}', **self.options)
+            snapshot = Snapshot(replica, path, taken_at, version, pool)
+            with self._lock:
+                previous, self.replicas[replica] = self.replicas[replica], snapshot
+                if previous is not None:
+                    previous.retired = True
+                    discard = previous.in_use == 0
+            if previous is not None and discard:
+                self._discard(previous)
+
+            elapsed = time.perf_counter() - started
+            self.refreshes += 1
+            self.refresh_seconds_total += elapsed
+            self.refresh_seconds_max = max(self.refresh_seconds_max, elapsed)
+            return snapshot
+
+    def _copy(self, path):
+        # One backup step: a single consistent read of the primary, restarted by nothing.
+        dest = sqlite3.connect(path)
+        try:
+            self._source.backup(dest)
+            dest.execute("PRAGMA journal_mode = DELETE;")
+        except sqlite3.Error:
+            dest.close()
+            _remove(path)
+            raise
+        dest.close()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return False
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop,), name='snapshot-refresh', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        with self._lock:
+            thread, stop = self._thread, self._stop
+            self._thread = self._stop = None
+        if thread is not None:
+            stop.set()
+            self._wake.set()
+            thread.join()
+
+    def _run(self, stop):
+        # Every replica is taken right away, then refreshed in turn: with n replicas one of
+        # them is refreshed every interval / n seconds, so the freshest is never older than that.
+        for replica in range(len(self.replicas)):
+            self._refresh_logged(replica)
+        while not stop.is_set():
+            self._wake.wait(self.interval / len(self.replicas))
+            self._wake.clear()
+            if not stop.is_set():
+                self._refresh_logged()
+
+    def _refresh_logged(self, replica=None):
+        try:
+            self.refresh(replica)
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"Database error during snapshot refresh: {e}")
+
+    def close(self):
+        self.stop()
+        with self._refresh_lock, self._lock:
+            snapshots = [s for s in self.replicas if s is not None]
+            self.replicas = [None] * len(self.replicas)
+            for snapshot in snapshots:
+                snapshot.retired = True
+            if self._source is not None:
+                self._source.close()
+                self._source = None
+        for snapshot in snapshots:
+            if snapshot.in_use == 0:
+                self._discard(snapshot)
+
+    def status(self):
+        with self._lock:
+            replicas = [{'replica': s.replica, 'age_seconds': round(s.age, 3), 'in_use': s.in_use,
+                         'file_bytes': _size(s.path)}
+                        for s in self.replicas if s is not None]
+            return {
+                'running': self.running,
+                'replicas': replicas,
+                'interval': self.interval,
+                'commits': self.commits,
+                'pending_commits': self._pending_commits,
+                'refreshes': self.refreshes,
+                'unchanged': self.unchanged,
+                'errors': self.errors,
+                'served': self.served,
+                'too_stale': self.too_stale,
+                'refresh_seconds_total': self.refresh_seconds_total,
+                'refresh_seconds_max': self.refresh_seconds_max,
+            }
+
+def _remove(path):
+    for suffix in ('', '-journal'):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
@@ -0,0 +1,203 @@
+import argparse
+import json
+import sqlite3
+import sys
+from datetime import datetime, timedelta, timezone
+
+# --- Support Tickets ---
+# Tickets filed by customers, answered through messages and triaged by agents
+# (admin-support.html). The queues are partial indexes, so reading the head of
+# a queue is one B-tree descent whatever the number of tickets:
+#   * the work queue holds the open (unassigned) tickets in handling order:
+#     premium customers first, then priority, then the SLA deadline. Claiming
+#     the next ticket is a single UPDATE of the first entry;
+#   * tickets.premium copies "the customer has an active subscription to a
+#     service with priority_support". It is set when the ticket is filed and
+#     kept current by triggers on user_services and services (migrations.py),
+#     so the queue never joins the subscriptions;
+#   * sla_due_at is the first-response deadline, fixed when the ticket is
+#     filed (SLA_HOURS by priority, PREMIUM_SLA_HOURS for premium customers).
+#     Tickets no agent has answered yet form the SLA queue, ordered by deadline;
+#   * bulk assignment and closing are one UPDATE over a json_each() list of ids.
+# Timestamps are UTC ISO 8601 strings, which sort like the instants they encode.
+#   python tickets.py --database extended_database.db [--queue 20] [--breached]
+
+PRIORITIES = ('urgent', 'high', 'normal', 'low') # stored as the index: 0 = most urgent
+SLA_HOURS = (4, 8, 24, 72)
+PREMIUM_SLA_HOURS = (1, 2, 4, 8)
+
+OPEN = 'open' # waiting in the work queue
+ASSIGNED = 'assigned'
+CLOSED = 'closed'
+
+TICKET_COLUMNS = ('id', 'user_id', 'subscription_id', 'subject', 'status', 'priority', 'premium', 'assignee',
+                  'created_at', 'updated_at', 'sla_due_at', 'responded_at', 'closed_at')
+MESSAGE_COLUMNS = ('id', 'ticket_id', 'agent', 'body', 'created_at')
+SELECT_TICKETS = f"SELECT {', '.join(TICKET_COLUMNS)} FROM tickets"
+
+# Handling order of the work queue, the key of idx_tickets_queue.
+QUEUE_ORDER = "premium DESC, priority, sla_due_at, id"
+
+# Whether user {user} currently has priority support; evaluated when a ticket is
+# filed and by the triggers, never per ticket when reading a queue.
+PREMIUM_SUPPORT = ("EXISTS (SELECT 1 FROM user_services us JOIN services s ON s.id = us.service_id "
+                   "WHERE us.user_id = {user} AND us.active = 1 AND s.priority_support = 1)")
+
+def utc_now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def sla_deadline(opened_at, priority, premium):
+    hours = (PREMIUM_SLA_HOURS if premium else SLA_HOURS)[priority]
+    opened = datetime.strptime(opened_at, '%Y-%m-%dT%H:%M:%SZ')
+    return (opened + timedelta(hours=hours)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def parse_priority(value):
+    # Accepts a name or its index; raises ValueError.
+    if value in PRIORITIES:
+        return PRIORITIES.index(value)
+    if isinstance(value, int) and not isinstance(value, bool) and 0 <= value < len(PRIORITIES):
+        return value
+    raise ValueError(f"priority must be one of: {', '.join(PRIORITIES)}")
+
+def row_to_ticket(row):
+    ticket = dict(zip(TICKET_COLUMNS, row))
+    ticket['priority'] = PRIORITIES[ticket['priority']]
+    return ticket
+
+def tickets_where(conn, where, params=(), order='id', limit=None):
+    query = f"{SELECT_TICKETS} WHERE {where} ORDER BY {order}"
+    if limit is not None:
+        query += " LIMIT ?"
+        params = (*params, limit)
+    return [row_to_ticket(row) for row in conn.execute(query + ";", params)]
+
+# --- Reads ---
+
+def get_ticket(conn, ticket_id, user_id=None):
+    # Ticket with its messages, None if unknown (or not filed by user_id, when given).
+    where, params = "id = ?", (ticket_id,)
+    if user_id is not None:
+        where, params = "id = ? AND user_id = ?", (ticket_id, user_id)
+    found = tickets_where(conn, where, params)
+    if not found:
+        return None
+    ticket = found[0]
+    ticket['messages'] = [dict(zip(MESSAGE_COLUMNS, row)) for row in conn.execute(
+        f"SELECT {', '.join(MESSAGE_COLUMNS)} FROM ticket_messages WHERE ticket_id = ? ORDER BY id;", (ticket_id,))]
+    return ticket
+
+def user_tickets(conn, user_id):
+    return tickets_where(conn, "user_id = ?", (user_id,), order='id DESC')
+
+def work_queue(conn, limit=20):
+    # The next open tickets, in the order claim_next() hands them out.
+    return tickets_where(conn, f"status = '{OPEN}'", order=QUEUE_ORDER, limit=limit)
+
+def sla_queue(conn, limit=20, before=None):
+    # Unanswered tickets by first-response deadline; with `before`, only the deadlines earlier than it.
+    where, params = f"responded_at IS NULL AND status <> '{CLOSED}'", ()
+    if before is not None:
+        where, params = where + " AND sla_due_at < ?", (before,)
+    return tickets_where(conn, where, params, order='sla_due_at, id', limit=limit)
+
+def agent_tickets(conn, assignee, limit=100):
+    return tickets_where(conn, f"assignee = ? AND status = '{ASSIGNED}'", (assignee,), order='sla_due_at, id',
+                         limit=limit)
+
+def ticket_state(conn, ticket_id):
+    # Only called on the failure path of a mutation: (user_id, status), None for an unknown ticket.
+    return conn.execute("SELECT user_id, status FROM tickets WHERE id = ?;", (ticket_id,)).fetchone()
+
+# --- Mutations ---
+# fn(conn, ...) in the caller's transaction (app.run_write).
+
+def open_ticket(conn, user_id, subject, body, priority=2, subscription_id=None, now=None):
+    """Files a ticket with its first message; returns (ticket_id, sla_due_at).
+
+    Raises LookupError for a subscription of another user, sqlite3.IntegrityError for an unknown user.
+    """
+    now = now or utc_now()
+    if subscription_id is not None and conn.execute(
+            "SELECT 1 FROM user_services WHERE id = ? AND user_id = ?;", (subscription_id, user_id)).fetchone() is None:
+        raise LookupError('Subscription not found')
+    premium = conn.execute(f"SELECT {PREMIUM_SUPPORT.format(user='?')};", (user_id,)).fetchone()[0]
+    due = sla_deadline(now, priority, premium)
+    ticket_id = conn.execute(
+        "INSERT INTO tickets (user_id, subscription_id, subject, priority, premium, created_at, updated_at, sla_due_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?) RETURNING id;",
+        (user_id, subscription_id, subject, priority, premium, now, now, due)
+    ).fetchone()[0]
+    conn.execute("INSERT INTO ticket_messages (ticket_id, body, created_at) VALUES (?, ?, ?);", (ticket_id, body, now))
+    return ticket_id, due
+
+def add_message(conn, ticket_id, body, agent=None, user_id=None, now=None):
+    # Customer message (agent None, ticket filed by user_id) or agent answer, which meets the SLA.
+    # Returns the message id, None when the ticket is unknown, not the user's, or closed.
+    now = now or utc_now()
+    query = "UPDATE tickets SET updated_at = ?"
+    params = [now]
+    if agent is not None:
+        query += ", responded_at = COALESCE(responded_at, ?)"
+        params.append(now)
+    query += f" WHERE id = ? AND status <> '{CLOSED}'"
+    params.append(ticket_id)
+    if user_id is not None:
+        query += " AND user_id = ?"
+        params.append(user_id)
+    if conn.execute(query + " RETURNING id;", params).fetchone() is None:
+        return None
+    return conn.execute("INSERT INTO ticket_messages (ticket_id, agent, body, created_at) VALUES (?, ?, ?, ?) "
+                        "RETURNING id;", (ticket_id, agent, body, now)).fetchone()[0]
+
+def claim_next(conn, assignee, now=None):
+    # Assigns the head of the work queue to `assignee`; returns the ticket, None if the queue is empty.
+    row = conn.execute(
+        f"UPDATE tickets SET status = '{ASSIGNED}', assignee = ?, updated_at = ? WHERE id = "
+        f"(SELECT id FROM tickets WHERE status = '{OPEN}' ORDER BY {QUEUE_ORDER} LIMIT 1) "
+        f"RETURNING {', '.join(TICKET_COLUMNS)};",
+        (assignee, now or utc_now())
+    ).fetchone()
+    return row_to_ticket(row) if row is not None else None
+
+def assign_tickets(conn, ticket_ids, assignee, now=None):
+    # One statement for the whole list; assignee None puts the tickets back in the work queue.
+    # Closed and unknown tickets are left out. Returns the ids updated.
+    return [row[0] for row in conn.execute(
+        f"UPDATE tickets SET assignee = ?1, status = CASE WHEN ?1 IS NULL THEN '{OPEN}' ELSE '{ASSIGNED}' END, "
+        f"updated_at = ?2 WHERE id IN (SELECT value FROM json_each(?3)) AND status <> '{CLOSED}' RETURNING id;",
+        (assignee, now or utc_now(), json.dumps(ticket_ids))
+    )]
+
+def close_tickets(conn, ticket_ids, now=None):
+    # Returns the ids closed; tickets already closed or unknown are left out.
+    now = now or utc_now()
+    return [row[0] for row in conn.execute(
+        f"UPDATE tickets SET status = '{CLOSED}', closed_at = ?1, updated_at = ?1 "
+        f"WHERE id IN (SELECT value FROM json_each(?2)) AND status <> '{CLOSED}' RETURNING id;",
+        (now, json.dumps(ticket_ids))
+    )]
+
+# --- Command Line Interface ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show the support work queue and the SLA queue.")
+    parser.add_argument('--database', default='extended_database.db')
+    parser.add_argument('--queue', type=int, default=20, help="Number of tickets to list")
+    parser.add_argument('--breached', action='store_true',
+                        help="List the unanswered tickets past their SLA deadline instead of the work queue")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.database)
+    try:
+        if args.breached:
+            tickets = sla_queue(conn, args.queue, before=utc_now())
+        else:
+            tickets = work_queue(conn, args.queue)
+    finally:
+        conn.close()
+    for ticket in tickets:
+        print(json.dumps(ticket))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())